@@ -15,7 +15,8 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from typing import Any
+from typing import Any, Awaitable, Callable
+from contextlib import nullcontext
 from time import time
 import asyncio
 
@@ -35,6 +36,7 @@ from .portal import Portal
 from .puppet import Puppet
 from .telemetry import TelemetryService
 from .user import User
+from .util import image_executor
 from .version import linkified_version, version
 from .web.provisioning import ProvisioningAPI
 from .web.public import PublicBridgeWebsite
@@ -54,6 +56,15 @@ METRIC_AS_CONNECTIONS = Gauge(
 METRIC_BOT_STARTUP_OK = Gauge(
     "bridge_bot_startup_ok", "Whether or not the configured Telegram started up correctly"
 )
+METRIC_STARTUP_USERS = Gauge(
+    "bridge_startup_users", "Number of logged-in users to start at startup", ["tier"]
+)
+METRIC_STARTUP_USERS_STARTED = Gauge(
+    "bridge_startup_users_started", "Number of users started so far at startup", ["tier"]
+)
+METRIC_STARTUP_ACTIVE_SECONDS = Gauge(
+    "bridge_startup_active_users_seconds", "Time it took to start all recently active users"
+)
 
 
 class TelegramBridge(Bridge):
@@ -88,6 +99,7 @@ class TelegramBridge(Bridge):
     latest_telegram_update_timestamp: float | None = None
 
     as_connection_metric_task: asyncio.Task | None = None
+    dormant_user_start_task: asyncio.Task | None = None
 
     def prepare_db(self) -> None:
         super().prepare_db()
@@ -168,21 +180,63 @@ class TelegramBridge(Bridge):
         if self.config["bridge.limits.enable_activity_tracking"]:
             self.periodic_sync_task = self.loop.create_task(self._loop_active_puppet_metric())
 
-        semaphore = None
+        await self._start_users()
+
+    async def _start_users(self) -> None:
         concurrency = self.config["telegram.connection.concurrent_connections_startup"]
-        if concurrency:
-            semaphore = asyncio.Semaphore(concurrency)
-            await semaphore.acquire()
-
-        async def sem_task(task):
-            if not semaphore:
-                return await task
-            async with semaphore:
-                return await task
-
-        await asyncio.gather(
-            *[sem_task(user.try_ensure_started()) async for user in User.all_with_tgid()]
-        )
+        active_days = self.config["telegram.connection.startup_active_days"]
+        dormant_rate = self.config["telegram.connection.startup_dormant_rate"]
+        semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+
+        users = await User.all_with_tgid_by_activity()
+        active_since = time() - active_days * 24 * 60 * 60
+        active = [
+            user for user, activity in users if not active_days or (activity or 0) >= active_since
+        ]
+        dormant = [
+            user for user, activity in users if active_days and (activity or 0) < active_since
+        ]
+        METRIC_STARTUP_USERS.labels(tier="active").set(len(active))
+        METRIC_STARTUP_USERS.labels(tier="dormant").set(len(dormant))
+        METRIC_STARTUP_USERS_STARTED.labels(tier="active").set(0)
+        METRIC_STARTUP_USERS_STARTED.labels(tier="dormant").set(0)
+
+        async def start_user(user: User, tier: str) -> None:
+            async with semaphore or nullcontext():
+                await user.try_ensure_started()
+            METRIC_STARTUP_USERS_STARTED.labels(tier=tier).inc()
+
+        # Users are sorted by activity and the semaphore is fair, so the most recently active
+        # users are connected first.
+        self.log.info(f"Starting {len(active)} active users ({len(dormant)} dormant users)")
+        start = time()
+        await asyncio.gather(*(start_user(user, "active") for user in active))
+        METRIC_STARTUP_ACTIVE_SECONDS.set(time() - start)
+        self.log.info(f"Started {len(active)} active users in {time() - start:.1f} seconds")
+
+        if dormant and dormant_rate > 0:
+            self.dormant_user_start_task = self.loop.create_task(
+                self._start_dormant_users(dormant, dormant_rate, start_user)
+            )
+        elif dormant:
+            self.log.info("Dormant users will be started when they next use the bridge")
+
+    async def _start_dormant_users(
+        self,
+        users: list[User],
+        rate: float,
+        start_user: Callable[[User, str], Awaitable[None]],
+    ) -> None:
+        tasks = []
+        for user in users:
+            # Users who used the bridge in the meantime have already been started on demand
+            if not user.client:
+                tasks.append(asyncio.create_task(start_user(user, "dormant")))
+                await asyncio.sleep(1 / rate)
+            else:
+                METRIC_STARTUP_USERS_STARTED.labels(tier="dormant").inc()
+        await asyncio.gather(*tasks)
+        self.log.info(f"Finished starting {len(users)} dormant users")
 
     async def resend_bridge_info(self) -> None:
         self.config["bridge.resend_bridge_info"] = False
@@ -197,12 +251,18 @@ class TelegramBridge(Bridge):
             self.periodic_sync_task.cancel()
         if self.as_connection_metric_task:
             self.as_connection_metric_task.cancel()
+        if self.dormant_user_start_task:
+            self.dormant_user_start_task.cancel()
         if self.as_bridge_liveness_task:
             self.as_bridge_liveness_task.cancel()
         self.add_shutdown_actions(user.stop() for user in User.by_tgid.values())
         if self.bot:
             self.add_shutdown_actions(self.bot.stop())
 
+    async def stop(self) -> None:
+        await super().stop()
+        image_executor.shutdown()
+
     async def get_user(self, user_id: UserID, create: bool = True) -> User | None:
         user = await User.get_by_mxid(user_id, create=create)
         if user:
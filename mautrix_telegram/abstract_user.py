@@ -15,8 +15,9 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Union
+from typing import TYPE_CHECKING, Any, Tuple, Union
 from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
 import asyncio
 import logging
 import platform
@@ -39,6 +40,7 @@ from telethon.tl.types import (
     PeerChat,
     PeerUser,
     PhoneCallRequested,
+    TypePeer,
     TypeUpdate,
     UpdateBotMessageReaction,
     UpdateChannel,
@@ -75,14 +77,14 @@ from telethon.tl.types import (
     UserStatusOnline,
 )
 
-from mautrix.appservice import AppService
+from mautrix.appservice import AppService, IntentAPI
 from mautrix.errors import MatrixError
-from mautrix.types import PresenceState, UserID
+from mautrix.types import EventID, PresenceState, RoomID, UserID
 from mautrix.util import background_task
 from mautrix.util.logging import TraceLogger
-from mautrix.util.opt_prometheus import Counter, Histogram
+from mautrix.util.opt_prometheus import Counter, Gauge, Histogram
 
-from . import __version__, portal as po, puppet as pu
+from . import __version__, portal as po, puppet as pu, util
 from .config import Config
 from .db import Message as DBMessage, PgSession
 from .tgclient import MautrixTelegramClient
@@ -103,6 +105,11 @@ UpdateMessage = Union[
 UpdateMessageContent = Union[
     UpdateShortMessage, UpdateShortChatMessage, Message, MessageService, MessageEmpty
 ]
+UpdateQueueKey = Union[Tuple[TelegramID, TelegramID], None]
+
+# Number of recent non-channel message IDs to remember the dispatch queue of, so that
+# deletions (which don't include the chat) can be ordered after the message they delete.
+RECENT_MESSAGE_QUEUE_KEYS = 10000
 
 UPDATE_TIME = Histogram(
     name="bridge_telegram_update",
@@ -114,6 +121,15 @@ UPDATE_ERRORS = Counter(
     documentation="Number of fatal errors while handling Telegram updates",
     labelnames=("update_type",),
 )
+UPDATE_QUEUE_DEPTH = Gauge(
+    name="bridge_telegram_update_queue_depth",
+    documentation="Number of Telegram updates waiting in per-portal dispatch queues",
+)
+UPDATE_QUEUE_WAIT = Histogram(
+    name="bridge_telegram_update_queue_wait",
+    documentation="Time Telegram updates spend in per-portal dispatch queues before handling",
+    labelnames=("update_type",),
+)
 
 
 class AbstractUser(ABC):
@@ -125,6 +141,8 @@ class AbstractUser(ABC):
     relaybot: Bot | None
     ignore_incoming_bot_events: bool = True
     max_deletions: int = 10
+    max_concurrent_redactions: int = 5
+    update_dispatch_workers: int = 0
 
     client: MautrixTelegramClient | None
     mxid: UserID | None
@@ -141,7 +159,22 @@ class AbstractUser(ABC):
     matrix_puppet_whitelisted: bool
     is_admin: bool
 
+    _update_queues: dict[UpdateQueueKey, deque[tuple[float, TypeUpdate]]]
+    _update_worker_sema: asyncio.Semaphore | None
+    _update_worker_tasks: set[asyncio.Task]
+    _update_drain_tasks: set[asyncio.Task]
+    _recent_message_queue_keys: OrderedDict[TelegramID, UpdateQueueKey]
+
     def __init__(self) -> None:
+        self._update_queues = {}
+        self._update_worker_tasks = set()
+        self._update_drain_tasks = set()
+        self._recent_message_queue_keys = OrderedDict()
+        self._update_worker_sema = (
+            asyncio.Semaphore(self.update_dispatch_workers)
+            if self.update_dispatch_workers > 0
+            else None
+        )
         self.is_admin = False
         self.matrix_puppet_whitelisted = False
         self.puppet_whitelisted = False
@@ -188,6 +221,32 @@ class AbstractUser(ABC):
         cls.az = bridge.az
         cls.ignore_incoming_bot_events = cls.config["bridge.relaybot.ignore_own_incoming_events"]
         cls.max_deletions = cls.config["bridge.max_telegram_delete"]
+        cls.max_concurrent_redactions = max(cls.config["bridge.max_concurrent_redactions"], 1)
+        cls.update_dispatch_workers = cls.config["telegram.update_dispatch.workers"]
+        PgSession.entity_cache_size = cls.config["telegram.entity_cache_size"]
+        PgSession.update_state_flush_interval = cls.config["telegram.update_state_flush.interval"]
+        PgSession.update_state_flush_max_pending = cls.config[
+            "telegram.update_state_flush.max_pending"
+        ]
+        util.transfer_scheduler.global_limit = max(
+            cls.config["bridge.transfer_connections.global"], 1
+        )
+        util.transfer_scheduler.per_dc_limit = max(
+            cls.config["bridge.transfer_connections.per_dc"], 1
+        )
+        util.transfer_scheduler.backfill_limit = max(
+            cls.config["bridge.transfer_connections.backfill"], 1
+        )
+        util.image_executor.configure(
+            kind=cls.config["bridge.image_processing.executor"],
+            workers=cls.config["bridge.image_processing.workers"],
+            max_queue=cls.config["bridge.image_processing.max_queue"],
+            timeout=cls.config["bridge.image_processing.timeout"],
+        )
+        util.sticker_converter.configure(
+            max_concurrent=cls.config["bridge.sticker_conversion.max_concurrent"],
+            cache_size=cls.config["bridge.sticker_conversion.cache_size"],
+        )
 
     async def _init_client(self) -> None:
         self.log.debug(f"Initializing client for {self.name}")
@@ -295,6 +354,145 @@ class AbstractUser(ABC):
         raise NotImplementedError()
 
     async def _update_catch(self, update: TypeUpdate) -> None:
+        if not self._update_worker_sema:
+            await self._handle_update(update)
+            return
+        inner_update = update.update if isinstance(update, UpdateShort) else update
+        if isinstance(inner_update, UpdateDeleteMessages):
+            for key, delete_update in self._split_delete_update(inner_update):
+                self._enqueue_update(key, delete_update)
+            return
+        key = self._get_update_queue_key(update)
+        self._remember_message_queue_key(inner_update, key)
+        self._enqueue_update(key, update)
+
+    def _enqueue_update(self, key: UpdateQueueKey, update: TypeUpdate) -> None:
+        queue = self._update_queues.get(key)
+        if queue is None:
+            queue = self._update_queues[key] = deque()
+            task = background_task.create(self._drain_update_queue(key, queue))
+            self._update_drain_tasks.add(task)
+            task.add_done_callback(self._update_drain_tasks.discard)
+        queue.append((time.time(), update))
+        UPDATE_QUEUE_DEPTH.inc()
+
+    def _remember_message_queue_key(self, update: TypeUpdate, key: UpdateQueueKey) -> None:
+        if isinstance(update, UpdateNewMessage):
+            message_id = update.message.id
+        elif isinstance(update, (UpdateShortMessage, UpdateShortChatMessage)):
+            message_id = update.id
+        else:
+            return
+        self._recent_message_queue_keys[TelegramID(message_id)] = key
+        self._recent_message_queue_keys.move_to_end(TelegramID(message_id))
+        while len(self._recent_message_queue_keys) > RECENT_MESSAGE_QUEUE_KEYS:
+            self._recent_message_queue_keys.popitem(last=False)
+
+    def _split_delete_update(
+        self, update: UpdateDeleteMessages
+    ) -> list[tuple[UpdateQueueKey, UpdateDeleteMessages]]:
+        """
+        Route a deletion to the queues of the chats its messages were recently received in.
+        Messages that weren't seen recently were already handled, so they go to the shared queue.
+        """
+        if len(update.messages) > self.max_deletions:
+            # Too large deletions are ignored entirely, so don't split them into allowed ones
+            return [(None, update)]
+        message_ids: dict[UpdateQueueKey, list[int]] = {}
+        for message_id in update.messages:
+            key = self._recent_message_queue_keys.get(TelegramID(message_id))
+            message_ids.setdefault(key, []).append(message_id)
+        if len(message_ids) == 1:
+            return [(next(iter(message_ids)), update)]
+        return [
+            (key, UpdateDeleteMessages(messages=ids, pts=update.pts, pts_count=update.pts_count))
+            for key, ids in message_ids.items()
+        ]
+
+    async def _drain_update_queue(
+        self, key: UpdateQueueKey, queue: deque[tuple[float, TypeUpdate]]
+    ) -> None:
+        task = asyncio.current_task()
+        try:
+            while queue:
+                async with self._update_worker_sema:
+                    queued_at, update = queue.popleft()
+                    UPDATE_QUEUE_DEPTH.dec()
+                    UPDATE_QUEUE_WAIT.labels(update_type=type(update).__name__).observe(
+                        time.time() - queued_at
+                    )
+                    self._update_worker_tasks.add(task)
+                    try:
+                        await self._handle_update(update)
+                    finally:
+                        self._update_worker_tasks.discard(task)
+        finally:
+            if self._update_queues.get(key) is queue:
+                del self._update_queues[key]
+            if queue:
+                UPDATE_QUEUE_DEPTH.dec(len(queue))
+
+    def _peer_queue_key(self, peer: TypePeer) -> UpdateQueueKey:
+        if isinstance(peer, PeerUser):
+            return TelegramID(peer.user_id), self.tgid
+        elif isinstance(peer, PeerChat):
+            return TelegramID(peer.chat_id), TelegramID(peer.chat_id)
+        elif isinstance(peer, PeerChannel):
+            return TelegramID(peer.channel_id), TelegramID(peer.channel_id)
+        return None
+
+    def _get_update_queue_key(self, update: TypeUpdate) -> UpdateQueueKey:
+        """
+        Find the ``tgid_full`` of the portal an update belongs to without touching the database.
+        Updates that aren't tied to a single chat share the ``None`` queue.
+        """
+        if isinstance(update, UpdateShort):
+            update = update.update
+        if isinstance(
+            update,
+            (
+                UpdateNewMessage,
+                UpdateNewChannelMessage,
+                UpdateEditMessage,
+                UpdateEditChannelMessage,
+            ),
+        ):
+            return self._peer_queue_key(getattr(update.message, "peer_id", None))
+        elif isinstance(update, (UpdateShortMessage, UpdateUserTyping)):
+            return TelegramID(update.user_id), self.tgid
+        elif isinstance(update, (UpdateShortChatMessage, UpdateChatUserTyping)):
+            return TelegramID(update.chat_id), TelegramID(update.chat_id)
+        elif isinstance(update, UpdateChatParticipantAdmin):
+            return TelegramID(update.chat_id), TelegramID(update.chat_id)
+        elif isinstance(update, UpdateChatParticipants):
+            chat_id = TelegramID(update.participants.chat_id)
+            return chat_id, chat_id
+        elif isinstance(
+            update,
+            (
+                UpdateDeleteChannelMessages,
+                UpdateChannelUserTyping,
+                UpdatePinnedChannelMessages,
+                UpdateReadChannelInbox,
+                UpdateChannel,
+            ),
+        ):
+            return TelegramID(update.channel_id), TelegramID(update.channel_id)
+        elif isinstance(
+            update,
+            (
+                UpdateMessageReactions,
+                UpdateBotMessageReaction,
+                UpdatePinnedMessages,
+                UpdateChatDefaultBannedRights,
+                UpdateReadHistoryOutbox,
+                UpdateReadHistoryInbox,
+            ),
+        ):
+            return self._peer_queue_key(update.peer)
+        return None
+
+    async def _handle_update(self, update: TypeUpdate) -> None:
         start_time = time.time()
         update_type = type(update).__name__
         try:
@@ -356,6 +554,20 @@ class AbstractUser(ABC):
         if self.client:
             await self.client.disconnect()
             self.client = None
+        await self._stop_update_dispatch()
+
+    async def _stop_update_dispatch(self) -> None:
+        # stop() may be called from an update handler (e.g. on logout), don't cancel that one
+        current_task = asyncio.current_task()
+        tasks = [task for task in self._update_drain_tasks if task is not current_task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for queue in self._update_queues.values():
+            UPDATE_QUEUE_DEPTH.dec(len(queue))
+            queue.clear()
+        self._update_queues.clear()
+        self._recent_message_queue_keys.clear()
 
     # region Telegram update handling
 
@@ -618,41 +830,54 @@ class AbstractUser(ABC):
             return update, None, None
         return update, sender, portal
 
-    @staticmethod
-    async def _try_redact(message: DBMessage) -> None:
-        portal = await po.Portal.get_by_mxid(message.mx_room)
-        if not portal:
-            return
-        try:
-            await portal.main_intent.redact(message.mx_room, message.mxid)
-        except MatrixError:
-            pass
+    async def _redact_deleted(self, messages: list[DBMessage]) -> None:
+        by_room: dict[RoomID, list[EventID]] = {}
+        for message in messages:
+            by_room.setdefault(message.mx_room, []).append(message.mxid)
+        sema = asyncio.Semaphore(self.max_concurrent_redactions)
+
+        async def redact(intent: IntentAPI, room_id: RoomID, event_id: EventID) -> None:
+            async with sema:
+                try:
+                    await intent.redact(room_id, event_id)
+                except MatrixError:
+                    pass
+
+        redactions = []
+        for room_id, event_ids in by_room.items():
+            portal = await po.Portal.get_by_mxid(room_id)
+            if not portal:
+                continue
+            for event_id in event_ids:
+                portal.recent_events.remove(event_id)
+            redactions += [redact(portal.main_intent, room_id, event_id) for event_id in event_ids]
+        await asyncio.gather(*redactions)
 
     async def delete_message(self, update: UpdateDeleteMessages) -> None:
         if len(update.messages) > self.max_deletions:
             return
 
-        for message_id in update.messages:
-            for message in await DBMessage.get_all_by_tgid(TelegramID(message_id), self.tgid):
-                if message.redacted:
-                    continue
-                await message.delete()
-                number_left = await DBMessage.count_spaces_by_mxid(message.mxid, message.mx_room)
-                if number_left == 0:
-                    await self._try_redact(message)
+        deleted = await DBMessage.delete_many_by_tgid(
+            [TelegramID(message_id) for message_id in update.messages], self.tgid
+        )
+        # Messages in normal chats and DMs are bridged once for each Telegram user in the chat,
+        # so only redact the ones that aren't referenced by any other user's message space.
+        still_referenced = await DBMessage.find_referenced_mxids(
+            list({message.mxid for message in deleted})
+        )
+        await self._redact_deleted(
+            [msg for msg in deleted if (msg.mxid, msg.mx_room) not in still_referenced]
+        )
 
     async def delete_channel_message(self, update: UpdateDeleteChannelMessages) -> None:
         if len(update.messages) > self.max_deletions:
             return
 
-        channel_id = TelegramID(update.channel_id)
-
-        for message_id in update.messages:
-            for message in await DBMessage.get_all_by_tgid(TelegramID(message_id), channel_id):
-                if message.redacted:
-                    continue
-                await message.delete()
-                await self._try_redact(message)
+        deleted = await DBMessage.delete_many_by_tgid(
+            [TelegramID(message_id) for message_id in update.messages],
+            TelegramID(update.channel_id),
+        )
+        await self._redact_deleted(deleted)
 
     async def update_reactions(self, update: UpdateMessageReactions) -> None:
         portal = await po.Portal.get_by_entity(update.peer, tg_receiver=self.tgid)
@@ -758,7 +983,9 @@ class AbstractUser(ABC):
             return
 
         task = self._call_portal_message_handler(update, original_update, portal, sender)
-        if portal.backfill_lock.locked:
+        # With per-portal dispatch queues, the worker slot is released while waiting for the
+        # backfill lock, so only this chat is blocked
+        if portal.backfill_lock.locked and not self._update_worker_sema:
             self.log.debug(
                 f"{portal.tgid_log} is backfill locked, moving incoming message to async task"
             )
@@ -766,6 +993,36 @@ class AbstractUser(ABC):
         else:
             await task
 
+    async def _wait_for_backfill(self, portal: po.Portal, task_name: str) -> None:
+        if not portal.backfill_lock.locked:
+            return
+        task = asyncio.current_task()
+        if task not in self._update_worker_tasks:
+            await portal.backfill_lock.wait(task_name)
+            return
+        # Let other chats use the dispatch worker slot while this chat is waiting for its
+        # backfill. The rest of this chat's queue still waits, so the order is kept.
+        self._update_worker_tasks.discard(task)
+        self._update_worker_sema.release()
+        try:
+            await portal.backfill_lock.wait(task_name)
+        finally:
+            await self._reacquire_update_worker_slot()
+            self._update_worker_tasks.add(task)
+
+    async def _reacquire_update_worker_slot(self) -> None:
+        # The caller's ``async with`` releases the slot, so it must be taken back even if this
+        # task is cancelled while waiting for it. The cancellation is re-raised afterwards.
+        acquire = asyncio.ensure_future(self._update_worker_sema.acquire())
+        cancelled = False
+        while not acquire.done():
+            try:
+                await asyncio.shield(acquire)
+            except asyncio.CancelledError:
+                cancelled = True
+        if cancelled:
+            raise asyncio.CancelledError()
+
     async def _call_portal_message_handler(
         self,
         update: UpdateMessageContent,
@@ -773,7 +1030,7 @@ class AbstractUser(ABC):
         portal: po.Portal,
         sender: pu.Puppet,
     ) -> None:
-        await portal.backfill_lock.wait(f"update {update.id}")
+        await self._wait_for_backfill(portal, f"update {update.id}")
 
         if isinstance(update, MessageService):
             if isinstance(update.action, MessageActionChannelMigrateFrom):
@@ -34,12 +34,12 @@ async def clear_db_cache(evt: CommandEvent) -> EventID:
     except IndexError:
         return await evt.reply("**Usage:** `$cmdprefix+sp clear-db-cache <section>`")
     if section == "portal":
-        po.Portal.by_tgid = {}
-        po.Portal.by_mxid = {}
+        po.Portal.by_tgid.clear()
+        po.Portal.by_mxid.clear()
         await evt.reply("Cleared portal cache")
     elif section == "puppet":
-        pu.Puppet.by_tgid = {}
-        pu.Puppet.by_custom_mxid = {}
+        pu.Puppet.by_tgid.clear()
+        pu.Puppet.by_custom_mxid.clear()
         await asyncio.gather(
             *[puppet.try_start() async for puppet in pu.Puppet.all_with_custom_mxid()]
         )
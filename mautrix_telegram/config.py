@@ -118,6 +118,7 @@ class Config(BaseBridgeConfig):
         copy("bridge.allow_contact_info")
 
         copy("bridge.max_initial_member_sync")
+        copy("bridge.member_sync_concurrency")
         copy("bridge.max_member_count")
         copy("bridge.sync_channel_members")
         copy("bridge.skip_deleted_members")
@@ -128,9 +129,12 @@ class Config(BaseBridgeConfig):
         else:
             copy("bridge.sync_update_limit")
             copy("bridge.sync_create_limit")
+        copy("bridge.sync_dialog_workers")
         copy("bridge.sync_deferred_create_all")
         copy("bridge.sync_direct_chats")
         copy("bridge.max_telegram_delete")
+        copy("bridge.max_concurrent_redactions")
+        copy("bridge.max_concurrent_reactions")
         copy("bridge.sync_matrix_state")
         copy("bridge.allow_matrix_login")
         copy("bridge.public_portals")
@@ -153,6 +157,20 @@ class Config(BaseBridgeConfig):
         copy("bridge.document_as_link_size.bot")
         copy("bridge.document_as_link_size.channel")
         copy("bridge.parallel_file_transfer")
+        copy("bridge.streaming_file_transfer.min_size")
+        copy("bridge.streaming_file_transfer.chunk_size")
+        copy("bridge.transfer_connections.global")
+        copy("bridge.transfer_connections.per_dc")
+        copy("bridge.transfer_connections.backfill")
+        copy("bridge.image_processing.executor")
+        copy("bridge.image_processing.workers")
+        copy("bridge.image_processing.max_queue")
+        copy("bridge.image_processing.timeout")
+        copy("bridge.sticker_conversion.max_concurrent")
+        copy("bridge.sticker_conversion.cache_size")
+        copy("bridge.object_cache.portals")
+        copy("bridge.object_cache.puppets")
+        copy("bridge.object_cache.min_idle")
         copy("bridge.federate_rooms")
         copy("bridge.always_custom_emoji_reaction")
         copy("bridge.animated_sticker.target")
@@ -210,6 +228,10 @@ class Config(BaseBridgeConfig):
             copy("bridge.backfill.forward_limits.sync.supergroup")
             copy("bridge.backfill.forward_limits.sync.channel")
         copy("bridge.backfill.forward_timeout")
+        copy("bridge.backfill.pipeline.convert_concurrency")
+        copy("bridge.backfill.pipeline.send_batch_size")
+        copy("bridge.backfill.workers.per_user")
+        copy("bridge.backfill.workers.global")
         copy("bridge.backfill.incremental.messages_per_batch")
         copy("bridge.backfill.incremental.post_batch_delay")
         copy("bridge.backfill.incremental.max_batches.user")
@@ -219,6 +241,14 @@ class Config(BaseBridgeConfig):
 
         copy("bridge.max_portal_rooms")
 
+        copy("bridge.deduplication.cache_size")
+        copy("bridge.deduplication.warm_size")
+        copy("bridge.read_receipt_delay")
+        copy("bridge.reply_event_cache_size")
+        copy("bridge.typing_notifications.refresh_interval")
+        copy("bridge.typing_notifications.rate_limit")
+        copy("bridge.typing_notifications.burst")
+
         copy("bridge.initial_power_level_overrides.group")
         copy("bridge.initial_power_level_overrides.user")
 
@@ -287,6 +317,10 @@ class Config(BaseBridgeConfig):
 
         copy("telegram.catch_up")
         copy("telegram.sequential_updates")
+        copy("telegram.update_dispatch.workers")
+        copy("telegram.entity_cache_size")
+        copy("telegram.update_state_flush.interval")
+        copy("telegram.update_state_flush.max_pending")
         copy("telegram.exit_on_update_error")
         copy("telegram.force_refresh_interval_seconds")
 
@@ -297,6 +331,8 @@ class Config(BaseBridgeConfig):
         copy("telegram.connection.request_retries")
         copy("telegram.connection.use_ipv6")
         copy("telegram.connection.concurrent_connections_startup")
+        copy("telegram.connection.startup_active_days")
+        copy("telegram.connection.startup_dormant_rate")
 
         copy("telegram.device_info.device_model")
         copy("telegram.device_info.system_version")
@@ -15,7 +15,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, ClassVar
+from typing import TYPE_CHECKING, Any, ClassVar, Collection
 from datetime import datetime, timedelta
 from enum import Enum
 import json
@@ -24,7 +24,7 @@ from asyncpg import Record
 from attr import dataclass
 
 from mautrix.types import UserID
-from mautrix.util.async_db import Connection, Database
+from mautrix.util.async_db import Connection, Database, Scheme
 
 from ..types import TelegramID
 
@@ -135,6 +135,58 @@ class Backfill:
             await cls.db.fetchrow(q, user_mxid, datetime.now() - timedelta(minutes=15))
         )
 
+    @classmethod
+    async def claim_next(
+        cls, user_mxid: UserID, skip_portals: Collection[TelegramID] = ()
+    ) -> Backfill | None:
+        """
+        Find the next backfill request for the given user and mark it as dispatched atomically,
+        so that concurrent workers never get the same request.
+
+        Requests for portals in ``skip_portals`` (e.g. portals that are already being backfilled
+        by another worker) are ignored.
+        """
+        now = datetime.now()
+        args: list[Any] = [user_mxid, now - timedelta(minutes=15), now]
+        if cls.db.scheme in (Scheme.POSTGRES, Scheme.COCKROACH):
+            skip_condition = "AND portal_tgid <> ALL($4)"
+            args.append(list(skip_portals))
+            lock = "FOR UPDATE SKIP LOCKED"
+        else:
+            # SQLite doesn't have row locks, but it only allows one writer at a time anyway,
+            # so the UPDATE with a subquery is atomic.
+            skip_condition = ""
+            if skip_portals:
+                placeholders = ",".join(f"${i + 4}" for i in range(len(skip_portals)))
+                skip_condition = f"AND portal_tgid NOT IN ({placeholders})"
+                args += skip_portals
+            lock = ""
+        q = f"""
+        UPDATE backfill_queue SET dispatch_time=$3
+        WHERE queue_id=(
+            SELECT queue_id
+            FROM backfill_queue
+            WHERE user_mxid=$1
+                AND (
+                    dispatch_time IS NULL
+                    OR (
+                        dispatch_time < $2
+                        AND completed_at IS NULL
+                    )
+                )
+                AND (
+                    cooldown_timeout IS NULL
+                    OR cooldown_timeout < current_timestamp
+                )
+                {skip_condition}
+            ORDER BY priority, queue_id
+            LIMIT 1
+            {lock}
+        )
+        RETURNING queue_id, {cls.columns_str}
+        """
+        return cls._from_row(await cls.db.fetchrow(q, *args))
+
     @classmethod
     async def delete_existing(
         cls,
@@ -19,7 +19,6 @@ from typing import TYPE_CHECKING, ClassVar
 
 from asyncpg import Record
 from attr import dataclass
-import attr
 
 from mautrix.types import EventID, RoomID, UserID
 from mautrix.util.async_db import Database, Scheme
@@ -29,7 +28,7 @@ from ..types import TelegramID
 fake_db = Database.create("") if TYPE_CHECKING else None
 
 
-@dataclass
+@dataclass(slots=True)
 class Message:
     db: ClassVar[Database] = fake_db
 
@@ -47,7 +46,8 @@ class Message:
     def _from_row(cls, row: Record | None) -> Message | None:
         if row is None:
             return None
-        return cls(**row)
+        # The columns are selected in field order, so the row can be passed positionally
+        return cls(*row)
 
     columns: ClassVar[str] = ", ".join(
         (
@@ -106,6 +106,40 @@ class Message:
             rows = await cls.db.fetch(q, tg_space, *tgids)
         return [cls._from_row(row) for row in rows]
 
+    @classmethod
+    async def delete_many_by_tgid(
+        cls, tgids: list[TelegramID], tg_space: TelegramID
+    ) -> list[Message]:
+        if not tgids:
+            return []
+        if cls.db.scheme in (Scheme.POSTGRES, Scheme.COCKROACH):
+            q = (
+                "DELETE FROM message WHERE tgid=ANY($1) AND tg_space=$2 AND redacted=false "
+                f"RETURNING {cls.columns}"
+            )
+            rows = await cls.db.fetch(q, tgids, tg_space)
+        else:
+            tgid_placeholders = ("?," * len(tgids)).rstrip(",")
+            q = (
+                "DELETE FROM message WHERE tg_space=? AND redacted=false "
+                f"AND tgid IN ({tgid_placeholders}) RETURNING {cls.columns}"
+            )
+            rows = await cls.db.fetch(q, tg_space, *tgids)
+        return [cls._from_row(row) for row in rows]
+
+    @classmethod
+    async def find_referenced_mxids(cls, mxids: list[EventID]) -> set[tuple[EventID, RoomID]]:
+        if not mxids:
+            return set()
+        if cls.db.scheme in (Scheme.POSTGRES, Scheme.COCKROACH):
+            q = "SELECT DISTINCT mxid, mx_room FROM message WHERE mxid=ANY($1)"
+            rows = await cls.db.fetch(q, mxids)
+        else:
+            mxid_placeholders = ("?," * len(mxids)).rstrip(",")
+            q = f"SELECT DISTINCT mxid, mx_room FROM message WHERE mxid IN ({mxid_placeholders})"
+            rows = await cls.db.fetch(q, *mxids)
+        return {(row["mxid"], row["mx_room"]) for row in rows}
+
     @classmethod
     async def count_spaces_by_mxid(cls, mxid: EventID, mx_room: RoomID) -> int:
         return (
@@ -172,6 +206,23 @@ class Message:
         """
         return [cls._from_row(row) for row in await cls.db.fetch(q, mx_room, not_sender, limit)]
 
+    @classmethod
+    async def find_recent_for_dedup(cls, mx_room: RoomID, limit: int) -> list[Message]:
+        q = f"""
+        SELECT {cls.columns} FROM message
+        WHERE mx_room=$1 AND edit_index=0
+        ORDER BY tgid DESC LIMIT $2
+        """
+        return [cls._from_row(row) for row in await cls.db.fetch(q, mx_room, limit)]
+
+    @classmethod
+    async def find_by_content_hash(cls, mx_room: RoomID, content_hash: bytes) -> Message | None:
+        q = (
+            f"SELECT {cls.columns} FROM message "
+            "WHERE mx_room=$1 AND content_hash=$2 AND edit_index=0 LIMIT 1"
+        )
+        return cls._from_row(await cls.db.fetchrow(q, mx_room, content_hash))
+
     @classmethod
     async def replace_temp_mxid(cls, temp_mxid: str, mx_room: RoomID, real_mxid: EventID) -> None:
         q = "UPDATE message SET mxid=$1 WHERE mxid=$2 AND mx_room=$3"
@@ -185,7 +236,7 @@ class Message:
     @classmethod
     async def bulk_insert(cls, messages: list[Message]) -> None:
         columns = cls.columns.split(", ")
-        records = [attr.astuple(message) for message in messages]
+        records = [message._values for message in messages]
         async with cls.db.acquire() as conn, conn.transaction():
             if cls.db.scheme == Scheme.POSTGRES:
                 await conn.copy_records_to_table("message", records=records, columns=columns)
@@ -22,7 +22,7 @@ from attr import dataclass
 from yarl import URL
 
 from mautrix.types import ContentURI, SyncToken, UserID
-from mautrix.util.async_db import Database
+from mautrix.util.async_db import Database, Scheme
 
 from ..types import TelegramID
 
@@ -83,6 +83,19 @@ class Puppet:
         q = f"SELECT {cls.columns} FROM puppet WHERE id=$1"
         return cls._from_row(await cls.db.fetchrow(q, tgid))
 
+    @classmethod
+    async def get_many_by_tgid(cls, tgids: list[TelegramID]) -> list[Puppet]:
+        if not tgids:
+            return []
+        if cls.db.scheme in (Scheme.POSTGRES, Scheme.COCKROACH):
+            q = f"SELECT {cls.columns} FROM puppet WHERE id=ANY($1)"
+            rows = await cls.db.fetch(q, tgids)
+        else:
+            tgid_placeholders = ("?," * len(tgids)).rstrip(",")
+            q = f"SELECT {cls.columns} FROM puppet WHERE id IN ({tgid_placeholders})"
+            rows = await cls.db.fetch(q, *tgids)
+        return [cls._from_row(row) for row in rows]
+
     @classmethod
     async def get_by_custom_mxid(cls, mxid: UserID) -> Puppet | None:
         q = f"SELECT {cls.columns} FROM puppet WHERE custom_mxid=$1"
@@ -29,7 +29,7 @@ from ..types import TelegramID
 fake_db = Database.create("") if TYPE_CHECKING else None
 
 
-@dataclass
+@dataclass(slots=True)
 class Reaction:
     db: ClassVar[Database] = fake_db
 
@@ -43,7 +43,7 @@ class Reaction:
     def _from_row(cls, row: Record | None) -> Reaction | None:
         if row is None:
             return None
-        return cls(**row)
+        return cls(*row)
 
     columns: ClassVar[str] = "mxid, mx_room, msg_mxid, tg_sender, reaction"
 
@@ -87,14 +87,31 @@ class Reaction:
             self.reaction,
         )
 
+    _upsert_query: ClassVar[str] = """
+        INSERT INTO reaction (mxid, mx_room, msg_mxid, tg_sender, reaction)
+        VALUES ($1, $2, $3, $4, $5) ON CONFLICT (msg_mxid, mx_room, tg_sender, reaction)
+            DO UPDATE SET mxid=excluded.mxid
+    """
+    _delete_query: ClassVar[str] = (
+        "DELETE FROM reaction WHERE msg_mxid=$1 AND mx_room=$2 AND tg_sender=$3 AND reaction=$4"
+    )
+
+    @property
+    def _key(self):
+        return self.msg_mxid, self.mx_room, self.tg_sender, self.reaction
+
+    @classmethod
+    async def bulk_save(cls, reactions: list[Reaction]) -> None:
+        if reactions:
+            await cls.db.executemany(cls._upsert_query, [react._values for react in reactions])
+
+    @classmethod
+    async def bulk_delete(cls, reactions: list[Reaction]) -> None:
+        if reactions:
+            await cls.db.executemany(cls._delete_query, [react._key for react in reactions])
+
     async def save(self) -> None:
-        q = """
-            INSERT INTO reaction (mxid, mx_room, msg_mxid, tg_sender, reaction)
-            VALUES ($1, $2, $3, $4, $5) ON CONFLICT (msg_mxid, mx_room, tg_sender, reaction)
-                DO UPDATE SET mxid=excluded.mxid
-        """
-        await self.db.execute(q, *self._values)
+        await self.db.execute(self._upsert_query, *self._values)
 
     async def delete(self) -> None:
-        q = "DELETE FROM reaction WHERE msg_mxid=$1 AND mx_room=$2 AND tg_sender=$3 AND reaction=$4"
-        await self.db.execute(q, self.msg_mxid, self.mx_room, self.tg_sender, self.reaction)
+        await self.db.execute(self._delete_query, *self._key)
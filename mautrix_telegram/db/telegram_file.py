@@ -26,7 +26,7 @@ from mautrix.util.async_db import Database, Scheme
 fake_db = Database.create("") if TYPE_CHECKING else None
 
 
-@dataclass
+@dataclass(slots=True)
 class TelegramFile:
     db: ClassVar[Database] = fake_db
 
@@ -40,23 +40,61 @@ class TelegramFile:
     height: int | None
     decryption_info: EncryptedFile | None
     thumbnail: TelegramFile | None = None
+    sha256: bytes | None = None
+    # Serialized InputDocument or InputPhoto for sending the same media back to Telegram
+    input_media: bytes | None = None
+    # The Telegram message the file was transferred from, used to refresh the file reference
+    source_chat_id: int | None = None
+    source_receiver: int | None = None
+    source_msg_id: int | None = None
+    # The file name of the Telegram document, reused media can't be sent under a different name
+    file_name: str | None = None
 
     columns: ClassVar[str] = (
         "id, mxc, mime_type, was_converted, timestamp, size, width, height, thumbnail, "
-        "decryption_info"
+        "decryption_info, sha256, input_media, source_chat_id, source_receiver, source_msg_id, "
+        "file_name"
     )
 
     @classmethod
     def _from_row(cls, row: Record | None) -> TelegramFile | None:
         if row is None:
             return None
-        data = {**row}
-        data.pop("thumbnail", None)
-        decryption_info = data.pop("decryption_info", None)
+        (
+            id,
+            mxc,
+            mime_type,
+            was_converted,
+            timestamp,
+            size,
+            width,
+            height,
+            _,
+            decryption_info,
+            sha256,
+            input_media,
+            source_chat_id,
+            source_receiver,
+            source_msg_id,
+            file_name,
+        ) = row
         return cls(
-            **data,
-            thumbnail=None,
-            decryption_info=EncryptedFile.parse_json(decryption_info) if decryption_info else None,
+            id,
+            mxc,
+            mime_type,
+            was_converted,
+            timestamp,
+            size,
+            width,
+            height,
+            EncryptedFile.parse_json(decryption_info) if decryption_info else None,
+            None,
+            sha256,
+            input_media,
+            source_chat_id,
+            source_receiver,
+            source_msg_id,
+            file_name,
         )
 
     @classmethod
@@ -90,11 +128,36 @@ class TelegramFile:
         q = f"SELECT {cls.columns} FROM telegram_file WHERE mxc=$1"
         return cls._from_row(await cls.db.fetchrow(q, mxc))
 
+    @classmethod
+    async def find_by_sha256(cls, sha256: bytes, encrypted: bool) -> TelegramFile | None:
+        encrypted_cond = "IS NOT NULL" if encrypted else "IS NULL"
+        q = (
+            f"SELECT {cls.columns} FROM telegram_file "
+            f"WHERE sha256=$1 AND decryption_info {encrypted_cond} LIMIT 1"
+        )
+        return cls._from_row(await cls.db.fetchrow(q, sha256))
+
+    @classmethod
+    async def find_reusable_by_mxc(cls, mxc: ContentURI) -> TelegramFile | None:
+        """Find a file by mxc, preferring one that can be sent back to Telegram as-is."""
+        q = (
+            f"SELECT {cls.columns} FROM telegram_file "
+            "WHERE mxc=$1 ORDER BY input_media IS NULL LIMIT 1"
+        )
+        return cls._from_row(await cls.db.fetchrow(q, mxc))
+
+    @classmethod
+    async def set_input_media(cls, mxc: ContentURI, input_media: bytes) -> None:
+        q = "UPDATE telegram_file SET input_media=$2 WHERE mxc=$1"
+        await cls.db.execute(q, mxc, input_media)
+
     async def insert(self) -> None:
         q = (
             "INSERT INTO telegram_file (id, mxc, mime_type, was_converted, timestamp,"
-            "                           size, width, height, thumbnail, decryption_info) "
-            "VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)"
+            "                           size, width, height, thumbnail, decryption_info, sha256,"
+            "                           input_media, source_chat_id, source_receiver,"
+            "                           source_msg_id, file_name) "
+            "VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16)"
         )
         await self.db.execute(
             q,
@@ -108,4 +171,10 @@ class TelegramFile:
             self.height,
             self.thumbnail.id if self.thumbnail else None,
             self.decryption_info.json() if self.decryption_info else None,
+            self.sha256,
+            self.input_media,
+            self.source_chat_id,
+            self.source_receiver,
+            self.source_msg_id,
+            self.file_name,
         )
@@ -16,6 +16,7 @@
 from __future__ import annotations
 
 from typing import TYPE_CHECKING, ClassVar, Iterable
+from collections import OrderedDict
 import asyncio
 import datetime
 
@@ -24,13 +25,34 @@ from telethon.crypto import AuthKey
 from telethon.sessions import MemorySession
 from telethon.tl.types import PeerChannel, PeerChat, PeerUser, updates
 
+from mautrix.util import background_task
 from mautrix.util.async_db import Database, Scheme
+from mautrix.util.opt_prometheus import Counter
 
 fake_db = Database.create("") if TYPE_CHECKING else None
 
+METRIC_ENTITY_CACHE_HITS = Counter(
+    "bridge_telethon_entity_cache_hits",
+    "Telethon entity lookups served from the in-memory cache",
+    labelnames=("lookup",),
+)
+METRIC_ENTITY_CACHE_MISSES = Counter(
+    "bridge_telethon_entity_cache_misses",
+    "Telethon entity lookups that had to query the database",
+    labelnames=("lookup",),
+)
+
 
 class PgSession(MemorySession):
     db: ClassVar[Database] = fake_db
+    entity_cache_size: ClassVar[int] = 1024
+    update_state_flush_interval: ClassVar[float] = 1
+    update_state_flush_max_pending: ClassVar[int] = 1000
+
+    # Dirty update states of all sessions, keyed by (session_id, entity_id)
+    _pending_update_states: ClassVar[dict[tuple[str, int], updates.State]] = {}
+    _update_state_flush_lock: ClassVar[asyncio.Lock] = asyncio.Lock()
+    _update_state_flush_task: ClassVar[asyncio.Task | None] = None
 
     session_id: str
     _dc_id: int
@@ -39,6 +61,12 @@ class PgSession(MemorySession):
     _auth_key: AuthKey | None
     _takeout_id: int | None
     _process_entities_lock: asyncio.Lock
+    # Entity ID -> access hash
+    _entity_hash_cache: OrderedDict[int, int]
+    # (lookup type, username/phone/name) -> entity ID
+    _entity_key_cache: OrderedDict[tuple[str, str], int]
+    # Entity ID -> lookup type -> username/phone/name currently in the key cache
+    _entity_cached_keys: dict[int, dict[str, str]]
 
     def __init__(
         self,
@@ -57,6 +85,9 @@ class PgSession(MemorySession):
         self._auth_key = auth_key
         self._takeout_id = takeout_id
         self._process_entities_lock = asyncio.Lock()
+        self._entity_hash_cache = OrderedDict()
+        self._entity_key_cache = OrderedDict()
+        self._entity_cached_keys = {}
 
     def clone(self, to_instance=None) -> MemorySession:
         # We don't want to store data of clones
@@ -104,15 +135,26 @@ class PgSession(MemorySession):
     )
 
     async def delete(self) -> None:
-        async with self.db.acquire() as conn, conn.transaction():
-            for table in self._tables:
-                await conn.execute(f"DELETE FROM {table} WHERE session_id=$1", self.session_id)
+        self._entity_hash_cache.clear()
+        self._entity_key_cache.clear()
+        self._entity_cached_keys.clear()
+        # Hold the flush lock so that an in-progress flush can't write states back afterwards
+        async with self._update_state_flush_lock:
+            for key in [key for key in self._pending_update_states if key[0] == self.session_id]:
+                del self._pending_update_states[key]
+            async with self.db.acquire() as conn, conn.transaction():
+                for table in self._tables:
+                    await conn.execute(f"DELETE FROM {table} WHERE session_id=$1", self.session_id)
 
     async def close(self) -> None:
-        # Nothing to do here, DB connection is global
-        pass
+        # DB connection is global, so just make sure buffered update states are written
+        await self.flush_update_states()
 
     async def get_update_state(self, entity_id: int) -> updates.State | None:
+        try:
+            return self._pending_update_states[(self.session_id, entity_id)]
+        except KeyError:
+            pass
         q = (
             "SELECT pts, qts, date, seq, unread_count FROM telethon_update_state "
             "WHERE session_id=$1 AND entity_id=$2"
@@ -132,32 +174,86 @@ class PgSession(MemorySession):
     """
 
     async def set_update_state(self, entity_id: int, row: updates.State) -> None:
-        q = self._set_update_state_q
-        ts = row.date.timestamp()
-        await self.db.execute(
-            q, self.session_id, entity_id, row.pts, row.qts, ts, row.seq, row.unread_count
-        )
+        if self.update_state_flush_interval <= 0:
+            row = self._update_state_to_row(self.session_id, entity_id, row)
+            await self._upsert_update_states([row])
+            return
+        self._pending_update_states[(self.session_id, entity_id)] = row
+        if len(self._pending_update_states) >= self.update_state_flush_max_pending:
+            await self.flush_update_states()
+        else:
+            self._schedule_update_state_flush()
 
     async def set_update_states(self, rows: list[tuple[int, updates.State]]) -> None:
-        rows = [
-            (
-                self.session_id,
-                entity_id,
-                row.pts,
-                row.qts,
-                row.date.timestamp(),
-                row.seq,
-                row.unread_count,
+        # This is only called when Telethon explicitly saves all states, so write them out
+        # immediately (together with anything else that's pending) instead of buffering.
+        for entity_id, row in rows:
+            self._pending_update_states[(self.session_id, entity_id)] = row
+        await self.flush_update_states()
+
+    @staticmethod
+    def _update_state_to_row(
+        session_id: str, entity_id: int, row: updates.State
+    ) -> tuple[str, int, int, int, float, int, int]:
+        return (
+            session_id,
+            entity_id,
+            row.pts,
+            row.qts,
+            row.date.timestamp(),
+            row.seq,
+            row.unread_count,
+        )
+
+    @classmethod
+    def _schedule_update_state_flush(cls) -> None:
+        if not PgSession._update_state_flush_task:
+            PgSession._update_state_flush_task = background_task.create(
+                cls._delayed_flush_update_states()
             )
-            for entity_id, row in rows
-        ]
-        if self.db.scheme == Scheme.POSTGRES:
+
+    @classmethod
+    async def _delayed_flush_update_states(cls) -> None:
+        try:
+            await asyncio.sleep(cls.update_state_flush_interval)
+        finally:
+            PgSession._update_state_flush_task = None
+        await cls.flush_update_states()
+
+    @classmethod
+    async def flush_update_states(cls) -> None:
+        """
+        Write all buffered update states of all sessions to the database in one bulk upsert.
+        """
+        async with cls._update_state_flush_lock:
+            if not cls._pending_update_states:
+                return
+            pending = PgSession._pending_update_states
+            PgSession._pending_update_states = {}
+            rows = [
+                cls._update_state_to_row(session_id, entity_id, row)
+                for (session_id, entity_id), row in pending.items()
+            ]
+            try:
+                await cls._upsert_update_states(rows)
+            except Exception:
+                # Put the states back unless they were already replaced by newer ones
+                for key, row in pending.items():
+                    PgSession._pending_update_states.setdefault(key, row)
+                cls._schedule_update_state_flush()
+                raise
+
+    @classmethod
+    async def _upsert_update_states(
+        cls, rows: list[tuple[str, int, int, int, float, int, int]]
+    ) -> None:
+        if cls.db.scheme == Scheme.POSTGRES:
             q = """
             INSERT INTO telethon_update_state (
                 session_id, entity_id, pts, qts, date, seq, unread_count
             )
             VALUES (
-                $1,
+                unnest($1::text[]),
                 unnest($2::bigint[]), unnest($3::bigint[]), unnest($4::bigint[]),
                 unnest($5::bigint[]), unnest($6::bigint[]), unnest($7::integer[])
             )
@@ -165,18 +261,18 @@ class PgSession(MemorySession):
                 pts=excluded.pts, qts=excluded.qts, date=excluded.date, seq=excluded.seq,
                 unread_count=excluded.unread_count
             """
-            _, entity_ids, ptses, qtses, timestamps, seqs, unread_counts = zip(*rows)
-            await self.db.execute(
-                q, self.session_id, entity_ids, ptses, qtses, timestamps, seqs, unread_counts
-            )
+            await cls.db.execute(q, *zip(*rows))
         else:
-            await self.db.executemany(self._set_update_state_q, rows)
+            await cls.db.executemany(cls._set_update_state_q, rows)
 
     async def delete_update_state(self, entity_id: int) -> None:
-        q = "DELETE FROM telethon_update_state WHERE session_id=$1 AND entity_id=$2"
-        await self.db.execute(q, self.session_id, entity_id)
+        async with self._update_state_flush_lock:
+            self._pending_update_states.pop((self.session_id, entity_id), None)
+            q = "DELETE FROM telethon_update_state WHERE session_id=$1 AND entity_id=$2"
+            await self.db.execute(q, self.session_id, entity_id)
 
     async def get_update_states(self) -> Iterable[tuple[int, updates.State], ...]:
+        await self.flush_update_states()
         q = (
             "SELECT entity_id, pts, qts, date, seq, unread_count FROM telethon_update_state "
             "WHERE session_id=$1"
@@ -232,6 +328,64 @@ class PgSession(MemorySession):
                 "    SET hash=$3, username=$4, phone=$5, name=$6"
             )
             await self.db.executemany(q, rows)
+        for _, id, hash, username, phone, name in rows:
+            self._cache_entity(id, hash, username=username, phone=phone, name=name)
+
+    @staticmethod
+    def _lru_put(cache: OrderedDict, key, value, max_size: int) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+    def _cache_entity(self, id: int, hash: int, **keys: str | None) -> None:
+        if self.entity_cache_size <= 0:
+            return
+        self._lru_put(self._entity_hash_cache, id, hash, self.entity_cache_size)
+        cached_keys = self._entity_cached_keys.setdefault(id, {})
+        for lookup, key in keys.items():
+            # Drop the previous username/phone/name so it doesn't keep resolving to this entity
+            old_key = cached_keys.pop(lookup, None)
+            if old_key is not None and old_key != key:
+                self._entity_key_cache.pop((lookup, old_key), None)
+            if not key:
+                continue
+            prev_id = self._entity_key_cache.get((lookup, key))
+            if prev_id is not None and prev_id != id:
+                self._forget_cached_key(prev_id, lookup)
+            self._entity_key_cache[(lookup, key)] = id
+            self._entity_key_cache.move_to_end((lookup, key))
+            cached_keys[lookup] = key
+        while len(self._entity_key_cache) > self.entity_cache_size:
+            (lookup, _), evicted_id = self._entity_key_cache.popitem(last=False)
+            self._forget_cached_key(evicted_id, lookup)
+        if not cached_keys:
+            del self._entity_cached_keys[id]
+
+    def _forget_cached_key(self, id: int, lookup: str) -> None:
+        cached_keys = self._entity_cached_keys.get(id)
+        if cached_keys is not None:
+            cached_keys.pop(lookup, None)
+            if not cached_keys:
+                del self._entity_cached_keys[id]
+
+    def _get_cached_entity(self, id: int) -> tuple[int, int] | None:
+        try:
+            hash = self._entity_hash_cache[id]
+        except KeyError:
+            return None
+        self._entity_hash_cache.move_to_end(id)
+        return id, hash
+
+    def _get_cached_entity_by_key(self, lookup: str, key: str) -> tuple[int, int] | None:
+        try:
+            id = self._entity_key_cache[(lookup, key)]
+        except KeyError:
+            return None
+        self._entity_key_cache.move_to_end((lookup, key))
+        # The hash is always read from the ID cache, so it can't go stale when the entity
+        # is updated under a different username/phone/name.
+        return self._get_cached_entity(id)
 
     async def _select_entity(
         self, constraint: str, *args: str | int | tuple[int, ...]
@@ -242,25 +396,48 @@ class PgSession(MemorySession):
             return None
         return row["id"], row["hash"]
 
+    async def _select_entity_by_key(self, lookup: str, key: str) -> tuple[int, int] | None:
+        cached = self._get_cached_entity_by_key(lookup, key)
+        if cached is not None:
+            METRIC_ENTITY_CACHE_HITS.labels(lookup=lookup).inc()
+            return cached
+        METRIC_ENTITY_CACHE_MISSES.labels(lookup=lookup).inc()
+        row = await self._select_entity(f"{lookup}=$2", key)
+        if row is not None:
+            self._cache_entity(*row, **{lookup: key})
+        return row
+
     async def get_entity_rows_by_phone(self, key: str | int) -> tuple[int, int] | None:
-        return await self._select_entity("phone=$2", str(key))
+        return await self._select_entity_by_key("phone", str(key))
 
     async def get_entity_rows_by_username(self, key: str) -> tuple[int, int] | None:
-        return await self._select_entity("username=$2", key)
+        return await self._select_entity_by_key("username", key)
 
     async def get_entity_rows_by_name(self, key: str) -> tuple[int, int] | None:
-        return await self._select_entity("name=$2", key)
+        return await self._select_entity_by_key("name", key)
 
     async def get_entity_rows_by_id(self, key: int, exact: bool = True) -> tuple[int, int] | None:
         if exact:
-            return await self._select_entity("id=$2", key)
+            ids = (key,)
+        else:
+            ids = (
+                utils.get_peer_id(PeerUser(key)),
+                utils.get_peer_id(PeerChat(key)),
+                utils.get_peer_id(PeerChannel(key)),
+            )
+        for id in ids:
+            cached = self._get_cached_entity(id)
+            if cached is not None:
+                METRIC_ENTITY_CACHE_HITS.labels(lookup="id").inc()
+                return cached
+        METRIC_ENTITY_CACHE_MISSES.labels(lookup="id").inc()
 
-        ids = (
-            utils.get_peer_id(PeerUser(key)),
-            utils.get_peer_id(PeerChat(key)),
-            utils.get_peer_id(PeerChannel(key)),
-        )
-        if self.db.scheme in (Scheme.POSTGRES, Scheme.COCKROACH):
-            return await self._select_entity("id=ANY($2)", ids)
+        if exact:
+            row = await self._select_entity("id=$2", key)
+        elif self.db.scheme in (Scheme.POSTGRES, Scheme.COCKROACH):
+            row = await self._select_entity("id=ANY($2)", ids)
         else:
-            return await self._select_entity(f"id IN ($2, $3, $4)", *ids)
+            row = await self._select_entity(f"id IN ($2, $3, $4)", *ids)
+        if row is not None:
+            self._cache_entity(*row)
+        return row
@@ -24,4 +24,9 @@ from . import (  # isort:skip
     v16_backfill_anchor_id,
     v17_backfill_type,
     v18_puppet_contact_info_set,
+    v19_message_content_hash_index,
+    v20_telegram_file_sha256,
+    v21_telegram_file_input_media,
+    v22_user_portal_sync_state,
+    v23_telegram_file_source,
 )
@@ -15,7 +15,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from mautrix.util.async_db import Connection, Scheme
 
-latest_version = 18
+latest_version = 23
 
 
 async def create_latest_tables(conn: Connection, scheme: Scheme) -> int:
@@ -74,6 +74,7 @@ async def create_latest_tables(conn: Connection, scheme: Scheme) -> int:
         )"""
     )
     await conn.execute("CREATE INDEX message_mx_room_and_tgid_idx ON message(mx_room, tgid DESC)")
+    await conn.execute("CREATE INDEX message_content_hash_idx ON message(mx_room, content_hash)")
     await conn.execute(
         """CREATE TABLE reaction (
             mxid      TEXT NOT NULL,
@@ -138,11 +139,18 @@ async def create_latest_tables(conn: Connection, scheme: Scheme) -> int:
             height          INTEGER,
             thumbnail       TEXT,
             decryption_info jsonb,
+            sha256          bytea,
+            input_media     bytea,
+            source_chat_id  BIGINT,
+            source_receiver BIGINT,
+            source_msg_id   BIGINT,
+            file_name       TEXT,
             FOREIGN KEY (thumbnail) REFERENCES telegram_file(id)
                 ON UPDATE CASCADE ON DELETE SET NULL
         )"""
     )
     await conn.execute("CREATE INDEX telegram_file_mxc_idx ON telegram_file(mxc)")
+    await conn.execute("CREATE INDEX telegram_file_sha256_idx ON telegram_file(sha256)")
     await conn.execute(
         """CREATE TABLE bot_chat (
             id   BIGINT PRIMARY KEY,
@@ -154,6 +162,8 @@ async def create_latest_tables(conn: Connection, scheme: Scheme) -> int:
             "user"          BIGINT,
             portal          BIGINT,
             portal_receiver BIGINT,
+            synced_message_id BIGINT,
+            synced_state_hash BIGINT,
             PRIMARY KEY ("user", portal, portal_receiver),
             FOREIGN KEY ("user") REFERENCES "user"(tgid) ON DELETE CASCADE ON UPDATE CASCADE,
             FOREIGN KEY (portal, portal_receiver) REFERENCES portal(tgid, tg_receiver)
@@ -56,6 +56,19 @@ class User:
         q = f'SELECT {cls.columns} FROM "user" WHERE tgid=$1'
         return cls._from_row(await cls.db.fetchrow(q, tgid))
 
+    @classmethod
+    async def get_many_by_tgid(cls, tgids: list[TelegramID]) -> list[User]:
+        if not tgids:
+            return []
+        if cls.db.scheme in (Scheme.POSTGRES, Scheme.COCKROACH):
+            q = f'SELECT {cls.columns} FROM "user" WHERE tgid=ANY($1)'
+            rows = await cls.db.fetch(q, tgids)
+        else:
+            tgid_placeholders = ("?," * len(tgids)).rstrip(",")
+            q = f'SELECT {cls.columns} FROM "user" WHERE tgid IN ({tgid_placeholders})'
+            rows = await cls.db.fetch(q, *tgids)
+        return [cls._from_row(row) for row in rows]
+
     @classmethod
     async def get_by_mxid(cls, mxid: UserID) -> User | None:
         q = f'SELECT {cls.columns} FROM "user" WHERE mxid=$1'
@@ -71,6 +84,34 @@ class User:
         q = f'SELECT {cls.columns} FROM "user" WHERE tgid IS NOT NULL'
         return [cls._from_row(row) for row in await cls.db.fetch(q)]
 
+    @classmethod
+    async def all_with_tgid_by_activity(cls) -> list[tuple[User, float | None]]:
+        """
+        Get all logged-in users with the timestamp of their most recent activity, newest first.
+        Activity is the latest of the Telegram update state date of the user's session and the
+        last tracked activity of the user's puppet. Users without any activity are last.
+        """
+        q = (
+            f"SELECT {cls.columns}, activity.last_activity_ts, state.last_update "
+            'FROM "user" '
+            'LEFT JOIN user_activity activity ON activity.puppet_id="user".tgid '
+            "LEFT JOIN ("
+            "  SELECT session_id, MAX(date) AS last_update FROM telethon_update_state"
+            "  GROUP BY session_id"
+            ') state ON state.session_id="user".mxid '
+            "WHERE tgid IS NOT NULL"
+        )
+        users = []
+        for row in await cls.db.fetch(q):
+            last_activity_ts = row["last_activity_ts"]
+            activity = max(
+                last_activity_ts / 1000 if last_activity_ts else 0, row["last_update"] or 0
+            )
+            user = cls._from_row({key: row[key] for key in cls.columns.split(", ")})
+            users.append((user, activity or None))
+        users.sort(key=lambda item: item[1] or 0, reverse=True)
+        return users
+
     async def delete(self) -> None:
         await self.db.execute('DELETE FROM "user" WHERE mxid=$1', self.mxid)
 
@@ -136,15 +177,50 @@ class User:
         return [(TelegramID(row["portal"]), TelegramID(row["portal_receiver"])) for row in rows]
 
     async def set_portals(self, portals: Iterable[tuple[TelegramID, TelegramID]]) -> None:
-        columns = ["user", "portal", "portal_receiver"]
-        records = [(self.tgid, tgid, tg_receiver) for tgid, tg_receiver in portals]
+        # Only add and remove the changed rows to keep the sync state of existing portals
+        portals = set(portals)
+        existing = set(await self.get_portals())
+        removed = [(self.tgid, tgid, tg_receiver) for tgid, tg_receiver in existing - portals]
+        added = [(self.tgid, tgid, tg_receiver) for tgid, tg_receiver in portals - existing]
         async with self.db.acquire() as conn, conn.transaction():
-            await conn.execute('DELETE FROM user_portal WHERE "user"=$1', self.tgid)
-            if self.db.scheme == Scheme.POSTGRES:
-                await conn.copy_records_to_table("user_portal", records=records, columns=columns)
-            else:
-                q = 'INSERT INTO user_portal ("user", portal, portal_receiver) VALUES ($1, $2, $3)'
-                await conn.executemany(q, records)
+            if removed:
+                q = 'DELETE FROM user_portal WHERE "user"=$1 AND portal=$2 AND portal_receiver=$3'
+                await conn.executemany(q, removed)
+            if added:
+                q = (
+                    'INSERT INTO user_portal ("user", portal, portal_receiver) VALUES ($1, $2, $3) '
+                    'ON CONFLICT ("user", portal, portal_receiver) DO NOTHING'
+                )
+                await conn.executemany(q, added)
+
+    async def get_portal_sync_states(
+        self,
+    ) -> dict[tuple[TelegramID, TelegramID], tuple[TelegramID, int]]:
+        q = (
+            "SELECT portal, portal_receiver, synced_message_id, synced_state_hash "
+            'FROM user_portal WHERE "user"=$1 AND synced_message_id IS NOT NULL'
+        )
+        rows = await self.db.fetch(q, self.tgid)
+        return {
+            (TelegramID(row["portal"]), TelegramID(row["portal_receiver"])): (
+                TelegramID(row["synced_message_id"]),
+                row["synced_state_hash"],
+            )
+            for row in rows
+        }
+
+    async def set_portal_sync_state(
+        self, tgid: TelegramID, tg_receiver: TelegramID, message_id: TelegramID, state_hash: int
+    ) -> None:
+        q = (
+            "INSERT INTO user_portal "
+            '("user", portal, portal_receiver, synced_message_id, synced_state_hash) '
+            "VALUES ($1, $2, $3, $4, $5) "
+            'ON CONFLICT ("user", portal, portal_receiver) DO UPDATE '
+            "SET synced_message_id=excluded.synced_message_id, "
+            "synced_state_hash=excluded.synced_state_hash"
+        )
+        await self.db.execute(q, self.tgid, tgid, tg_receiver, message_id, state_hash)
 
     async def register_portal(self, tgid: TelegramID, tg_receiver: TelegramID) -> None:
         q = (
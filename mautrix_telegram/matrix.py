@@ -39,7 +39,7 @@ from mautrix.types import (
     UserID,
 )
 
-from . import commands as com, portal as po, puppet as pu, user as u
+from . import commands as com, portal as po, puppet as pu, user as u, util
 from .commands.portal.util import get_initial_state, user_has_power_level, warn_missing_power
 from .types import TelegramID
 
@@ -49,6 +49,7 @@ if TYPE_CHECKING:
 
 class MatrixHandler(BaseMatrixHandler):
     commands: com.CommandProcessor
+    typing: util.TypingNotifier
     _previously_typing: dict[RoomID, set[UserID]]
 
     def __init__(self, bridge: "TelegramBridge") -> None:
@@ -60,6 +61,11 @@ class MatrixHandler(BaseMatrixHandler):
         super().__init__(command_processor=com.CommandProcessor(bridge), bridge=bridge)
 
         self._previously_typing = {}
+        self.typing = util.TypingNotifier(
+            refresh_interval=bridge.config["bridge.typing_notifications.refresh_interval"],
+            rate=bridge.config["bridge.typing_notifications.rate_limit"],
+            burst=bridge.config["bridge.typing_notifications.burst"],
+        )
 
     async def handle_puppet_group_invite(
         self,
@@ -371,18 +377,14 @@ class MatrixHandler(BaseMatrixHandler):
             return
 
         previously_typing = self._previously_typing.get(room_id, set())
+        self._previously_typing[room_id] = now_typing
 
-        for user_id in set(previously_typing | now_typing):
-            is_typing = user_id in now_typing
-            was_typing = user_id in previously_typing
-            if is_typing and was_typing:
-                continue
-
+        started, stopped = [], []
+        for user_id in previously_typing ^ now_typing:
             user = await u.User.get_by_mxid(user_id, check_db=False, create=False)
             if user and await user.is_logged_in():
-                await portal.set_typing(user, is_typing)
-
-        self._previously_typing[room_id] = now_typing
+                (started if user_id in now_typing else stopped).append(user)
+        await self.typing.update(portal, started, stopped)
 
     async def handle_ephemeral_event(
         self, evt: ReceiptEvent | PresenceEvent | TypingEvent
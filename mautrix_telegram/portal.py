@@ -28,6 +28,7 @@ from typing import (
     cast,
 )
 from collections import defaultdict
+from contextlib import ExitStack
 from datetime import datetime
 from html import escape as escape_html
 from sqlite3 import IntegrityError
@@ -47,7 +48,11 @@ from telethon.errors import (
     EntitiesTooLongError,
     EntityBoundsInvalidError,
     EntityMentionUserInvalidError,
+    FileReferenceEmptyError,
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
     InputUserDeactivatedError,
+    MediaEmptyError,
     MessageEmptyError,
     MessageIdInvalidError,
     MessageNotModifiedError,
@@ -107,6 +112,7 @@ from telethon.tl.types import (
     InputChannel,
     InputChatUploadedPhoto,
     InputDialogPeer,
+    InputMediaDocument,
     InputMediaUploadedDocument,
     InputMediaUploadedPhoto,
     InputPeerChannel,
@@ -135,6 +141,7 @@ from telethon.tl.types import (
     MessageMediaGeo,
     MessagePeerReaction,
     MessageReactions,
+    MessageReplyHeader,
     PeerChannel,
     PeerChat,
     PeerUser,
@@ -153,10 +160,13 @@ from telethon.tl.types import (
     TypeChannelParticipant,
     TypeChat,
     TypeChatParticipant,
+    TypeDocumentAttribute,
     TypeInputChannel,
+    TypeInputMedia,
     TypeInputPeer,
     TypeMessage,
     TypeMessageAction,
+    TypeMessageEntity,
     TypePeer,
     TypeReaction,
     TypeUser,
@@ -264,6 +274,9 @@ TypeChatPhoto = Union[ChatPhoto, ChatPhotoEmpty, Photo, PhotoEmpty]
 MediaHandler = Callable[["au.AbstractUser", IntentAPI, Message, RelatesTo], Awaitable[EventID]]
 
 REACTION_POLL_MIN_INTERVAL = 20
+# Telegram returns up to 100 messages per history request, so backfilled messages are
+# prefetched in pages of the same size.
+BACKFILL_PREFETCH_PAGE_SIZE = 100
 
 
 class BridgingError(Exception):
@@ -279,6 +292,11 @@ class WrappedReaction(NamedTuple):
     date: datetime | None
 
 
+class BackfillPrefetch(NamedTuple):
+    puppets: dict[TelegramID, p.Puppet]
+    reply_targets: putil.ReplyTargets
+
+
 class Portal(DBPortal, BasePortal):
     bot: "Bot"
     config: Config
@@ -287,7 +305,7 @@ class Portal(DBPortal, BasePortal):
 
     # Instance cache
     by_mxid: dict[RoomID, Portal] = {}
-    by_tgid: dict[tuple[TelegramID, TelegramID], Portal] = {}
+    by_tgid: util.ObjectCache[tuple[TelegramID, TelegramID], Portal] = util.ObjectCache("portal")
 
     # Config cache
     filter_mode: str
@@ -295,6 +313,8 @@ class Portal(DBPortal, BasePortal):
     filter_users: bool | None
 
     max_initial_member_sync: int
+    member_sync_concurrency: int
+    max_concurrent_reactions: int
     sync_channel_members: bool
     sync_matrix_state: bool
     public_portals: bool
@@ -313,6 +333,8 @@ class Portal(DBPortal, BasePortal):
     alias: RoomAlias | None
 
     dedup: putil.PortalDedup
+    read_receipts: putil.PortalReadReceipts
+    recent_events: putil.PortalRecentEvents
     send_lock: putil.PortalSendLock
     reaction_lock: putil.PortalReactionLock
     _pin_lock: asyncio.Lock
@@ -388,6 +410,8 @@ class Portal(DBPortal, BasePortal):
         self.backfill_method_lock = asyncio.Lock()
 
         self.dedup = putil.PortalDedup(self)
+        self.read_receipts = putil.PortalReadReceipts(self)
+        self.recent_events = putil.PortalRecentEvents()
         self.send_lock = putil.PortalSendLock()
         self.reaction_lock = putil.PortalReactionLock()
         self._pin_lock = asyncio.Lock()
@@ -492,6 +516,14 @@ class Portal(DBPortal, BasePortal):
         cls.bot = bridge.bot
 
         cls.max_initial_member_sync = cls.config["bridge.max_initial_member_sync"]
+        cls.member_sync_concurrency = max(cls.config["bridge.member_sync_concurrency"], 1)
+        cls.max_concurrent_reactions = max(cls.config["bridge.max_concurrent_reactions"], 1)
+        cls.by_tgid.configure(
+            max_size=cls.config["bridge.object_cache.portals"],
+            min_idle=cls.config["bridge.object_cache.min_idle"],
+            in_use=cls._is_in_use,
+            on_evict=cls._remove_evicted,
+        )
         cls.sync_channel_members = cls.config["bridge.sync_channel_members"]
         cls.sync_matrix_state = cls.config["bridge.sync_matrix_state"]
         cls.public_portals = cls.config["bridge.public_portals"]
@@ -501,6 +533,10 @@ class Portal(DBPortal, BasePortal):
         cls.filter_users = cls.config["bridge.filter.users"]
         cls.hs_domain = cls.config["homeserver.domain"]
         cls.backfill_enable = cls.config["bridge.backfill.enable"]
+        putil.PortalDedup.cache_queue_length = cls.config["bridge.deduplication.cache_size"]
+        putil.PortalDedup.warm_count = cls.config["bridge.deduplication.warm_size"]
+        putil.PortalReadReceipts.delay = cls.config["bridge.read_receipt_delay"]
+        putil.PortalRecentEvents.cache_size = cls.config["bridge.reply_event_cache_size"]
         cls.alias_template = SimpleTemplate(
             cls.config["bridge.alias_template"],
             "groupname",
@@ -726,11 +762,13 @@ class Portal(DBPortal, BasePortal):
         levels: PowerLevelStateEventContent = None,
         users: list[User] = None,
         client: MautrixTelegramClient | None = None,
-    ) -> None:
+    ) -> bool:
         try:
             await self._update_matrix_room(user, entity, puppet, levels, users, client)
         except Exception:
             self.log.exception("Fatal error updating Matrix room")
+            return False
+        return True
 
     async def _update_matrix_room(
         self,
@@ -755,19 +793,21 @@ class Portal(DBPortal, BasePortal):
             await puppet.update_info(user, entity)
             await puppet.intent_for(self).join_room(self.mxid)
             await self.update_info_from_puppet(puppet, user, entity.photo)
-
-            puppet = await p.Puppet.get_by_custom_mxid(user.mxid)
-            if puppet:
-                try:
-                    did_join = await puppet.intent.ensure_joined(self.mxid)
-                    if isinstance(user, u.User) and did_join and self.peer_type == "user":
-                        await user.update_direct_chats({self.main_intent.mxid: [self.mxid]})
-                except Exception:
-                    self.log.exception("Failed to ensure %s is joined to portal", user.mxid)
+            await self._ensure_double_puppet_joined(user)
 
         if self.sync_matrix_state:
             await self.main_intent.get_joined_members(self.mxid)
 
+    async def _ensure_double_puppet_joined(self, user: au.AbstractUser) -> None:
+        puppet = await p.Puppet.get_by_custom_mxid(user.mxid)
+        if puppet:
+            try:
+                did_join = await puppet.intent.ensure_joined(self.mxid)
+                if isinstance(user, u.User) and did_join and self.peer_type == "user":
+                    await user.update_direct_chats({self.main_intent.mxid: [self.mxid]})
+            except Exception:
+                self.log.exception("Failed to ensure %s is joined to portal", user.mxid)
+
     async def update_info_from_puppet(
         self,
         puppet: p.Puppet | None = None,
@@ -790,7 +830,14 @@ class Portal(DBPortal, BasePortal):
         update_if_exists: bool = True,
         from_dialog_sync: bool = False,
         client: MautrixTelegramClient | None = None,
+        wait_for_backfill: bool = False,
     ) -> RoomID | None:
+        """
+        Create the Matrix room for this portal, or update it if it already exists.
+
+        The initial backfill of a new room runs in the background unless ``wait_for_backfill`` is
+        set, in which case it finishes before this returns.
+        """
         if self.mxid:
             if update_if_exists:
                 if not entity:
@@ -808,7 +855,12 @@ class Portal(DBPortal, BasePortal):
         async with self._room_create_lock:
             try:
                 return await self._create_matrix_room(
-                    user, entity, invites, client=client, from_dialog_sync=from_dialog_sync
+                    user,
+                    entity,
+                    invites,
+                    client=client,
+                    from_dialog_sync=from_dialog_sync,
+                    wait_for_backfill=wait_for_backfill,
                 )
             except Exception:
                 self.log.exception("Fatal error creating Matrix room")
@@ -866,6 +918,7 @@ class Portal(DBPortal, BasePortal):
         invites: InviteList,
         from_dialog_sync: bool,
         client: MautrixTelegramClient | None = None,
+        wait_for_backfill: bool = False,
     ) -> RoomID | None:
         if self.mxid:
             return self.mxid
@@ -935,48 +988,73 @@ class Portal(DBPortal, BasePortal):
 
         self.log.debug("Preparing to create room")
 
+        autojoin_invites = self.bridge.homeserver_software.is_hungry
         if self.is_direct:
             puppet = await self.get_dm_puppet()
-            await puppet.update_info(user, entity, client_override=client)
             self._main_intent = puppet.intent_for(self)
-            if self.tgid == user.tgid:
-                self.title = "Telegram Saved Messages"
-                self.about = "Your Telegram cloud storage chat"
         else:
             puppet = None
             self._main_intent = self.az.intent
-            await self.update_info(user, entity, client=client)
+            if self.peer_type == "channel":
+                self.megagroup = entity.megagroup
 
         preset = RoomCreatePreset.PRIVATE
         if self.peer_type == "channel" and entity.username:
             if self.public_portals:
                 preset = RoomCreatePreset.PUBLIC
-            self.username = entity.username
-            alias = self.alias_localpart
+            alias = self.alias_template.format(entity.username)
         else:
             # TODO invite link alias?
             alias = None
 
-        if alias:
-            # TODO? properly handle existing room aliases
-            await self.main_intent.remove_room_alias(alias)
-
         power_levels = putil.get_base_power_levels(self, entity=entity)
-        users = None
         if not self.is_direct:
-            users = await self._get_users(client, entity)
             if self.has_bot:
                 extra_invites = self.config["bridge.relaybot.group_chat_invite"]
                 invites += extra_invites
                 for invite in extra_invites:
                     power_levels.users.setdefault(invite, 100)
-            await putil.participants_to_power_levels(self, users, power_levels)
         elif self.bot and self.tg_receiver == self.bot.tgid:
-            assert puppet is not None
             invites += self.config["bridge.relaybot.private_chat.invite"]
             for invite in invites:
                 power_levels.users.setdefault(invite, 100)
+
+        async def update_info() -> None:
+            if puppet:
+                await puppet.update_info(user, entity, client_override=client)
+            else:
+                await self.update_info(user, entity, client=client)
+
+        async def remove_alias() -> None:
+            if alias:
+                # TODO? properly handle existing room aliases
+                await self.main_intent.remove_room_alias(alias)
+
+        async def fetch_members() -> tuple[list[TypeUser] | None, set[UserID]]:
+            if self.is_direct:
+                return None, set()
+            members = await self._get_users(client, entity)
+            await putil.participants_to_power_levels(self, members, power_levels)
+            # With autojoining, members are synced before creating the room,
+            # so that they can be invited and joined as a part of the creation request.
+            member_mxids = set()
+            if autojoin_invites:
+                member_mxids = await self._sync_telegram_users(user, members, client=client)
+            return members, member_mxids
+
+        # The portal info, the alias cleanup and the member list only depend on the entity,
+        # so fetch them all at once instead of one after another.
+        _, _, (users, member_mxids) = await asyncio.gather(
+            update_info(), remove_alias(), fetch_members()
+        )
+        if alias:
+            self.username = entity.username
+        if self.is_direct:
+            if self.tgid == user.tgid:
+                self.about = "Your Telegram cloud storage chat"
             self.title = puppet.displayname
+            self.avatar_url = puppet.avatar_url
+            self.photo_id = puppet.photo_id
 
         initial_state = [
             {
@@ -995,13 +1073,10 @@ class Portal(DBPortal, BasePortal):
                 "content": self.bridge_info,
             },
         ]
-        autojoin_invites = self.bridge.homeserver_software.is_hungry
         create_invites = set()
         if autojoin_invites:
-            create_invites |= set(invites)
+            create_invites |= set(invites) | member_mxids
             invites = []
-            if not self.is_direct:
-                create_invites |= await self._sync_telegram_users(user, users, client=client)
         if self.config["bridge.encryption.default"] and self.matrix.e2ee:
             self.encrypted = True
             initial_state.append(
@@ -1012,11 +1087,6 @@ class Portal(DBPortal, BasePortal):
             )
             if self.is_direct:
                 create_invites.add(self.az.bot_mxid)
-        if self.is_direct:
-            assert puppet is not None
-            self.title = puppet.displayname
-            self.avatar_url = puppet.avatar_url
-            self.photo_id = puppet.photo_id
         creation_content = {}
         if not self.config["bridge.federate_rooms"]:
             creation_content["m.federate"] = False
@@ -1028,7 +1098,10 @@ class Portal(DBPortal, BasePortal):
                 }
             )
 
-        with self.backfill_lock:
+        with ExitStack() as backfill_lock:
+            # New messages must wait until the initial backfill is done, so the lock is
+            # held from here until the backfill task finishes.
+            backfill_lock.enter_context(self.backfill_lock)
             self.log.debug(
                 f"Creating room with parameters invite={create_invites}, {autojoin_invites=}, "
                 f"{preset=}, {alias=!r}, name={self.title!r}, topic={self.about!r}, "
@@ -1063,18 +1136,15 @@ class Portal(DBPortal, BasePortal):
             self.log.debug(f"Matrix room created: {self.mxid}")
             await self.az.state_store.set_power_levels(self.mxid, power_levels)
             await user.register_portal(self)
-            if dialog and isinstance(user, u.User):
-                await user.post_sync_dialog(
-                    self, puppet=None, was_created=True, **user.dialog_to_sync_args(dialog)
-                )
 
-            if not autojoin_invites or not self.is_direct:
-                await self.invite_to_matrix(invites)
-                await self.update_matrix_room(
-                    user, entity, puppet, levels=power_levels, users=users, client=client
+            # The room info and power levels were already included in the initial state,
+            # so only the members that couldn't be autojoined need to be synced.
+            if not autojoin_invites:
+                await asyncio.gather(
+                    self.invite_to_matrix(invites),
+                    self._sync_new_room_members(user, users, client),
                 )
-            else:
-                # When using autojoining, all metadata is already set, so just update state caches
+            if autojoin_invites or self.sync_matrix_state:
                 await self.main_intent.get_joined_members(self.mxid)
 
             self.first_event_id = await self.main_intent.send_message_event(
@@ -1083,15 +1153,50 @@ class Portal(DBPortal, BasePortal):
             await self.save()
 
             if self.backfill_enable:
-                try:
-                    await self.forward_backfill(user, initial=True, client=client)
-                except Exception:
-                    self.log.exception("Error in initial backfill")
-                if self._enable_batch_sending:
-                    await self.enqueue_backfill(user, priority=50)
+                backfill = self._initial_backfill(user, client, backfill_lock.pop_all(), dialog)
+                if wait_for_backfill:
+                    await backfill
+                else:
+                    background_task.create(backfill)
+            else:
+                await self._post_sync_new_dialog(user, dialog)
 
         return self.mxid
 
+    async def _sync_new_room_members(
+        self, user: au.AbstractUser, users: list[User] | None, client: MautrixTelegramClient
+    ) -> None:
+        try:
+            if self.is_direct:
+                await self._ensure_double_puppet_joined(user)
+            else:
+                await self._sync_telegram_users(user, users, client=client)
+        except Exception:
+            self.log.exception("Failed to sync members of new Matrix room")
+
+    async def _initial_backfill(
+        self,
+        user: au.AbstractUser,
+        client: MautrixTelegramClient,
+        backfill_lock: ExitStack,
+        dialog: Dialog | None = None,
+    ) -> None:
+        with backfill_lock:
+            try:
+                await self.forward_backfill(user, initial=True, client=client)
+            except Exception:
+                self.log.exception("Error in initial backfill")
+            if self._enable_batch_sending:
+                await self.enqueue_backfill(user, priority=50)
+        # Read markers can only be set once the backfilled messages exist
+        await self._post_sync_new_dialog(user, dialog)
+
+    async def _post_sync_new_dialog(self, user: au.AbstractUser, dialog: Dialog | None) -> None:
+        if dialog and isinstance(user, u.User):
+            await user.post_sync_dialog(
+                self, puppet=None, was_created=True, **user.dialog_to_sync_args(dialog)
+            )
+
     async def _get_users(
         self,
         client: MautrixTelegramClient,
@@ -1135,30 +1240,37 @@ class Portal(DBPortal, BasePortal):
         users: list[User],
         client: MautrixTelegramClient | None = None,
     ) -> set[UserID] | None:
-        allowed_tgids = set()
+        allowed_tgids = {TelegramID(entity.id) for entity in users}
         join_mxids = set()
         skip_deleted = self.config["bridge.skip_deleted_members"]
-        for entity in users:
-            puppet = await p.Puppet.get_by_tgid(TelegramID(entity.id))
-            if entity.bot:
-                await self._add_bot_chat(entity)
-            allowed_tgids.add(entity.id)
-
-            await puppet.update_info(source, entity, client_override=client)
-            if skip_deleted and entity.deleted:
-                continue
-
-            if self.mxid:
-                await puppet.intent_for(self).ensure_joined(self.mxid)
-            else:
-                join_mxids.add(puppet.intent_for(self).mxid)
+        puppets = await p.Puppet.get_many_by_tgid(allowed_tgids)
+        mx_users = await u.User.get_many_by_tgid(allowed_tgids)
+        sema = asyncio.Semaphore(self.member_sync_concurrency)
+
+        async def sync_member(entity: User) -> None:
+            tgid = TelegramID(entity.id)
+            async with sema:
+                puppet = puppets.get(tgid) or await p.Puppet.get_by_tgid(tgid)
+                if entity.bot:
+                    await self._add_bot_chat(entity)
+
+                await puppet.update_info(source, entity, client_override=client)
+                if skip_deleted and entity.deleted:
+                    return
 
-            user = await u.User.get_by_tgid(TelegramID(entity.id))
-            if user:
                 if self.mxid:
-                    await self.invite_to_matrix(user.mxid)
+                    await puppet.intent_for(self).ensure_joined(self.mxid)
                 else:
-                    join_mxids.add(user.mxid)
+                    join_mxids.add(puppet.intent_for(self).mxid)
+
+                user = mx_users.get(tgid)
+                if user:
+                    if self.mxid:
+                        await self.invite_to_matrix(user.mxid)
+                    else:
+                        join_mxids.add(user.mxid)
+
+        await asyncio.gather(*[sync_member(entity) for entity in users])
 
         if not self.mxid:
             return join_mxids
@@ -1566,6 +1678,7 @@ class Portal(DBPortal, BasePortal):
                 " in preparation for sending new one"
             )
             await self.main_intent.redact(self.mxid, self.sponsored_event_id)
+            self.recent_events.remove(self.sponsored_event_id)
         content = await putil.make_sponsored_message_content(user, msg, entity)
         self.log.trace("Sending sponsored message")
         self.sponsored_event_id = await self._send_message(self.main_intent, content)
@@ -1625,6 +1738,12 @@ class Portal(DBPortal, BasePortal):
     async def mark_read(self, user: u.User, event_id: EventID, timestamp: int) -> None:
         if user.is_bot:
             return
+        if self.peer_type == "channel" and not self.megagroup:
+            # This isn't coalesced, because receipts for the sponsored message itself don't point
+            # at a bridged message and would be dropped by the coalescer.
+            background_task.create(
+                self._try_handle_read_for_sponsored_msg(user, event_id, timestamp)
+            )
         space = self.tgid if self.peer_type == "channel" else user.tgid
         message = await DBMessage.get_by_mxid(event_id, self.mxid, space)
         if not message:
@@ -1646,16 +1765,16 @@ class Portal(DBPortal, BasePortal):
                 "Handling Matrix read receipt: marking messages up to "
                 f"{message.mxid}/{message.tgid} as read by {user.mxid}/{user.tgid}"
             )
+        await self.read_receipts.queue(user, message, event_id, timestamp)
+
+    async def send_read_receipt(
+        self, user: u.User, message: DBMessage, event_id: EventID, timestamp: int
+    ) -> None:
         await user.client.send_read_acknowledge(
             self.peer, max_id=message.tgid, clear_mentions=True, clear_reactions=True
         )
-        if self.peer_type == "channel":
-            if not self.megagroup:
-                background_task.create(
-                    self._try_handle_read_for_sponsored_msg(user, event_id, timestamp)
-                )
-            else:
-                background_task.create(self._poll_telegram_reactions(user))
+        if self.peer_type == "channel" and self.megagroup:
+            background_task.create(self._poll_telegram_reactions(user))
 
     async def _preproc_kick_ban(
         self, user: u.User | p.Puppet, source: u.User
@@ -1853,6 +1972,175 @@ class Portal(DBPortal, BasePortal):
         caption: TextMessageEventContent = None,
     ) -> None:
         sender_id = sender.tgid if logged_in else self.bot.tgid
+        mxc = content.file.url if content.file else content.url
+        known_file = await DBTelegramFile.find_reusable_by_mxc(mxc) if mxc else None
+        mxc_from_telegram = known_file is not None
+        media = util.get_input_media(known_file) if known_file else None
+        if (
+            isinstance(media, InputMediaDocument)
+            and known_file.file_name
+            and known_file.file_name != file_name
+        ):
+            # Telegram documents are always re-sent with their original attributes,
+            # so a file that was renamed on Matrix has to be uploaded again.
+            self.log.debug(
+                f"Not reusing Telegram media {known_file.id} for {event_id}: file name changed"
+            )
+            media = None
+        if media:
+            self.log.debug(f"Reusing Telegram media {known_file.id} to send {event_id}")
+            mime, attributes = content.info.mimetype, []
+        else:
+            known_file = None
+            media, mime, attributes = await self._upload_matrix_file(
+                client, content, event_id, file_name
+            )
+
+        capt, entities = (
+            await formatter.matrix_to_telegram(
+                client, text=caption.body, html=caption.formatted(Format.HTML)
+            )
+            if caption
+            else (None, None)
+        )
+
+        async with self.send_lock(sender_id):
+            if await self._matrix_document_edit(
+                sender, sender_id, client, content, space, capt, entities, media, event_id
+            ):
+                return
+            try:
+                try:
+                    response = await self._send_matrix_file_media(
+                        client, media, mime, attributes, reply_to, capt, entities
+                    )
+                except (
+                    FileReferenceEmptyError,
+                    FileReferenceExpiredError,
+                    FileReferenceInvalidError,
+                    MediaEmptyError,
+                ) as e:
+                    if not known_file:
+                        raise
+                    self.log.debug(
+                        f"Failed to reuse Telegram media {known_file.id} ({type(e).__name__}),"
+                        " refreshing file reference"
+                    )
+                    media = await self._refresh_known_file_media(client, known_file)
+                    response = None
+                    if media:
+                        try:
+                            response = await self._send_matrix_file_media(
+                                client, media, mime, attributes, reply_to, capt, entities
+                            )
+                        except (
+                            FileReferenceEmptyError,
+                            FileReferenceExpiredError,
+                            FileReferenceInvalidError,
+                            MediaEmptyError,
+                        ) as e:
+                            self.log.debug(
+                                f"Failed to reuse refreshed Telegram media {known_file.id}"
+                                f" ({type(e).__name__})"
+                            )
+                    if not response:
+                        self.log.debug(f"Uploading {mxc} instead of reusing {known_file.id}")
+                        known_file = None
+                        media, mime, attributes = await self._upload_matrix_file(
+                            client, content, event_id, file_name
+                        )
+                        response = await self._send_matrix_file_media(
+                            client, media, mime, attributes, reply_to, capt, entities
+                        )
+            except Exception:
+                raise
+            else:
+                await self._mark_matrix_handled(
+                    sender=sender,
+                    sender_tgid=sender_id,
+                    event_type=EventType.ROOM_MESSAGE,
+                    event_id=event_id,
+                    space=space,
+                    edit_index=0,
+                    response=response,
+                    msgtype=content.msgtype,
+                )
+        if not known_file and mxc_from_telegram and response:
+            # Remember the fresh file reference, since the mxc came from Telegram originally
+            input_media = util.message_media_to_input_media(response.media)
+            if input_media:
+                await DBTelegramFile.set_input_media(mxc, input_media)
+
+    async def _refresh_known_file_media(
+        self, client: MautrixTelegramClient, known_file: DBTelegramFile
+    ) -> TypeInputMedia | None:
+        """
+        Get a fresh file reference for a previously transferred file by re-fetching the
+        Telegram message it was transferred from.
+        """
+        if not known_file.source_msg_id:
+            return None
+        portal = await self.get_by_tgid(
+            TelegramID(known_file.source_chat_id),
+            tg_receiver=TelegramID(known_file.source_receiver),
+        )
+        if not portal:
+            return None
+        try:
+            message = await client.get_messages(portal.peer, ids=known_file.source_msg_id)
+        except (RPCError, ValueError) as e:
+            self.log.debug(
+                f"Failed to fetch source message {known_file.source_msg_id} of"
+                f" {known_file.id} in {portal.tgid_log}: {e}"
+            )
+            return None
+        input_media = util.message_media_to_input_media(getattr(message, "media", None))
+        if not input_media:
+            return None
+        old_media = util.get_input_media(known_file)
+        known_file.input_media = input_media
+        media = util.get_input_media(known_file)
+        if not old_media or not media or media.id.id != old_media.id.id:
+            # The message was edited or deleted and the ID now points at something else
+            return None
+        await DBTelegramFile.set_input_media(known_file.mxc, input_media)
+        return media
+
+    async def _send_matrix_file_media(
+        self,
+        client: MautrixTelegramClient,
+        media: TypeInputMedia,
+        mime: str | None,
+        attributes: list[TypeDocumentAttribute],
+        reply_to: TelegramID,
+        caption: str | None,
+        entities: list[TypeMessageEntity] | None,
+    ) -> Message:
+        try:
+            return await client.send_media(
+                self.peer, media, reply_to=reply_to, caption=caption, entities=entities
+            )
+        except (
+            PhotoInvalidDimensionsError,
+            PhotoSaveFileInvalidError,
+            PhotoExtInvalidError,
+        ):
+            if not isinstance(media, InputMediaUploadedPhoto):
+                raise
+            media = InputMediaUploadedDocument(
+                file=media.file, mime_type=mime, attributes=attributes
+            )
+            return await client.send_media(
+                self.peer, media, reply_to=reply_to, caption=caption, entities=entities
+            )
+
+    async def _upload_matrix_file(
+        self,
+        client: MautrixTelegramClient,
+        content: MediaMessageEventContent,
+        event_id: EventID,
+        file_name: str,
+    ) -> tuple[TypeInputMedia, str | None, list[TypeDocumentAttribute]]:
         mime = content.info.mimetype
         if isinstance(content.info, (ImageInfo, VideoInfo)):
             w, h = content.info.width, content.info.height
@@ -1864,7 +2152,7 @@ class Portal(DBPortal, BasePortal):
         attributes = []
         if self.config["bridge.parallel_file_transfer"] and content.url:
             file_handle, file_size = await util.parallel_transfer_to_telegram(
-                client, self.main_intent, content.url, sender_id
+                client, self.main_intent, content.url
             )
         else:
             if content.file:
@@ -1886,7 +2174,7 @@ class Portal(DBPortal, BasePortal):
                     file_name = "sticker.gif"
                 else:
                     if mime not in ("video/webm", "application/x-tgsticker"):
-                        mime, file, w, h = util.convert_image(
+                        mime, file, w, h = await util.convert_image(
                             file, source_mime=mime, target_type="webp"
                         )
                     attributes.append(
@@ -1937,49 +2225,7 @@ class Portal(DBPortal, BasePortal):
                 attributes=attributes,
                 mime_type=mime or "application/octet-stream",
             )
-
-        capt, entities = (
-            await formatter.matrix_to_telegram(
-                client, text=caption.body, html=caption.formatted(Format.HTML)
-            )
-            if caption
-            else (None, None)
-        )
-
-        async with self.send_lock(sender_id):
-            if await self._matrix_document_edit(
-                sender, sender_id, client, content, space, capt, entities, media, event_id
-            ):
-                return
-            try:
-                try:
-                    response = await client.send_media(
-                        self.peer, media, reply_to=reply_to, caption=capt, entities=entities
-                    )
-                except (
-                    PhotoInvalidDimensionsError,
-                    PhotoSaveFileInvalidError,
-                    PhotoExtInvalidError,
-                ):
-                    media = InputMediaUploadedDocument(
-                        file=media.file, mime_type=mime, attributes=attributes
-                    )
-                    response = await client.send_media(
-                        self.peer, media, reply_to=reply_to, caption=capt, entities=entities
-                    )
-            except Exception:
-                raise
-            else:
-                await self._mark_matrix_handled(
-                    sender=sender,
-                    sender_tgid=sender_id,
-                    event_type=EventType.ROOM_MESSAGE,
-                    event_id=event_id,
-                    space=space,
-                    edit_index=0,
-                    response=response,
-                    msgtype=content.msgtype,
-                )
+        return media, mime, attributes
 
     async def _matrix_document_edit(
         self,
@@ -2206,8 +2452,11 @@ class Portal(DBPortal, BasePortal):
             )
             return
 
+        # Cache the content as it was sent, before it's modified for bridging (e.g. relay mode)
+        original_content = content.serialize()
         try:
             await self._handle_matrix_message(sender, content, event_id)
+            self.recent_events.add(self.mxid, event_id, sender.mxid, original_content)
         except RPCError as e:
             self.log.exception(f"RPCError while bridging {event_id}: {e}")
             await self._send_bridge_error(
@@ -2416,6 +2665,7 @@ class Portal(DBPortal, BasePortal):
     async def handle_matrix_deletion(
         self, deleter: u.User, event_id: EventID, redaction_event_id: EventID
     ) -> None:
+        self.recent_events.remove(event_id)
         try:
             await self._handle_matrix_deletion(deleter, event_id)
         except IgnoredMessageError as e:
@@ -2754,6 +3004,20 @@ class Portal(DBPortal, BasePortal):
     # endregion
     # region Telegram -> Matrix bridging
 
+    async def _send_message(
+        self,
+        intent: IntentAPI,
+        content: MessageEventContent,
+        event_type: EventType = EventType.ROOM_MESSAGE,
+        **kwargs,
+    ) -> EventID:
+        event_id = await super()._send_message(intent, content, event_type, **kwargs)
+        if event_type == EventType.ROOM_MESSAGE:
+            self.recent_events.add(
+                self.mxid, event_id, intent.mxid, content, timestamp=kwargs.get("timestamp")
+            )
+        return event_id
+
     async def handle_telegram_typing(self, user: p.Puppet, update: UpdateTyping) -> None:
         if user.is_real_user:
             # Ignore typing notifications from double puppeted users to avoid echoing
@@ -3013,21 +3277,73 @@ class Portal(DBPortal, BasePortal):
             self.log.debug("No more messages to backfill")
         return f"Backfilled {event_count} messages"
 
+    @staticmethod
+    def _get_batch_msg_sender(source: u.User, msg: Message) -> PeerUser | PeerChannel | None:
+        if msg.from_id and isinstance(msg.from_id, (PeerUser, PeerChannel)):
+            return msg.from_id
+        elif isinstance(msg.peer_id, PeerUser):
+            return PeerUser(source.tgid) if msg.out else msg.peer_id
+        return None
+
+    async def _prefetch_batch_msgs(
+        self, source: u.User, client: MautrixTelegramClient, msgs: list[Message]
+    ) -> BackfillPrefetch:
+        tg_space = self.tgid if self.peer_type == "channel" else source.tgid
+        reply_ids = {
+            TelegramID(msg.reply_to.reply_to_msg_id)
+            for msg in msgs
+            if isinstance(msg.reply_to, MessageReplyHeader)
+            and msg.reply_to.reply_to_msg_id
+            and (not msg.reply_to.reply_to_peer_id or msg.reply_to.reply_to_peer_id == msg.peer_id)
+        }
+        reply_targets: putil.ReplyTargets = {(tgid, tg_space): None for tgid in reply_ids}
+        if reply_ids:
+            for dbm in await DBMessage.get_first_by_tgids(list(reply_ids), tg_space):
+                reply_targets[(dbm.tgid, tg_space)] = dbm
+
+        sender_peers = {}
+        for msg in msgs:
+            if peer := self._get_batch_msg_sender(source, msg):
+                sender_peers[p.Puppet.get_id_from_peer(peer)] = peer
+        puppets = await p.Puppet.get_many_by_tgid(sender_peers.keys())
+        new_puppets = await asyncio.gather(
+            *(
+                p.Puppet.get_by_peer(peer)
+                for tgid, peer in sender_peers.items()
+                if tgid not in puppets
+            )
+        )
+        puppets.update((puppet.tgid, puppet) for puppet in new_puppets)
+
+        # Fetch the info of all unknown senders at once instead of one by one when converting
+        missing_info = [puppet for puppet in puppets.values() if not puppet.displayname]
+        if missing_info:
+            try:
+                entities = await client.get_entity([puppet.peer for puppet in missing_info])
+            except Exception as e:
+                self.log.warning(f"Failed to prefetch info of {len(missing_info)} senders: {e}")
+            else:
+                await asyncio.gather(
+                    *(
+                        puppet.update_info(source, entity, client_override=client)
+                        for puppet, entity in zip(missing_info, entities)
+                    )
+                )
+        return BackfillPrefetch(puppets=puppets, reply_targets=reply_targets)
+
     async def _convert_batch_msg(
         self,
         source: u.User,
         client: MautrixTelegramClient,
         msg: Message,
+        prefetch: BackfillPrefetch | None = None,
     ) -> tuple[putil.ConvertedMessage, IntentAPI]:
-        if msg.from_id and isinstance(msg.from_id, (PeerUser, PeerChannel)):
-            sender = await p.Puppet.get_by_peer(msg.from_id)
-        elif isinstance(msg.peer_id, PeerUser):
-            if msg.out:
-                sender = await p.Puppet.get_by_tgid(source.tgid)
-            else:
-                sender = await p.Puppet.get_by_peer(msg.peer_id)
-        else:
-            sender = None
+        sender = None
+        if sender_peer := self._get_batch_msg_sender(source, msg):
+            if prefetch:
+                sender = prefetch.puppets.get(p.Puppet.get_id_from_peer(sender_peer))
+            if not sender:
+                sender = await p.Puppet.get_by_peer(sender_peer)
         if sender:
             intent = sender.intent_for(self)
             if not sender.displayname:
@@ -3050,6 +3366,8 @@ class Portal(DBPortal, BasePortal):
             msg,
             client=client,
             deterministic_reply_id=self.bridge.homeserver_software.is_hungry,
+            priority=util.TransferPriority.BACKFILL,
+            reply_targets=prefetch.reply_targets if prefetch else None,
         )
         return converted, intent
 
@@ -3079,74 +3397,89 @@ class Portal(DBPortal, BasePortal):
             event_id=event_id,
         )
 
-    async def _backfill_messages(
+    async def _convert_backfill_msg(
+        self,
+        source: u.User,
+        client: MautrixTelegramClient,
+        msg: Message,
+        convert_sema: asyncio.Semaphore,
+        prefetch: BackfillPrefetch | None = None,
+    ) -> tuple[putil.ConvertedMessage | None, IntentAPI]:
+        async with convert_sema:
+            return await self._convert_batch_msg(source, client, msg, prefetch)
+
+    async def _queue_backfill_page(
         self,
         source: u.User,
         client: MautrixTelegramClient,
+        page: list[Message],
+        queue: asyncio.Queue[tuple[Message, asyncio.Task] | None],
+        convert_sema: asyncio.Semaphore,
+    ) -> None:
+        try:
+            prefetch = await self._prefetch_batch_msgs(source, client, page)
+        except Exception:
+            self.log.exception("Failed to prefetch backfill page, converting without prefetch")
+            prefetch = None
+        for msg in page:
+            convert_task = asyncio.create_task(
+                self._convert_backfill_msg(source, client, msg, convert_sema, prefetch)
+            )
+            await queue.put((msg, convert_task))
+
+    async def _fetch_backfill_msgs(
+        self,
+        source: u.User,
+        client: MautrixTelegramClient,
+        entity: TypeInputPeer,
         forward: bool,
         anchor_id: int,
         limit: int,
-    ) -> tuple[int, int, TelegramID]:
-        entity = await self.get_input_entity(source)
-        events = []
-        intents = []
-        metas = []
-        tg_space = self.tgid if self.peer_type == "channel" else source.tgid
-
-        lowest_id = 0
-        first_id_found = False
-        first_id = anchor_id
-        message_count = 0
-        minmax = {"min_id": anchor_id} if forward else {"max_id": anchor_id}
-        if not forward and not anchor_id:
-            anchor_id = 2**31 - 1
-            minmax = {}
-        self.log.debug(f"Iterating messages through {source.tgid} with {limit=}, {minmax}")
-        delay_warn_handle = self.loop.call_later(
-            5 * 60, lambda: self.log.warning("Iterating messages is taking long")
-        )
-        # Iterate messages newest to oldest and collect the results
-        async for msg in client.iter_messages(entity, limit=limit, **minmax):
-            message_count += 1
-            if message_count == 1:
-                self.log.debug(f"Backfill iter: got first message {msg.id}")
-            elif message_count % 50 == 0:
-                self.log.debug(f"Backfill iter: got {message_count} messages so far (at {msg.id})")
-            if (forward and msg.id <= anchor_id) or (not forward and msg.id >= anchor_id):
-                continue
-            elif isinstance(msg, MessageService):
-                # TODO some service messages can be backfilled
-                continue
-            if not lowest_id or msg.id < lowest_id:
-                lowest_id = msg.id
-            if not first_id_found:
-                first_id = msg.id
-                first_id_found = True
-
-            converted, intent = await self._convert_batch_msg(source, client, msg)
-            if converted is None:
-                continue
-            d_event_id = None
-            if self.bridge.homeserver_software.is_hungry:
-                d_event_id = self._msg_conv.deterministic_event_id(tg_space, msg.id)
-            events.append(await self._wrap_batch_msg(intent, msg, converted, event_id=d_event_id))
-            intents.append(intent)
-            metas.append(msg)
-            if converted.caption:
-                events.append(await self._wrap_batch_msg(intent, msg, converted, caption=True))
-                intents.append(intent)
-                metas.append(None)
-        delay_warn_handle.cancel()
-        if len(events) == 0:
-            self.log.debug(
-                f"Didn't get any events to send out of {message_count} messages fetched "
-                f"(first received ID: {first_id}, lowest: {lowest_id})"
-            )
-            return 0, message_count, lowest_id
-        self.log.debug(
-            f"Got {len(events)} events to send out of {message_count} messages fetched "
-            f"(first received ID: {first_id}, lowest: {lowest_id})"
-        )
+        minmax: dict[str, int],
+        queue: asyncio.Queue[tuple[Message, asyncio.Task] | None],
+        convert_sema: asyncio.Semaphore,
+        stats: dict[str, int],
+    ) -> None:
+        page: list[Message] = []
+        try:
+            # Iterate messages newest to oldest and start converting them a page at a time,
+            # so that the senders and reply targets of a page can be looked up in bulk.
+            async for msg in client.iter_messages(entity, limit=limit, **minmax):
+                stats["message_count"] += 1
+                message_count = stats["message_count"]
+                if message_count == 1:
+                    self.log.debug(f"Backfill iter: got first message {msg.id}")
+                elif message_count % 50 == 0:
+                    self.log.debug(
+                        f"Backfill iter: got {message_count} messages so far (at {msg.id})"
+                    )
+                if (forward and msg.id <= anchor_id) or (not forward and msg.id >= anchor_id):
+                    continue
+                elif isinstance(msg, MessageService):
+                    # TODO some service messages can be backfilled
+                    continue
+                if not stats["lowest_id"] or msg.id < stats["lowest_id"]:
+                    stats["lowest_id"] = msg.id
+                if not stats["first_id_found"]:
+                    stats["first_id"] = msg.id
+                    stats["first_id_found"] = True
+                page.append(msg)
+                if len(page) >= BACKFILL_PREFETCH_PAGE_SIZE:
+                    await self._queue_backfill_page(source, client, page, queue, convert_sema)
+                    page = []
+            if page:
+                await self._queue_backfill_page(source, client, page, queue, convert_sema)
+        finally:
+            await queue.put(None)
+
+    async def _send_backfill_batch(
+        self,
+        source: u.User,
+        forward: bool,
+        events: list[BatchSendEvent],
+        intents: list[IntentAPI],
+        metas: list[Message | None],
+    ) -> None:
         if self._enable_batch_sending:
             resp = await self.main_intent.beeper_batch_send(
                 self.mxid,
@@ -3181,7 +3514,110 @@ class Portal(DBPortal, BasePortal):
                 if msg is not None
             ]
         )
-        return len(events), message_count, lowest_id
+
+    async def _backfill_messages(
+        self,
+        source: u.User,
+        client: MautrixTelegramClient,
+        forward: bool,
+        anchor_id: int,
+        limit: int,
+    ) -> tuple[int, int, TelegramID]:
+        entity = await self.get_input_entity(source)
+        events = []
+        intents = []
+        metas = []
+        tg_space = self.tgid if self.peer_type == "channel" else source.tgid
+
+        convert_concurrency = max(self.config["bridge.backfill.pipeline.convert_concurrency"], 1)
+        send_batch_size = self.config["bridge.backfill.pipeline.send_batch_size"]
+        # Historical batches are inserted before the oldest event in the room, so newer chunks
+        # can be sent as soon as they're ready. Forward backfills and non-batch sending must
+        # send everything in chronological order, so those are only sent after iterating.
+        stream_send = not forward and self._enable_batch_sending and send_batch_size > 0
+        convert_sema = asyncio.Semaphore(convert_concurrency)
+        queue: asyncio.Queue[tuple[Message, asyncio.Task] | None] = asyncio.Queue(
+            maxsize=convert_concurrency * 2
+        )
+        stats = {
+            "message_count": 0,
+            "lowest_id": 0,
+            "first_id": anchor_id,
+            "first_id_found": False,
+        }
+        event_count = 0
+
+        minmax = {"min_id": anchor_id} if forward else {"max_id": anchor_id}
+        if not forward and not anchor_id:
+            anchor_id = 2**31 - 1
+            minmax = {}
+        self.log.debug(f"Iterating messages through {source.tgid} with {limit=}, {minmax}")
+        delay_warn_handle = self.loop.call_later(
+            5 * 60, lambda: self.log.warning("Iterating messages is taking long")
+        )
+        fetch_task = asyncio.create_task(
+            self._fetch_backfill_msgs(
+                source,
+                client,
+                entity,
+                forward,
+                anchor_id,
+                limit,
+                minmax,
+                queue,
+                convert_sema,
+                stats,
+            )
+        )
+        try:
+            while (item := await queue.get()) is not None:
+                msg, convert_task = item
+                converted, intent = await convert_task
+                if converted is None:
+                    continue
+                d_event_id = None
+                if self.bridge.homeserver_software.is_hungry:
+                    d_event_id = self._msg_conv.deterministic_event_id(tg_space, msg.id)
+                events.append(
+                    await self._wrap_batch_msg(intent, msg, converted, event_id=d_event_id)
+                )
+                intents.append(intent)
+                metas.append(msg)
+                if converted.caption:
+                    events.append(await self._wrap_batch_msg(intent, msg, converted, caption=True))
+                    intents.append(intent)
+                    metas.append(None)
+                if stream_send and len(events) >= send_batch_size:
+                    self.log.debug(f"Sending {len(events)} backfilled events (streamed batch)")
+                    await self._send_backfill_batch(source, forward, events, intents, metas)
+                    event_count += len(events)
+                    events, intents, metas = [], [], []
+            # Re-raise errors from iterating messages
+            await fetch_task
+        finally:
+            delay_warn_handle.cancel()
+            if not fetch_task.done():
+                fetch_task.cancel()
+            while not queue.empty():
+                if (item := queue.get_nowait()) is not None:
+                    item[1].cancel()
+        message_count = stats["message_count"]
+        lowest_id = stats["lowest_id"]
+        first_id = stats["first_id"]
+        if len(events) == 0 and event_count == 0:
+            self.log.debug(
+                f"Didn't get any events to send out of {message_count} messages fetched "
+                f"(first received ID: {first_id}, lowest: {lowest_id})"
+            )
+            return 0, message_count, lowest_id
+        self.log.debug(
+            f"Got {event_count + len(events)} events to send out of {message_count} messages "
+            f"fetched (first received ID: {first_id}, lowest: {lowest_id})"
+        )
+        if len(events) > 0:
+            await self._send_backfill_batch(source, forward, events, intents, metas)
+            event_count += len(events)
+        return event_count, message_count, lowest_id
 
     def _split_dm_reaction_counts(self, counts: list[ReactionCount]) -> list[MessagePeerReaction]:
         reactions = []
@@ -3330,9 +3766,7 @@ class Portal(DBPortal, BasePortal):
         return False
 
     @staticmethod
-    async def _get_reaction_limit(source: au.AbstractUser, sender: TelegramID) -> int:
-        puppet = await p.Puppet.get_by_tgid(sender, create=False)
-        is_premium = puppet and puppet.is_premium
+    async def _get_reaction_limit(source: au.AbstractUser, is_premium: bool | None) -> int:
         if isinstance(source, u.User) and not source.is_bot:
             return await source.get_max_reactions(is_premium)
         return 3 if is_premium else 1
@@ -3380,6 +3814,21 @@ class Portal(DBPortal, BasePortal):
         custom_emojis = await util.transfer_custom_emojis_to_matrix(source, custom_emoji_ids)
 
         existing_reactions = await DBReaction.get_all_by_message(msg.mxid, msg.mx_room)
+        puppets = await p.Puppet.get_many_by_tgid(
+            reactions.keys() | {reaction.tg_sender for reaction in existing_reactions}
+        )
+        reaction_limits: dict[bool | None, int] = {}
+
+        async def get_reaction_limit(sender_id: TelegramID) -> int:
+            sender_puppet = puppets.get(sender_id)
+            is_premium = sender_puppet.is_premium if sender_puppet else None
+            try:
+                return reaction_limits[is_premium]
+            except KeyError:
+                limit = reaction_limits[is_premium] = await self._get_reaction_limit(
+                    source, is_premium
+                )
+                return limit
 
         removed: list[DBReaction] = []
         for existing_reaction in existing_reactions:
@@ -3393,11 +3842,42 @@ class Portal(DBPortal, BasePortal):
             else:
                 if is_full or (
                     new_reactions is not None
-                    and len(new_reactions) == await self._get_reaction_limit(source, sender_id)
+                    and len(new_reactions) == await get_reaction_limit(sender_id)
                 ):
                     removed.append(existing_reaction)
                 # else: assume the reaction is still there, too much effort to fetch it
 
+        sema = asyncio.Semaphore(self.max_concurrent_reactions)
+
+        async def get_puppet(sender_id: TelegramID) -> p.Puppet:
+            return puppets.get(sender_id) or await p.Puppet.get_by_tgid(sender_id)
+
+        async def add_reaction(
+            sender_id: TelegramID, emoji_id: str, matrix_reaction: str, date: datetime | None
+        ) -> DBReaction:
+            async with sema:
+                puppet = await get_puppet(sender_id)
+                mxid = await puppet.intent_for(self).react(
+                    msg.mx_room, msg.mxid, matrix_reaction, timestamp=date
+                )
+            return DBReaction(
+                mxid=mxid,
+                mx_room=msg.mx_room,
+                msg_mxid=msg.mxid,
+                tg_sender=sender_id,
+                reaction=emoji_id,
+            )
+
+        async def remove_reaction(reaction: DBReaction) -> DBReaction:
+            self.log.debug(
+                f"Removing reaction {reaction.reaction} by {reaction.tg_sender} to {msg.tgid}"
+            )
+            async with sema:
+                puppet = await get_puppet(reaction.tg_sender)
+                await puppet.intent_for(self).redact(reaction.mx_room, reaction.mxid)
+            return reaction
+
+        additions = []
         new_reaction: TypeReaction
         for sender, new_reactions in reactions.items():
             for new_wrapped_reaction in new_reactions:
@@ -3416,28 +3896,18 @@ class Portal(DBPortal, BasePortal):
                     self.log.warning("Unknown reaction type %s", type(new_reaction))
                     continue
                 self.log.debug(f"Bridging reaction {emoji_id} by {sender} to {msg.tgid}")
-                puppet: p.Puppet = await p.Puppet.get_by_tgid(sender)
-                mxid = await puppet.intent_for(self).react(
-                    msg.mx_room,
-                    msg.mxid,
-                    matrix_reaction,
-                    timestamp=new_wrapped_reaction.date or timestamp,
+                additions.append(
+                    add_reaction(
+                        sender, emoji_id, matrix_reaction, new_wrapped_reaction.date or timestamp
+                    )
                 )
-                await DBReaction(
-                    mxid=mxid,
-                    mx_room=msg.mx_room,
-                    msg_mxid=msg.mxid,
-                    tg_sender=sender,
-                    reaction=emoji_id,
-                ).save()
-        for removed_reaction in removed:
-            self.log.debug(
-                f"Removing reaction {removed_reaction.reaction} by {removed_reaction.tg_sender} "
-                f"to {msg.tgid}"
-            )
-            puppet = await p.Puppet.get_by_tgid(removed_reaction.tg_sender)
-            await puppet.intent_for(self).redact(removed_reaction.mx_room, removed_reaction.mxid)
-            await removed_reaction.delete()
+        added = await asyncio.gather(*additions, return_exceptions=True)
+        deleted = await asyncio.gather(*map(remove_reaction, removed), return_exceptions=True)
+        await DBReaction.bulk_save([react for react in added if isinstance(react, DBReaction)])
+        await DBReaction.bulk_delete([react for react in deleted if isinstance(react, DBReaction)])
+        for result in (*added, *deleted):
+            if isinstance(result, BaseException):
+                raise result
 
     async def handle_telegram_message(
         self, source: au.AbstractUser, sender: p.Puppet | None, evt: Message
@@ -3475,6 +3945,9 @@ class Portal(DBPortal, BasePortal):
             if not self.mxid:
                 self.log.warning("Room doesn't exist even after creating, dropping %d", evt.id)
                 return
+            # The initial backfill runs in the background and may include this message.
+            # Waiting through the source frees its update dispatch slot for other chats.
+            await source._wait_for_backfill(self, f"message {evt.id}")
 
         if (
             self.peer_type == "user"
@@ -3496,7 +3969,13 @@ class Portal(DBPortal, BasePortal):
             temporary_identifier = EventID(
                 f"${random.randint(1000000000000, 9999999999999)}TGBRIDGETEMP"
             )
+            try:
+                await self.dedup.ensure_warm()
+            except Exception:
+                self.log.exception("Failed to warm deduplication cache")
             event_hash, duplicate_found = self.dedup.check(evt, (temporary_identifier, tg_space))
+            if not duplicate_found:
+                duplicate_found = await self.dedup.check_db(evt, event_hash)
             if duplicate_found:
                 mxid, other_tg_space = duplicate_found
                 self.log.debug(
@@ -3590,6 +4069,7 @@ class Portal(DBPortal, BasePortal):
                 "to other clients before responding to the sender. I'll just redact "
                 "the likely duplicate message now."
             )
+            self.recent_events.remove(event_id)
             await intent.redact(self.mxid, event_id)
             return
 
@@ -3611,6 +4091,7 @@ class Portal(DBPortal, BasePortal):
                 f"{type(e).__name__} while saving message mapping {evt.id}@{tg_space} "
                 f"-> {event_id}: {e}"
             )
+            self.recent_events.remove(event_id)
             await intent.redact(self.mxid, event_id)
             return
         if isinstance(evt, Message) and evt.reactions:
@@ -3960,6 +4441,23 @@ class Portal(DBPortal, BasePortal):
     # endregion
     # region Class instance lookup
 
+    def _is_in_use(self) -> bool:
+        return (
+            self.backfill_lock.locked
+            or self.backfill_method_lock.locked()
+            or self.send_lock.locked()
+            or self.reaction_lock.locked()
+            or self._pin_lock.locked()
+            or self._room_create_lock.locked()
+            or self._sponsored_msg_lock.locked()
+            or bool(self.read_receipts)
+        )
+
+    @classmethod
+    def _remove_evicted(cls, _: tuple[TelegramID, TelegramID], portal: Portal) -> None:
+        if portal.mxid and cls.by_mxid.get(portal.mxid) is portal:
+            del cls.by_mxid[portal.mxid]
+
     async def get_dm_puppet(self) -> p.Puppet | None:
         if not self.is_direct:
             return None
@@ -4003,9 +4501,12 @@ class Portal(DBPortal, BasePortal):
     @async_getter_lock
     async def get_by_mxid(cls, mxid: RoomID, /) -> Portal | None:
         try:
-            return cls.by_mxid[mxid]
+            portal = cls.by_mxid[mxid]
         except KeyError:
             pass
+        else:
+            cls.by_tgid.touch(portal.tgid_full)
+            return portal
 
         portal = cast(cls, await super().get_by_mxid(mxid))
         if portal:
@@ -1,6 +1,8 @@
 from .deduplication import PortalDedup
-from .message_convert import ConvertedMessage, TelegramMessageConverter
+from .message_convert import ConvertedMessage, ReplyTargets, TelegramMessageConverter
 from .participants import get_users
 from .power_levels import get_base_power_levels, participants_to_power_levels
+from .read_receipts import PortalReadReceipts
+from .recent_events import PortalRecentEvents
 from .send_lock import PortalReactionLock, PortalSendLock
 from .sponsored_message import get_sponsored_message, make_sponsored_message_content
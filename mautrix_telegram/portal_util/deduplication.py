@@ -15,11 +15,15 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from typing import Any, Generator, Tuple, Union
-from collections import deque
+from typing import Any, Tuple, Union
+from collections import OrderedDict, deque
+import asyncio
 import hashlib
+import struct
+import time
 
 from telethon.tl.patched import Message, MessageService
+from telethon.tl.tlobject import TLObject
 from telethon.tl.types import (
     Message,
     MessageMediaContact,
@@ -42,13 +46,24 @@ from telethon.tl.types import (
 )
 
 from mautrix.types import EventID
+from mautrix.util.opt_prometheus import Counter
 
 from .. import portal as po
+from ..db import Message as DBMessage
 from ..types import TelegramID
 
 DedupMXID = Tuple[EventID, TelegramID]
 TypeMessage = Union[Message, MessageService, UpdateShortMessage, UpdateShortChatMessage]
 
+METRIC_DEDUP_HITS = Counter("bridge_dedup_cache_hits", "Duplicate messages found in memory")
+METRIC_DEDUP_MISSES = Counter("bridge_dedup_cache_misses", "Messages not found in dedup memory")
+METRIC_DEDUP_EVICTIONS = Counter(
+    "bridge_dedup_cache_evictions", "Entries evicted from the in-memory dedup cache"
+)
+METRIC_DEDUP_DB_HITS = Counter(
+    "bridge_dedup_db_hits", "Duplicate messages found in the database after a cache miss"
+)
+
 media_content_table = {
     MessageMediaContact: lambda media: [media.user_id],
     MessageMediaDocument: lambda media: [media.document.id],
@@ -61,45 +76,95 @@ media_content_table = {
 }
 
 
+def _encode_str(value: str) -> bytes:
+    data = value.encode("utf-8")
+    return b"s" + struct.pack("<I", len(data)) + data
+
+
+def _encode_int(value: int) -> bytes:
+    if -(2**63) <= value < 2**63:
+        return b"i" + struct.pack("<q", value)
+    return _encode_str(str(value))
+
+
+def _encode_list(value: list | tuple) -> bytes:
+    return b"l" + struct.pack("<I", len(value)) + b"".join(map(_encode_component, value))
+
+
+_component_encoders = {
+    type(None): lambda value: b"n",
+    int: _encode_int,
+    float: lambda value: b"f" + struct.pack("<d", value),
+    str: _encode_str,
+    list: _encode_list,
+    tuple: _encode_list,
+}
+
+
+def _encode_component(value: Any) -> bytes:
+    """Encode a hash component into a stable, type-tagged binary representation."""
+    try:
+        return _component_encoders[type(value)](value)
+    except KeyError:
+        pass
+    if isinstance(value, TLObject):
+        data = bytes(value)
+        return b"t" + struct.pack("<I", len(data)) + data
+    return b"r" + _encode_str(str(value))
+
+
 class PortalDedup:
     cache_queue_length: int = 256
+    warm_count: int = 256
 
-    _dedup: deque[bytes | int]
-    _dedup_mxid: dict[bytes | int, DedupMXID]
+    _dedup: OrderedDict[bytes | int, DedupMXID]
     _dedup_action: deque[bytes | int]
     _portal: po.Portal
+    # When the cache was filled from the database, messages after this go through the cache
+    _warmed_at: float | None
+    _warm_lock: asyncio.Lock
 
     def __init__(self, portal: po.Portal) -> None:
-        self._dedup = deque()
-        self._dedup_mxid = {}
+        self._dedup = OrderedDict()
         self._dedup_action = deque(maxlen=self.cache_queue_length)
         self._portal = portal
+        self._warmed_at = None
+        self._warm_lock = asyncio.Lock()
 
     @property
     def _always_force_hash(self) -> bool:
         return self._portal.peer_type == "chat"
 
-    def _hash_content(self, event: TypeMessage) -> Generator[Any, None, None]:
-        if not self._always_force_hash:
-            yield event.id
-        yield int(event.date.timestamp())
+    def _encode_event(self, event: TypeMessage) -> bytes:
+        timestamp = int(event.date.timestamp())
+        if self._always_force_hash:
+            parts = [struct.pack("<q", timestamp)]
+        else:
+            parts = [struct.pack("<qq", event.id, timestamp)]
         if isinstance(event, MessageService):
-            yield event.from_id
-            yield event.action
+            parts += (b"S", _encode_component(event.from_id), _encode_component(event.action))
         else:
-            yield event.message.strip()
+            parts += (b"M", _encode_component(event.message.strip()))
             if event.fwd_from:
-                yield event.fwd_from.from_id
+                parts += (b"F", _encode_component(event.fwd_from.from_id))
             if isinstance(event, Message) and event.media:
                 media_hash_func = media_content_table.get(type(event.media)) or (
                     lambda media: ["unknown media"]
                 )
-                yield media_hash_func(event.media)
+                parts += (b"D", _encode_component(media_hash_func(event.media)))
+        return b"".join(parts)
 
     def hash_event(self, event: TypeMessage) -> bytes:
-        return hashlib.sha256(
-            "-".join(str(a) for a in self._hash_content(event)).encode("utf-8")
-        ).digest()
+        evt_hash = getattr(event, "_mautrix_dedup_hash", None)
+        if evt_hash is not None:
+            return evt_hash
+        evt_hash = hashlib.blake2b(self._encode_event(event), digest_size=16).digest()
+        try:
+            # Cache the hash on the event, as check, update and backfill all need it
+            event._mautrix_dedup_hash = evt_hash
+        except AttributeError:
+            pass
+        return evt_hash
 
     def check_action(self, event: TypeMessage) -> bool:
         dedup_id = self.hash_event(event) if self._always_force_hash else event.id
@@ -109,6 +174,41 @@ class PortalDedup:
         self._dedup_action.appendleft(dedup_id)
         return False
 
+    def _add(self, dedup_id: bytes | int, mxid: DedupMXID) -> None:
+        self._dedup[dedup_id] = mxid
+        self._dedup.move_to_end(dedup_id)
+        while len(self._dedup) > self.cache_queue_length:
+            self._dedup.popitem(last=False)
+            METRIC_DEDUP_EVICTIONS.inc()
+
+    async def ensure_warm(self) -> None:
+        """
+        Load the most recent messages in the portal from the database into the in-memory cache,
+        so that messages replayed after a restart are detected without a query per message.
+        This is done once, when the portal gets its first message after being loaded.
+        """
+        if self._warmed_at is not None or not self._portal.mxid:
+            return
+        async with self._warm_lock:
+            if self._warmed_at is not None:
+                return
+            self._warmed_at = time.time()
+            await self._warm()
+
+    async def _warm(self) -> None:
+        if self.warm_count <= 0:
+            return
+        rows = await DBMessage.find_recent_for_dedup(
+            self._portal.mxid, min(self.warm_count, self.cache_queue_length)
+        )
+        # Rows are newest first, add them in reverse so the newest ones are evicted last
+        for msg in reversed(rows):
+            mxid = (msg.mxid, msg.tg_space)
+            if not self._always_force_hash:
+                self._add(msg.tgid, mxid)
+            if msg.content_hash:
+                self._add(msg.content_hash, mxid)
+
     def update(
         self,
         event: TypeMessage,
@@ -119,15 +219,15 @@ class PortalDedup:
         evt_hash = self.hash_event(event)
         dedup_id = evt_hash if self._always_force_hash or force_hash else event.id
         try:
-            found_mxid = self._dedup_mxid[dedup_id]
+            found_mxid = self._dedup[dedup_id]
         except KeyError:
             return evt_hash, None
 
         if found_mxid != expected_mxid:
             return evt_hash, found_mxid
-        self._dedup_mxid[dedup_id] = mxid
+        self._dedup[dedup_id] = mxid
         if evt_hash != dedup_id:
-            self._dedup_mxid[evt_hash] = mxid
+            self._dedup[evt_hash] = mxid
         return evt_hash, None
 
     def check(
@@ -135,19 +235,39 @@ class PortalDedup:
     ) -> tuple[bytes, DedupMXID | None]:
         evt_hash = self.hash_event(event)
         dedup_id = evt_hash if self._always_force_hash or force_hash else event.id
-        if dedup_id in self._dedup:
-            return evt_hash, self._dedup_mxid[dedup_id]
+        try:
+            found_mxid = self._dedup[dedup_id]
+        except KeyError:
+            METRIC_DEDUP_MISSES.inc()
+        else:
+            METRIC_DEDUP_HITS.inc()
+            self._dedup.move_to_end(dedup_id)
+            return evt_hash, found_mxid
 
-        self._dedup_mxid[dedup_id] = mxid
-        self._dedup.appendleft(dedup_id)
+        self._add(dedup_id, mxid)
         if evt_hash != dedup_id:
-            self._dedup_mxid[evt_hash] = mxid
-            self._dedup.appendleft(evt_hash)
-
-        while len(self._dedup) > self.cache_queue_length:
-            del self._dedup_mxid[self._dedup.pop()]
+            self._add(evt_hash, mxid)
         return evt_hash, None
 
+    async def check_db(self, event: TypeMessage, evt_hash: bytes) -> DedupMXID | None:
+        """
+        Check whether a message with the given content hash has already been bridged into the
+        portal. This is only needed for portals where messages are deduplicated by hash, as the
+        message ID lookup covers other portals, and for messages from before the cache was
+        warmed, as newer ones were all seen by the cache.
+        """
+        if not self._always_force_hash or not self._portal.mxid:
+            return None
+        elif self._warmed_at is not None and event.date.timestamp() >= self._warmed_at:
+            return None
+        msg = await DBMessage.find_by_content_hash(self._portal.mxid, evt_hash)
+        if not msg:
+            return None
+        METRIC_DEDUP_DB_HITS.inc()
+        found_mxid = (msg.mxid, msg.tg_space)
+        self._add(evt_hash, found_mxid)
+        return found_mxid
+
     def register_outgoing_actions(self, response: TypeUpdates) -> None:
         for update in response.updates:
             check_dedup = isinstance(
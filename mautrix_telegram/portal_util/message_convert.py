@@ -15,7 +15,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from typing import Any, NamedTuple
+from typing import Any, Dict, NamedTuple, Tuple, Union
 import base64
 import codecs
 import hashlib
@@ -98,6 +98,11 @@ except ImportError:
     phonenumbers = None
 
 
+# Reply target messages looked up in advance, keyed by (tgid, tg_space). None means the
+# target was looked up, but isn't in the database.
+ReplyTargets = Dict[Tuple[TelegramID, TelegramID], Union[DBMessage, None]]
+
+
 @dataclass
 class ConvertedMessage:
     content: MessageEventContent
@@ -166,6 +171,8 @@ class TelegramMessageConverter:
         no_reply_fallback: bool = False,
         deterministic_reply_id: bool = False,
         client: MautrixTelegramClient | None = None,
+        priority: util.TransferPriority = util.TransferPriority.LIVE,
+        reply_targets: ReplyTargets | None = None,
     ) -> ConvertedMessage | None:
         if not client:
             client = source.client
@@ -173,12 +180,14 @@ class TelegramMessageConverter:
             if self._should_convert_full_document(evt.media, is_bot, is_channel):
                 convert_media = self._media_converters[type(evt.media)]
                 converted = await convert_media(
-                    source=source, intent=intent, evt=evt, client=client
+                    source=source, intent=intent, evt=evt, client=client, priority=priority
                 )
             else:
-                converted = await self._convert_document_thumb_only(source, intent, evt, client)
+                converted = await self._convert_document_thumb_only(
+                    source, intent, evt, client, priority
+                )
         elif evt.message:
-            converted = await self._convert_text(source, intent, is_bot, evt, client)
+            converted = await self._convert_text(source, intent, is_bot, evt, client, priority)
         else:
             self.log.debug("Unhandled Telegram message %d", evt.id)
             return
@@ -206,6 +215,7 @@ class TelegramMessageConverter:
                 converted.content,
                 no_fallback=no_reply_fallback,
                 deterministic_id=deterministic_reply_id,
+                reply_targets=reply_targets,
             )
         return converted
 
@@ -276,6 +286,7 @@ class TelegramMessageConverter:
         content: MessageEventContent,
         no_fallback: bool = False,
         deterministic_id: bool = False,
+        reply_targets: ReplyTargets | None = None,
     ) -> None:
         if not evt.reply_to:
             return
@@ -315,7 +326,10 @@ class TelegramMessageConverter:
             )
 
         reply_to_id = TelegramID(evt.reply_to.reply_to_msg_id)
-        msg = await DBMessage.get_one_by_tgid(reply_to_id, space)
+        if reply_targets is not None and (reply_to_id, space) in reply_targets:
+            msg = reply_targets[(reply_to_id, space)]
+        else:
+            msg = await DBMessage.get_one_by_tgid(reply_to_id, space)
         no_fallback = no_fallback or self.config["bridge.disable_reply_fallbacks"]
         if not msg:
             # TODO try to find room ID when generating deterministic ID for cross-room reply
@@ -332,10 +346,14 @@ class TelegramMessageConverter:
             return
 
         # Text message, try to fetch original message to generate reply fallback.
+        # Recently bridged events are cached in the portal, so the homeserver is only asked
+        # for older reply targets.
         try:
-            event = await self.portal.main_intent.get_event(msg.mx_room, msg.mxid)
-            if event.type == EventType.ROOM_ENCRYPTED and source.bridge.matrix.e2ee:
-                event = await source.bridge.matrix.e2ee.decrypt(event)
+            event = self.portal.recent_events.get(msg.mx_room, msg.mxid)
+            if not event:
+                event = await self.portal.main_intent.get_event(msg.mx_room, msg.mxid)
+                if event.type == EventType.ROOM_ENCRYPTED and source.bridge.matrix.e2ee:
+                    event = await source.bridge.matrix.e2ee.decrypt(event)
             if isinstance(event.content, TextMessageEventContent):
                 event.content.trim_reply_fallback()
             puppet = await pu.Puppet.get_by_mxid(event.sender, create=False)
@@ -382,7 +400,11 @@ class TelegramMessageConverter:
         )
 
     async def _webpage_to_beeper_link_preview(
-        self, source: au.AbstractUser, intent: IntentAPI, webpage: WebPage
+        self,
+        source: au.AbstractUser,
+        intent: IntentAPI,
+        webpage: WebPage,
+        priority: util.TransferPriority = util.TransferPriority.LIVE,
     ) -> dict[str, Any]:
         beeper_link_preview: dict[str, Any] = {
             "matched_url": webpage.url,
@@ -404,6 +426,7 @@ class TelegramMessageConverter:
                 loc,
                 encrypt=self.portal.encrypted,
                 async_upload=self.config["homeserver.async_media"],
+                priority=priority,
             )
 
             if file.decryption_info:
@@ -420,6 +443,7 @@ class TelegramMessageConverter:
         is_bot: bool,
         evt: Message,
         client: MautrixTelegramClient,
+        priority: util.TransferPriority = util.TransferPriority.LIVE,
     ) -> ConvertedMessage:
         content = await formatter.telegram_to_matrix(evt, source, client)
         if is_bot and self.portal.get_config("bot_messages_as_notices"):
@@ -431,7 +455,9 @@ class TelegramMessageConverter:
             and isinstance(evt.media.webpage, WebPage)
         ):
             content[BEEPER_LINK_PREVIEWS_KEY] = [
-                await self._webpage_to_beeper_link_preview(source, intent, evt.media.webpage)
+                await self._webpage_to_beeper_link_preview(
+                    source, intent, evt.media.webpage, priority
+                )
             ]
 
         return ConvertedMessage(content=content)
@@ -442,6 +468,7 @@ class TelegramMessageConverter:
         intent: IntentAPI,
         evt: Message,
         client: MautrixTelegramClient,
+        priority: util.TransferPriority = util.TransferPriority.LIVE,
     ) -> ConvertedMessage | None:
         media: MessageMediaPhoto = evt.media
         if media.photo is None and media.ttl_seconds:
@@ -464,6 +491,8 @@ class TelegramMessageConverter:
             loc,
             encrypt=self.portal.encrypted,
             async_upload=self.config["homeserver.async_media"],
+            priority=priority,
+            source_message=(self.portal.tgid, self.portal.tg_receiver, evt.id),
         )
         if not file:
             return None
@@ -514,6 +543,7 @@ class TelegramMessageConverter:
         intent: IntentAPI,
         evt: Message,
         client: MautrixTelegramClient,
+        priority: util.TransferPriority = util.TransferPriority.LIVE,
     ) -> ConvertedMessage | None:
         document = evt.media.document
 
@@ -547,6 +577,7 @@ class TelegramMessageConverter:
                     mime_type=document.mime_type,
                     encrypt=self.portal.encrypted,
                     async_upload=self.config["homeserver.async_media"],
+                    priority=priority,
                 )
             except Exception:
                 self.log.exception("Failed to transfer thumbnail")
@@ -599,6 +630,7 @@ class TelegramMessageConverter:
         intent: IntentAPI,
         evt: Message,
         client: MautrixTelegramClient,
+        priority: util.TransferPriority = util.TransferPriority.LIVE,
     ) -> ConvertedMessage | None:
         document = evt.media.document
 
@@ -622,6 +654,11 @@ class TelegramMessageConverter:
             thumb_loc = None
             thumb_size = None
         parallel_id = source.tgid if self.config["bridge.parallel_file_transfer"] else None
+        stream_min_size = self.config["bridge.streaming_file_transfer.min_size"]
+        if 0 < stream_min_size <= document.size:
+            stream_chunk_size = self.config["bridge.streaming_file_transfer.chunk_size"] * 1024
+        else:
+            stream_chunk_size = None
         tgs_convert = self.config["bridge.animated_sticker"]
         file = await util.transfer_file_to_matrix(
             client,
@@ -633,8 +670,11 @@ class TelegramMessageConverter:
             webm_convert=tgs_convert["target"] if tgs_convert["convert_from_webm"] else None,
             filename=attrs.name,
             parallel_id=parallel_id,
+            stream_chunk_size=stream_chunk_size,
             encrypt=self.portal.encrypted,
             async_upload=self.config["homeserver.async_media"],
+            priority=priority,
+            source_message=(self.portal.tgid, self.portal.tg_receiver, evt.id),
         )
         if not file:
             return None
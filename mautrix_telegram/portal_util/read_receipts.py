@@ -0,0 +1,108 @@
+# mautrix-telegram - A Matrix-Telegram puppeting bridge
+# Copyright (C) 2022 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+import asyncio
+
+from attr import dataclass
+
+from mautrix.types import EventID
+from mautrix.util import background_task
+from mautrix.util.opt_prometheus import Counter
+
+from .. import portal as po, user as u
+from ..db import Message as DBMessage
+from ..types import TelegramID
+
+METRIC_RECEIPTS_COALESCED = Counter(
+    "bridge_read_receipts_coalesced",
+    "Matrix read receipts merged into a later receipt or dropped as not advancing",
+)
+METRIC_RECEIPTS_SENT = Counter(
+    "bridge_read_receipts_sent", "Read acknowledgements sent to Telegram"
+)
+
+
+@dataclass
+class PendingReadReceipt:
+    user: u.User
+    message: DBMessage
+    event_id: EventID
+    timestamp: int
+
+
+class PortalReadReceipts:
+    """
+    Coalesces Matrix read receipts per Telegram user, so that a burst of receipts only results
+    in a single read acknowledgement for the newest message after a short delay.
+    """
+
+    delay: float = 1
+
+    _pending: dict[TelegramID, PendingReadReceipt]
+    _max_read_id: dict[TelegramID, TelegramID]
+    _portal: po.Portal
+
+    def __init__(self, portal: po.Portal) -> None:
+        self._pending = {}
+        self._max_read_id = {}
+        self._portal = portal
+
+    def __bool__(self) -> bool:
+        return bool(self._pending)
+
+    async def queue(
+        self, user: u.User, message: DBMessage, event_id: EventID, timestamp: int
+    ) -> None:
+        if message.tgid <= self._max_read_id.get(user.tgid, 0):
+            METRIC_RECEIPTS_COALESCED.inc()
+            return
+        receipt = PendingReadReceipt(user, message, event_id, timestamp)
+        if self.delay <= 0:
+            await self._send(receipt)
+            return
+        try:
+            pending = self._pending[user.tgid]
+        except KeyError:
+            self._pending[user.tgid] = receipt
+            background_task.create(self._flush_after_delay(user.tgid))
+        else:
+            METRIC_RECEIPTS_COALESCED.inc()
+            if message.tgid > pending.message.tgid:
+                self._pending[user.tgid] = receipt
+
+    async def _flush_after_delay(self, user_tgid: TelegramID) -> None:
+        await asyncio.sleep(self.delay)
+        receipt = self._pending.pop(user_tgid)
+        try:
+            await self._send(receipt)
+        except Exception:
+            self._portal.log.exception(
+                f"Failed to send read receipt up to {receipt.message.tgid} "
+                f"for {receipt.user.mxid}"
+            )
+
+    async def _send(self, receipt: PendingReadReceipt) -> None:
+        await self._portal.send_read_receipt(
+            receipt.user, receipt.message, receipt.event_id, receipt.timestamp
+        )
+        METRIC_RECEIPTS_SENT.inc()
+        # Only remember the position once Telegram has it, so a failed acknowledgement
+        # doesn't make later receipts for the same messages get dropped.
+        user_tgid = receipt.user.tgid
+        self._max_read_id[user_tgid] = max(
+            self._max_read_id.get(user_tgid, 0), receipt.message.tgid
+        )
@@ -0,0 +1,95 @@
+# mautrix-telegram - A Matrix-Telegram puppeting bridge
+# Copyright (C) 2022 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+from collections import OrderedDict
+from datetime import datetime
+import time
+
+from mautrix.types import (
+    JSON,
+    EventID,
+    EventType,
+    MessageEvent,
+    MessageEventContent,
+    RoomID,
+    Serializable,
+    UserID,
+)
+from mautrix.util.opt_prometheus import Counter
+
+METRIC_RECENT_EVENT_HITS = Counter(
+    "bridge_recent_event_cache_hits", "Reply targets found in the recent event cache"
+)
+METRIC_RECENT_EVENT_MISSES = Counter(
+    "bridge_recent_event_cache_misses", "Reply targets that had to be fetched from the homeserver"
+)
+
+
+class PortalRecentEvents:
+    """
+    A bounded cache of the most recent message events in a portal room. Events are added when
+    the bridge sends them or receives them from Matrix, so that reply fallbacks for recent
+    messages can be generated without fetching the target event from the homeserver.
+
+    Events are stored serialized and a new copy is returned on every lookup, so neither the
+    caller that added the content nor the ones reading it can change the cached event.
+    """
+
+    cache_size: int = 128
+
+    _events: OrderedDict[EventID, JSON]
+
+    def __init__(self) -> None:
+        self._events = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def add(
+        self,
+        room_id: RoomID,
+        event_id: EventID,
+        sender: UserID,
+        content: MessageEventContent | JSON,
+        timestamp: int | datetime | None = None,
+    ) -> None:
+        if self.cache_size <= 0:
+            return
+        if isinstance(timestamp, datetime):
+            timestamp = int(timestamp.timestamp() * 1000)
+        self._events[event_id] = {
+            "type": EventType.ROOM_MESSAGE.serialize(),
+            "room_id": room_id,
+            "event_id": event_id,
+            "sender": sender,
+            "origin_server_ts": timestamp or int(time.time() * 1000),
+            "content": content.serialize() if isinstance(content, Serializable) else content,
+        }
+        self._events.move_to_end(event_id)
+        while len(self._events) > self.cache_size:
+            self._events.popitem(last=False)
+
+    def remove(self, event_id: EventID) -> None:
+        self._events.pop(event_id, None)
+
+    def get(self, room_id: RoomID, event_id: EventID) -> MessageEvent | None:
+        event = self._events.get(event_id)
+        if not event or event["room_id"] != room_id:
+            METRIC_RECENT_EVENT_MISSES.inc()
+            return None
+        METRIC_RECENT_EVENT_HITS.inc()
+        return MessageEvent.deserialize(event)
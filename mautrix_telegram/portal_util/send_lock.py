@@ -46,6 +46,12 @@ class PortalSendLock:
         except KeyError:
             return self._send_locks.setdefault(user_id, Lock()) if required else self._noop_lock
 
+    def locked(self, user_id: TelegramID | None = None) -> bool:
+        if user_id is not None:
+            lock = self._send_locks.get(user_id)
+            return lock is not None and lock.locked()
+        return any(lock.locked() for lock in self._send_locks.values())
+
 
 class PortalReactionLock:
     _reaction_locks: dict[EventID, Lock]
@@ -55,3 +61,6 @@ class PortalReactionLock:
 
     def __call__(self, mxid: EventID) -> Lock:
         return self._reaction_locks[mxid]
+
+    def locked(self) -> bool:
+        return any(lock.locked() for lock in self._reaction_locks.values())
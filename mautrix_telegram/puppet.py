@@ -15,7 +15,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterable, Awaitable, cast
+from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterable, Awaitable, Iterable, cast
 from difflib import SequenceMatcher
 import unicodedata
 
@@ -61,7 +61,7 @@ class Puppet(DBPuppet, BasePuppet):
     mxid_template: SimpleTemplate[TelegramID]
     displayname_template: SimpleTemplate[str]
 
-    by_tgid: dict[TelegramID, Puppet] = {}
+    by_tgid: util.ObjectCache[TelegramID, Puppet] = util.ObjectCache("puppet")
     by_custom_mxid: dict[UserID, Puppet] = {}
 
     def __init__(
@@ -185,6 +185,12 @@ class Puppet(DBPuppet, BasePuppet):
             for server, secret in cls.config["bridge.login_shared_secret_map"].items()
         }
         cls.login_device_name = "Telegram Bridge"
+        # Double puppets are never evicted, as they have a sync loop running
+        cls.by_tgid.configure(
+            max_size=cls.config["bridge.object_cache.puppets"],
+            min_idle=cls.config["bridge.object_cache.min_idle"],
+            in_use=lambda puppet: bool(puppet.custom_mxid),
+        )
 
         return (puppet.try_start() async for puppet in cls.all_with_custom_mxid())
 
@@ -515,6 +521,25 @@ class Puppet(DBPuppet, BasePuppet):
 
         return None
 
+    @classmethod
+    async def get_many_by_tgid(cls, tgids: Iterable[TelegramID]) -> dict[TelegramID, Puppet]:
+        puppets = {}
+        missing = []
+        for tgid in tgids:
+            try:
+                puppets[tgid] = cls.by_tgid[tgid]
+            except KeyError:
+                missing.append(tgid)
+        puppet: cls
+        for puppet in await super().get_many_by_tgid(missing):
+            # A concurrent get_by_tgid call may have cached the puppet while the query ran
+            try:
+                puppets[puppet.id] = cls.by_tgid[puppet.id]
+            except KeyError:
+                puppet._add_to_cache()
+                puppets[puppet.id] = puppet
+        return puppets
+
     @staticmethod
     def get_id_from_peer(peer: TypePeer | User | Channel) -> TelegramID:
         if isinstance(peer, (PeerUser, InputPeerUser)):
@@ -15,15 +15,27 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, AsyncGenerator, AsyncIterable, Awaitable, NamedTuple, cast
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    Awaitable,
+    Iterable,
+    NamedTuple,
+    cast,
+)
+from contextlib import nullcontext
 from datetime import datetime
 import asyncio
+import hashlib
 import time
 
 from telethon.errors import (
     AuthKeyDuplicatedError,
     AuthKeyError,
     AuthKeyNotFound,
+    FloodWaitError,
     RPCError,
     TakeoutInitDelayError,
     UnauthorizedError,
@@ -97,7 +109,10 @@ class User(DBUser, AbstractUser, BaseUser):
     by_mxid: dict[str, User] = {}
     by_tgid: dict[int, User] = {}
 
-    _portals_cache: dict[tuple[TelegramID, TelegramID], po.Portal] | None
+    _backfill_global_sema: asyncio.Semaphore | None = None
+
+    # Only the keys are stored so that the portal objects can still be evicted from the cache
+    _portals_cache: set[tuple[TelegramID, TelegramID]] | None
 
     _ensure_started_lock: asyncio.Lock
     _track_connection_task: asyncio.Task | None
@@ -106,6 +121,7 @@ class User(DBUser, AbstractUser, BaseUser):
     _is_backfilling: bool
     takeout_retry_immediate: asyncio.Event
     takeout_requested: bool
+    backfill_flood_limiter: util.FloodWaitLimiter
 
     _available_emoji_reactions: set[str] | None
     _available_emoji_reactions_hash: int | None
@@ -144,6 +160,7 @@ class User(DBUser, AbstractUser, BaseUser):
         self.wakeup_backfill_task = asyncio.Event()
         self.takeout_retry_immediate = asyncio.Event()
         self.takeout_requested = False
+        self.backfill_flood_limiter = util.FloodWaitLimiter()
 
         self._available_emoji_reactions = None
         self._available_emoji_reactions_hash = None
@@ -193,6 +210,9 @@ class User(DBUser, AbstractUser, BaseUser):
         cls.bridge = bridge
         cls.az = bridge.az
         cls.loop = bridge.loop
+        global_backfill_workers = cls.config["bridge.backfill.workers.global"]
+        if global_backfill_workers > 0:
+            cls._backfill_global_sema = asyncio.Semaphore(global_backfill_workers)
 
     # region Telegram connection management
 
@@ -420,7 +440,7 @@ class User(DBUser, AbstractUser, BaseUser):
                 self.wakeup_backfill_task.clear()
             else:
                 try:
-                    await self._takeout_and_backfill(req)
+                    await self._takeout_and_backfill()
                 except Exception:
                     self.log.exception("Error in takeout backfill loop, retrying in an hour")
                     await asyncio.sleep(3600)
@@ -433,14 +453,14 @@ class User(DBUser, AbstractUser, BaseUser):
             )
             self.takeout_retry_immediate.set()
 
-    async def _takeout_and_backfill(self, first_req: Backfill, first_attempt: bool = True) -> None:
+    async def _takeout_and_backfill(self, first_attempt: bool = True) -> None:
         self.takeout_retry_immediate.clear()
         self.takeout_requested = True
         try:
             async with self.client.takeout(**self._takeout_options) as takeout_client:
                 self.takeout_requested = False
                 self.log.info("Acquired takeout client successfully")
-                await self._backfill_loop_with_client(takeout_client, first_req)
+                await self._backfill_loop_with_client(takeout_client)
                 self.log.info("Backfills finished, exiting takeout")
         except TakeoutInitDelayError as e:
             if first_attempt:
@@ -456,15 +476,42 @@ class User(DBUser, AbstractUser, BaseUser):
                 self.log.info("Retrying takeout")
             except asyncio.TimeoutError:
                 self.log.info("Takeout timeout expired")
-            await self._takeout_and_backfill(first_req, first_attempt=False)
+            await self._takeout_and_backfill(first_attempt=False)
+
+    async def _backfill_loop_with_client(self, client: MautrixTelegramClient) -> None:
+        worker_count = max(self.config["bridge.backfill.workers.per_user"], 1)
+        active_portals: set[TelegramID] = set()
+        claim_lock = asyncio.Lock()
+        await asyncio.gather(
+            *(
+                self._backfill_worker(client, active_portals, claim_lock, worker_id)
+                for worker_id in range(worker_count)
+            )
+        )
 
-    async def _backfill_loop_with_client(
-        self, client: MautrixTelegramClient, first_req: Backfill
+    async def _backfill_worker(
+        self,
+        client: MautrixTelegramClient,
+        active_portals: set[TelegramID],
+        claim_lock: asyncio.Lock,
+        worker_id: int,
     ) -> None:
         missed_reqs = 0
         while missed_reqs < 10:
-            req = first_req or await Backfill.get_next(self.mxid)
-            first_req = None
+            await self.backfill_flood_limiter.wait()
+            async with self._backfill_global_sema or nullcontext():
+                # Claims are serialized so that two workers can't both claim requests for
+                # the same portal before either has marked it as active.
+                async with claim_lock:
+                    req = await Backfill.claim_next(self.mxid, skip_portals=active_portals)
+                    if req:
+                        active_portals.add(req.portal_tgid)
+                if req:
+                    missed_reqs = 0
+                    try:
+                        await self._handle_backfill_request(client, req, worker_id)
+                    finally:
+                        active_portals.discard(req.portal_tgid)
             if not req:
                 missed_reqs += 1
                 try:
@@ -472,23 +519,32 @@ class User(DBUser, AbstractUser, BaseUser):
                 except asyncio.TimeoutError:
                     pass
                 self.wakeup_backfill_task.clear()
-                continue
-            missed_reqs = 0
-            self.log.info("Backfill request %s", req)
-            try:
-                portal = await po.Portal.get_by_tgid(
-                    TelegramID(req.portal_tgid), tg_receiver=TelegramID(req.portal_tg_receiver)
-                )
-                await req.mark_dispatched()
-                if req.type == BackfillType.HISTORICAL:
-                    await portal.backfill(self, client, req=req)
-                elif req.type == BackfillType.SYNC_DIALOG:
-                    await self._backfill_sync_dialog(portal, client, req.extra_data)
-                await req.mark_done()
+            else:
                 await asyncio.sleep(req.post_batch_delay)
-            except Exception:
-                self.log.exception("Error handling backfill request for %s", req.portal_tgid)
-                await req.set_cooldown_timeout(1800)
+
+    async def _handle_backfill_request(
+        self, client: MautrixTelegramClient, req: Backfill, worker_id: int
+    ) -> None:
+        self.log.info("Backfill request %s (worker %d)", req, worker_id)
+        try:
+            portal = await po.Portal.get_by_tgid(
+                TelegramID(req.portal_tgid), tg_receiver=TelegramID(req.portal_tg_receiver)
+            )
+            if req.type == BackfillType.HISTORICAL:
+                await portal.backfill(self, client, req=req)
+            elif req.type == BackfillType.SYNC_DIALOG:
+                await self._backfill_sync_dialog(portal, client, req.extra_data)
+            await req.mark_done()
+        except FloodWaitError as e:
+            self.log.warning(
+                f"Got flood wait of {e.seconds} seconds while backfilling {req.portal_tgid}, "
+                "pausing all backfill workers"
+            )
+            self.backfill_flood_limiter.add_flood_wait(e.seconds)
+            await req.set_cooldown_timeout(e.seconds)
+        except Exception:
+            self.log.exception("Error handling backfill request for %s", req.portal_tgid)
+            await req.set_cooldown_timeout(1800)
 
     async def _backfill_sync_dialog(
         self, portal: po.Portal, client: MautrixTelegramClient, post_sync_args: dict[str, Any]
@@ -504,6 +560,7 @@ class User(DBUser, AbstractUser, BaseUser):
                 update_if_exists=False,
                 invites=[self.mxid],
                 from_dialog_sync=True,
+                wait_for_backfill=True,
             )
         except Exception:
             self.log.exception(f"Error while creating {portal.tgid_log}")
@@ -780,7 +837,7 @@ class User(DBUser, AbstractUser, BaseUser):
 
     async def _sync_dialog(
         self, portal: po.Portal, dialog: Dialog, should_create: bool, puppet: pu.Puppet | None
-    ) -> None:
+    ) -> bool:
         if (
             not portal.mxid
             and isinstance(dialog.message, MessageService)
@@ -792,8 +849,9 @@ class User(DBUser, AbstractUser, BaseUser):
                 f"Not syncing {portal.tgid_log} "
                 f"(last message is a {type(dialog.message.action).__name__})"
             )
-            return
+            return False
         was_created = False
+        ok = True
         post_sync_args = self.dialog_to_sync_args(dialog)
         if portal.mxid:
             self.log.debug(f"Backfilling and updating {portal.tgid_log} (dialog sync)")
@@ -801,19 +859,23 @@ class User(DBUser, AbstractUser, BaseUser):
                 await portal.forward_backfill(self, initial=False, last_tgid=dialog.message.id)
             except Exception:
                 self.log.exception(f"Error while backfilling {portal.tgid_log}")
-            try:
-                await portal.update_matrix_room(self, dialog.entity)
-            except Exception:
-                self.log.exception(f"Error while updating {portal.tgid_log}")
+                ok = False
+            if not await portal.update_matrix_room(self, dialog.entity):
+                ok = False
         elif should_create:
             self.log.debug(f"Creating portal for {portal.tgid_log} immediately (dialog sync)")
             try:
                 await portal.create_matrix_room(
-                    self, dialog.entity, invites=[self.mxid], from_dialog_sync=True
+                    self,
+                    dialog.entity,
+                    invites=[self.mxid],
+                    from_dialog_sync=True,
+                    wait_for_backfill=True,
                 )
                 was_created = True
             except Exception:
                 self.log.exception(f"Error while creating {portal.tgid_log}")
+                ok = False
         elif self.config["bridge.sync_deferred_create_all"]:
             self.log.debug(f"Enqueuing deferred dialog sync for {portal.tgid_log}")
             await portal.enqueue_backfill(
@@ -830,6 +892,9 @@ class User(DBUser, AbstractUser, BaseUser):
                 **post_sync_args,
             )
         self.log.debug(f"_sync_dialog finished for {portal.tgid_log}")
+        # The initial backfill of new rooms doesn't report errors, so the sync state is only
+        # saved once a later sync has backfilled the existing room successfully.
+        return ok and bool(portal.mxid) and not was_created
 
     async def post_sync_dialog(
         self,
@@ -880,76 +945,140 @@ class User(DBUser, AbstractUser, BaseUser):
         except Exception:
             self.log.exception(f"Error updating read status and tags for {portal.tgid_log}")
 
-    async def get_cached_portals(self) -> dict[tuple[TelegramID, TelegramID], po.Portal]:
+    async def get_cached_portal_keys(self) -> set[tuple[TelegramID, TelegramID]]:
         if self._portals_cache is None:
-            self._portals_cache = {
-                (tgid, tg_receiver): await po.Portal.get_by_tgid(tgid, tg_receiver=tg_receiver)
-                for tgid, tg_receiver in await self.get_portals()
-            }
+            self._portals_cache = set(await self.get_portals())
         return self._portals_cache
 
+    async def get_cached_portals(self) -> dict[tuple[TelegramID, TelegramID], po.Portal]:
+        return {
+            (tgid, tg_receiver): await po.Portal.get_by_tgid(tgid, tg_receiver=tg_receiver)
+            for tgid, tg_receiver in await self.get_cached_portal_keys()
+        }
+
     async def sync_dialogs(self) -> None:
         if self.is_bot:
             return
-        creators = []
         update_limit = self.config["bridge.sync_update_limit"] or None
         create_limit = self.config["bridge.sync_create_limit"]
+        worker_count = max(self.config["bridge.sync_dialog_workers"], 1)
         index = 0
-        self.log.debug(f"Syncing dialogs ({update_limit=}, {create_limit=})")
+        skipped = 0
+        self.log.debug(f"Syncing dialogs ({update_limit=}, {create_limit=}, {worker_count=})")
         await self.push_bridge_state(BridgeStateEvent.BACKFILLING)
         puppet = await pu.Puppet.get_by_custom_mxid(self.mxid)
         dialog: Dialog
-        old_portal_cache = await self.get_cached_portals()
+        old_portal_cache = await self.get_cached_portal_keys()
         new_portal_cache = old_portal_cache.copy()
-        async for dialog in self.client.iter_dialogs(
-            limit=update_limit, ignore_migrated=True, archived=False
-        ):
-            entity = dialog.entity
-            if isinstance(entity, ChatForbidden):
-                self.log.warning(f"Ignoring forbidden chat {entity} while syncing")
-                continue
-            elif isinstance(entity, Chat) and (entity.deactivated or entity.left):
-                self.log.warning(f"Ignoring deactivated or left chat {entity} while syncing")
-                continue
-            elif isinstance(entity, TLUser) and not self.config["bridge.sync_direct_chats"]:
-                self.log.trace(f"Ignoring user {entity.id} while syncing")
-                continue
-            portal = await po.Portal.get_by_entity(entity, tg_receiver=self.tgid)
-            new_portal_cache[portal.tgid_full] = portal
-            should_create = not create_limit or index < create_limit
-            coro = self._sync_dialog(
-                portal=portal,
-                dialog=dialog,
-                puppet=puppet,
-                should_create=should_create,
-            )
-            creators.append(asyncio.create_task(coro))
-            index += 1
-        if new_portal_cache.keys() != old_portal_cache.keys():
-            await self.set_portals(new_portal_cache.keys())
-            self._portals_cache = new_portal_cache
-        await asyncio.gather(*creators)
+        sync_states = await self.get_portal_sync_states()
+        queue: asyncio.Queue[tuple[po.Portal, Dialog, bool] | None] = asyncio.Queue(
+            maxsize=worker_count * 2
+        )
+        workers = [
+            asyncio.create_task(self._sync_dialog_worker(queue, puppet))
+            for _ in range(worker_count)
+        ]
+        try:
+            async for dialog in self.client.iter_dialogs(
+                limit=update_limit, ignore_migrated=True, archived=False
+            ):
+                entity = dialog.entity
+                if isinstance(entity, ChatForbidden):
+                    self.log.warning(f"Ignoring forbidden chat {entity} while syncing")
+                    continue
+                elif isinstance(entity, Chat) and (entity.deactivated or entity.left):
+                    self.log.warning(f"Ignoring deactivated or left chat {entity} while syncing")
+                    continue
+                elif isinstance(entity, TLUser) and not self.config["bridge.sync_direct_chats"]:
+                    self.log.trace(f"Ignoring user {entity.id} while syncing")
+                    continue
+                portal = await po.Portal.get_by_entity(entity, tg_receiver=self.tgid)
+                new_portal_cache.add(portal.tgid_full)
+                should_create = not create_limit or index < create_limit
+                index += 1
+                if portal.mxid and sync_states.get(portal.tgid_full) == (
+                    self._get_dialog_top_id(dialog),
+                    self._hash_dialog_state(dialog),
+                ):
+                    skipped += 1
+                    continue
+                await queue.put((portal, dialog, should_create))
+            if new_portal_cache != old_portal_cache:
+                await self.set_portals(new_portal_cache)
+                self._portals_cache = new_portal_cache
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
         await self.update_direct_chats()
-        self.log.debug("Dialog syncing complete")
+        self.log.debug(f"Dialog syncing complete, skipped {skipped} unchanged dialogs")
+
+    async def _sync_dialog_worker(
+        self,
+        queue: asyncio.Queue[tuple[po.Portal, Dialog, bool] | None],
+        puppet: pu.Puppet | None,
+    ) -> None:
+        while (item := await queue.get()) is not None:
+            portal, dialog, should_create = item
+            try:
+                if await self._sync_dialog(portal, dialog, should_create, puppet):
+                    await self.set_portal_sync_state(
+                        portal.tgid,
+                        portal.tg_receiver,
+                        self._get_dialog_top_id(dialog),
+                        self._hash_dialog_state(dialog),
+                    )
+            except Exception:
+                self.log.exception(f"Failed to sync dialog {portal.tgid_log}")
+
+    @staticmethod
+    def _get_dialog_top_id(dialog: Dialog) -> TelegramID:
+        return TelegramID(dialog.message.id if dialog.message else 0)
+
+    @staticmethod
+    def _hash_dialog_state(dialog: Dialog) -> int:
+        entity = dialog.entity
+        photo = getattr(entity, "photo", None)
+        rights = (
+            getattr(entity, "default_banned_rights", None),
+            getattr(entity, "admin_rights", None),
+        )
+        state = (
+            dialog.date.timestamp() if dialog.date else None,
+            dialog.unread_count,
+            dialog.dialog.read_inbox_max_id,
+            dialog.dialog.notify_settings.mute_until,
+            dialog.pinned,
+            dialog.archived,
+            getattr(entity, "title", None),
+            getattr(entity, "first_name", None),
+            getattr(entity, "last_name", None),
+            getattr(entity, "username", None),
+            getattr(photo, "photo_id", None),
+            getattr(entity, "participants_count", None),
+            *(bytes(right) if right else None for right in rights),
+        )
+        digest = hashlib.sha256(repr(state).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big", signed=True)
 
     async def register_portal(self, portal: po.Portal) -> None:
         self.log.trace(f"Registering portal {portal.tgid_full}")
         if self._portals_cache is not None:
-            if self._portals_cache.get(portal.tgid_full) == portal:
+            if portal.tgid_full in self._portals_cache:
                 return
-            self._portals_cache[portal.tgid_full] = portal
+            self._portals_cache.add(portal.tgid_full)
         await super().register_portal(portal.tgid, portal.tg_receiver)
 
     async def unregister_portal(self, tgid: TelegramID, tg_receiver: TelegramID) -> None:
         self.log.trace(f"Unregistering portal {(tgid, tg_receiver)}")
         if self._portals_cache is not None:
-            self._portals_cache.pop((tgid, tg_receiver), None)
+            self._portals_cache.discard((tgid, tg_receiver))
         await super().unregister_portal(tgid, tg_receiver)
 
     async def needs_relaybot(self, portal: po.Portal) -> bool:
         return not await self.is_logged_in() or (
             (portal.has_bot or self.is_bot)
-            and portal.tgid_full not in await self.get_cached_portals()
+            and portal.tgid_full not in await self.get_cached_portal_keys()
         )
 
     @staticmethod
@@ -1063,6 +1192,18 @@ class User(DBUser, AbstractUser, BaseUser):
                 user._add_to_cache()
                 yield user
 
+    @classmethod
+    async def all_with_tgid_by_activity(cls) -> list[tuple[User, float | None]]:
+        users = []
+        user: cls
+        for user, activity in await super().all_with_tgid_by_activity():
+            try:
+                user = cls.by_mxid[user.mxid]
+            except KeyError:
+                user._add_to_cache()
+            users.append((user, activity))
+        return users
+
     @classmethod
     @async_getter_lock
     async def get_by_mxid(
@@ -1107,6 +1248,24 @@ class User(DBUser, AbstractUser, BaseUser):
 
         return None
 
+    @classmethod
+    async def get_many_by_tgid(cls, tgids: Iterable[TelegramID]) -> dict[TelegramID, User]:
+        users = {}
+        missing = []
+        for tgid in tgids:
+            try:
+                users[tgid] = cls.by_tgid[tgid]
+            except KeyError:
+                missing.append(tgid)
+        user: cls
+        for user in await super().get_many_by_tgid(missing):
+            try:
+                users[user.tgid] = cls.by_mxid[user.mxid]
+            except KeyError:
+                user._add_to_cache()
+                users[user.tgid] = user
+        return users
+
     @classmethod
     async def find_by_username(cls, username: str) -> User | None:
         if not username:
@@ -2,11 +2,20 @@ from .color_log import ColorFormatter
 from .file_transfer import (
     UnicodeCustomEmoji,
     convert_image,
+    get_input_media,
+    message_media_to_input_media,
     transfer_custom_emojis_to_matrix,
     transfer_file_to_matrix,
     transfer_thumbnail_to_matrix,
     unicode_custom_emoji_map,
 )
+from .flood_wait import FloodWaitLimiter
+from .image_executor import image_executor
+from .lock_map import LockMap
+from .object_cache import ObjectCache
 from .parallel_file_transfer import parallel_transfer_to_telegram
 from .recursive_dict import recursive_del, recursive_get, recursive_set
+from .sticker_converter import sticker_converter
 from .tl_json import parse_tl_json
+from .transfer_scheduler import TransferPriority, transfer_scheduler
+from .typing_notifier import TypingNotifier
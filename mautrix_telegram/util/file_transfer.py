@@ -19,6 +19,7 @@ from typing import NamedTuple, Optional, Union
 from io import BytesIO
 from sqlite3 import IntegrityError
 import asyncio
+import hashlib
 import logging
 import pickle
 import pkgutil
@@ -32,28 +33,40 @@ from telethon.errors import (
     LocationInvalidError,
     SecurityError,
 )
+from telethon.extensions import BinaryReader
 from telethon.tl.functions.messages import GetCustomEmojiDocumentsRequest
 from telethon.tl.types import (
     Document,
+    InputDocument,
     InputDocumentFileLocation,
     InputFileLocation,
+    InputMediaDocument,
+    InputMediaPhoto,
     InputPeerPhotoFileLocation,
+    InputPhoto,
     InputPhotoFileLocation,
+    MessageMediaDocument,
+    MessageMediaPhoto,
+    Photo,
     PhotoCachedSize,
     PhotoSize,
+    TypeMessageMedia,
     TypePhotoSize,
 )
 
 from mautrix.appservice import IntentAPI
+from mautrix.types import ContentURI, EncryptedFile
 from mautrix.util import ffmpeg, magic, variation_selector
 
 from .. import abstract_user as au
 from ..db import TelegramFile as DBTelegramFile
 from ..tgclient import MautrixTelegramClient
 from ..util import sane_mimetypes
+from .image_executor import image_executor
+from .lock_map import LockMap
 from .parallel_file_transfer import parallel_transfer_to_matrix
-from .tgs_converter import convert_tgs_to
-from .webm_converter import convert_webm_to
+from .sticker_converter import sticker_converter
+from .transfer_scheduler import TransferPriority, transfer_scheduler
 
 try:
     from PIL import Image
@@ -61,9 +74,9 @@ except ImportError:
     Image = None
 
 try:
-    from mautrix.crypto.attachments import encrypt_attachment
+    from mautrix.crypto.attachments import async_encrypt_attachment, encrypt_attachment
 except ImportError:
-    encrypt_attachment = None
+    async_encrypt_attachment = encrypt_attachment = None
 
 log: logging.Logger = logging.getLogger("mau.util")
 
@@ -76,7 +89,26 @@ TypeLocation = Union[
 ]
 
 
-def convert_image(
+def _convert_image(
+    file: bytes,
+    source_mime: str = "image/webp",
+    target_type: str = "png",
+    thumbnail_to: tuple[int, int] | None = None,
+) -> tuple[str, bytes, int | None, int | None]:
+    image: Image.Image = Image.open(BytesIO(file)).convert("RGBA")
+    if thumbnail_to:
+        image.thumbnail(thumbnail_to, Image.ANTIALIAS)
+    new_file = BytesIO()
+    image.save(new_file, target_type)
+    w, h = image.size
+    return f"image/{target_type}", new_file.getvalue(), w, h
+
+
+def _read_image_size(file: bytes) -> tuple[int, int]:
+    return Image.open(BytesIO(file)).size
+
+
+async def convert_image(
     file: bytes,
     source_mime: str = "image/webp",
     target_type: str = "png",
@@ -85,16 +117,14 @@ def convert_image(
     if not Image:
         return source_mime, file, None, None
     try:
-        image: Image.Image = Image.open(BytesIO(file)).convert("RGBA")
-        if thumbnail_to:
-            image.thumbnail(thumbnail_to, Image.ANTIALIAS)
-        new_file = BytesIO()
-        image.save(new_file, target_type)
-        w, h = image.size
-        return f"image/{target_type}", new_file.getvalue(), w, h
+        return await image_executor.run(
+            _convert_image, file, source_mime, target_type, thumbnail_to
+        )
+    except asyncio.TimeoutError:
+        log.warning(f"Timed out converting {source_mime} to {target_type}")
     except Exception:
         log.exception(f"Failed to convert {source_mime} to {target_type}")
-        return source_mime, file, None, None
+    return source_mime, file, None, None
 
 
 async def _read_video_thumbnail(data: bytes, mime_type: str) -> tuple[bytes, int, int]:
@@ -105,10 +135,156 @@ async def _read_video_thumbnail(data: bytes, mime_type: str) -> tuple[bytes, int
         input_mime=mime_type,
         logger=log,
     )
-    width, height = Image.open(BytesIO(first_frame)).size
+    width, height = await image_executor.run(_read_image_size, first_frame)
     return first_frame, width, height
 
 
+async def _upload_deduplicated(
+    intent: IntentAPI, file: bytes, mime_type: str, encrypt: bool, async_upload: bool
+) -> tuple[ContentURI, EncryptedFile | None, bytes]:
+    """
+    Upload a file to Matrix, unless a file with the exact same content (and encryption state)
+    has already been transferred, in which case the existing mxc URI is reused.
+    """
+    sha256 = hashlib.sha256(file).digest()
+    existing = await DBTelegramFile.find_by_sha256(sha256, encrypted=encrypt)
+    if existing:
+        log.debug(f"Reusing {existing.mxc} from {existing.id} for identical file content")
+        return existing.mxc, existing.decryption_info, sha256
+
+    decryption_info = None
+    upload_mime_type = mime_type
+    if encrypt:
+        file, decryption_info = encrypt_attachment(file)
+        upload_mime_type = "application/octet-stream"
+    content_uri = await intent.upload_media(file, upload_mime_type, async_upload=async_upload)
+    if decryption_info:
+        decryption_info.url = content_uri
+    return content_uri, decryption_info, sha256
+
+
+async def _streaming_transfer_to_matrix(
+    client: MautrixTelegramClient,
+    intent: IntentAPI,
+    loc_id: str,
+    location: Document,
+    filename: str | None,
+    encrypt: bool,
+    chunk_size: int,
+    priority: TransferPriority,
+) -> DBTelegramFile:
+    """
+    Transfer a document to Matrix without holding the whole file in memory. The file is
+    downloaded in ``chunk_size`` byte pieces, which are hashed, encrypted and uploaded as they
+    arrive, so memory use per transfer is bounded by the chunk size rather than the file size.
+    """
+    async with transfer_scheduler.reserve(location.dc_id, priority):
+        return await _unlocked_streaming_transfer_to_matrix(
+            client, intent, loc_id, location, filename, encrypt, chunk_size
+        )
+
+
+async def _unlocked_streaming_transfer_to_matrix(
+    client: MautrixTelegramClient,
+    intent: IntentAPI,
+    loc_id: str,
+    location: Document,
+    filename: str | None,
+    encrypt: bool,
+    chunk_size: int,
+) -> DBTelegramFile:
+    chunks = client.iter_download(location, request_size=chunk_size, file_size=location.size)
+    first_chunk = b""
+    async for first_chunk in chunks:
+        break
+    mime_type = magic.mimetype(first_chunk) if first_chunk else location.mime_type
+    sha256 = hashlib.sha256()
+
+    async def data_stream():
+        sha256.update(first_chunk)
+        yield first_chunk
+        async for chunk in chunks:
+            sha256.update(chunk)
+            yield chunk
+
+    data = data_stream()
+    decryption_info = None
+    upload_mime_type = mime_type
+    upload_size = location.size
+    if encrypt and async_encrypt_attachment:
+
+        async def encrypted(stream):
+            nonlocal decryption_info
+            async for chunk in async_encrypt_attachment(stream):
+                if isinstance(chunk, EncryptedFile):
+                    decryption_info = chunk
+                else:
+                    yield chunk
+
+        data = encrypted(data)
+        upload_mime_type = "application/octet-stream"
+        upload_size = None
+    content_uri = await intent.upload_media(
+        data, mime_type=upload_mime_type, filename=filename, size=upload_size
+    )
+    if decryption_info:
+        decryption_info.url = content_uri
+    return DBTelegramFile(
+        id=loc_id,
+        mxc=content_uri,
+        mime_type=mime_type,
+        was_converted=False,
+        timestamp=int(time.time()),
+        size=location.size,
+        width=None,
+        height=None,
+        decryption_info=decryption_info,
+        sha256=sha256.digest(),
+    )
+
+
+async def _download_file(
+    client: MautrixTelegramClient, location: TypeLocation, priority: TransferPriority
+) -> bytes:
+    # Input locations don't say which DC they're on, so count them against the home DC
+    dc_id = getattr(location, "dc_id", None) or client.session.dc_id
+    async with transfer_scheduler.reserve(dc_id, priority):
+        return await client.download_file(location)
+
+
+def _location_to_input_media(location: TypeLocation) -> bytes | None:
+    if isinstance(location, Document):
+        return bytes(InputDocument(location.id, location.access_hash, location.file_reference))
+    elif isinstance(location, InputPhotoFileLocation):
+        return bytes(InputPhoto(location.id, location.access_hash, location.file_reference))
+    return None
+
+
+def message_media_to_input_media(media: TypeMessageMedia) -> bytes | None:
+    if isinstance(media, MessageMediaDocument) and isinstance(media.document, Document):
+        doc = media.document
+        return bytes(InputDocument(doc.id, doc.access_hash, doc.file_reference))
+    elif isinstance(media, MessageMediaPhoto) and isinstance(media.photo, Photo):
+        photo = media.photo
+        return bytes(InputPhoto(photo.id, photo.access_hash, photo.file_reference))
+    return None
+
+
+def get_input_media(file: DBTelegramFile) -> InputMediaDocument | InputMediaPhoto | None:
+    """
+    Get an input media object that sends the Telegram media this file was transferred from,
+    so it can be bridged back to Telegram without downloading and re-uploading it.
+    """
+    if not file.input_media:
+        return None
+    media = BinaryReader(file.input_media).tgread_object()
+    if isinstance(media, InputDocument):
+        return InputMediaDocument(id=media)
+    elif isinstance(media, InputPhoto):
+        return InputMediaPhoto(id=media)
+    return None
+
+
 def _location_to_id(location: TypeLocation) -> str:
     if isinstance(location, Document):
         return str(location.id)
@@ -131,6 +307,7 @@ async def transfer_thumbnail_to_matrix(
     width: int | None = None,
     height: int | None = None,
     async_upload: bool = False,
+    priority: TransferPriority = TransferPriority.LIVE,
 ) -> DBTelegramFile | None:
     if not Image or not ffmpeg.ffmpeg_path:
         return None
@@ -160,18 +337,13 @@ async def transfer_thumbnail_to_matrix(
             return None
         mime_type = "image/png"
     else:
-        file = await client.download_file(thumbnail_loc)
+        file = await _download_file(client, thumbnail_loc, priority)
         width, height = None, None
         mime_type = magic.mimetype(file)
 
-    decryption_info = None
-    upload_mime_type = mime_type
-    if encrypt:
-        file, decryption_info = encrypt_attachment(file)
-        upload_mime_type = "application/octet-stream"
-    content_uri = await intent.upload_media(file, upload_mime_type, async_upload=async_upload)
-    if decryption_info:
-        decryption_info.url = content_uri
+    content_uri, decryption_info, sha256 = await _upload_deduplicated(
+        intent, file, mime_type, encrypt, async_upload
+    )
 
     db_file = DBTelegramFile(
         id=loc_id,
@@ -183,6 +355,7 @@ async def transfer_thumbnail_to_matrix(
         width=width,
         height=height,
         decryption_info=decryption_info,
+        sha256=sha256,
     )
     try:
         await db_file.insert()
@@ -195,7 +368,7 @@ async def transfer_thumbnail_to_matrix(
     return db_file
 
 
-transfer_locks: dict[str, asyncio.Lock] = {}
+transfer_locks: LockMap[str] = LockMap()
 
 unicode_custom_emoji_map = pickle.loads(
     pkgutil.get_data("mautrix_telegram", "unicodemojipack.pickle")
@@ -241,22 +414,20 @@ async def transfer_custom_emojis_to_matrix(
         tgs_args = source.config["bridge.animated_emoji"]
         webm_convert = tgs_args["target"]
 
-        transfer_sema = asyncio.Semaphore(5)
-
         async def transfer(document: Document) -> None:
-            async with transfer_sema:
-                file_map[document.id] = await transfer_file_to_matrix(
-                    client,
-                    source.bridge.az.intent,
-                    document,
-                    is_sticker=True,
-                    tgs_convert=tgs_args,
-                    webm_convert=webm_convert,
-                    filename=f"emoji-{document.id}",
-                    # Emojis are used as inline images and can't be encrypted
-                    encrypt=False,
-                    async_upload=source.config["homeserver.async_media"],
-                )
+            file_map[document.id] = await transfer_file_to_matrix(
+                client,
+                source.bridge.az.intent,
+                document,
+                is_sticker=True,
+                tgs_convert=tgs_args,
+                webm_convert=webm_convert,
+                filename=f"emoji-{document.id}",
+                # Emojis are used as inline images and can't be encrypted
+                encrypt=False,
+                async_upload=source.config["homeserver.async_media"],
+                priority=TransferPriority.EMOJI,
+            )
 
         await asyncio.gather(*[transfer(doc) for doc in documents])
     return file_map
@@ -274,7 +445,10 @@ async def transfer_file_to_matrix(
     filename: str | None = None,
     encrypt: bool = False,
     parallel_id: int | None = None,
+    stream_chunk_size: int | None = None,
     async_upload: bool = False,
+    priority: TransferPriority = TransferPriority.LIVE,
+    source_message: tuple[int, int, int] | None = None,
 ) -> DBTelegramFile | None:
     location_id = _location_to_id(location)
     if not location_id:
@@ -286,12 +460,7 @@ async def transfer_file_to_matrix(
     if db_file:
         return db_file
 
-    try:
-        lock = transfer_locks[location_id]
-    except KeyError:
-        lock = asyncio.Lock()
-        transfer_locks[location_id] = lock
-    async with lock:
+    async with transfer_locks.lock(location_id):
         return await _unlocked_transfer_file_to_matrix(
             client,
             intent,
@@ -304,7 +473,10 @@ async def transfer_file_to_matrix(
             filename,
             encrypt,
             parallel_id,
+            stream_chunk_size,
             async_upload=async_upload,
+            priority=priority,
+            source_message=source_message,
         )
 
 
@@ -320,7 +492,10 @@ async def _unlocked_transfer_file_to_matrix(
     filename: str | None,
     encrypt: bool,
     parallel_id: int | None,
+    stream_chunk_size: int | None,
     async_upload: bool = False,
+    priority: TransferPriority = TransferPriority.LIVE,
+    source_message: tuple[int, int, int] | None = None,
 ) -> DBTelegramFile | None:
     db_file = await DBTelegramFile.get(loc_id)
     if db_file:
@@ -330,13 +505,25 @@ async def _unlocked_transfer_file_to_matrix(
 
     if parallel_id and isinstance(location, Document) and (not is_sticker or not tgs_convert):
         db_file = await parallel_transfer_to_matrix(
-            client, intent, loc_id, location, filename, encrypt, parallel_id
+            client, intent, loc_id, location, filename, encrypt, priority
         )
         mime_type = location.mime_type
         unencrypted_file = None
+    elif stream_chunk_size and isinstance(location, Document) and not is_sticker:
+        try:
+            db_file = await _streaming_transfer_to_matrix(
+                client, intent, loc_id, location, filename, encrypt, stream_chunk_size, priority
+            )
+        except (LocationInvalidError, FileIdInvalidError):
+            return None
+        except (AuthBytesInvalidError, AuthKeyInvalidError, SecurityError) as e:
+            log.exception(f"{e.__class__.__name__} while downloading a file.")
+            return None
+        mime_type = db_file.mime_type
+        unencrypted_file = None
     else:
         try:
-            unencrypted_file = file = await client.download_file(location)
+            unencrypted_file = file = await _download_file(client, location, priority)
         except (LocationInvalidError, FileIdInvalidError):
             return None
         except (AuthBytesInvalidError, AuthKeyInvalidError, SecurityError) as e:
@@ -348,9 +535,10 @@ async def _unlocked_transfer_file_to_matrix(
 
         image_converted = False
         is_tgs = mime_type == "application/gzip"
+        document_id = location.id if isinstance(location, Document) else None
         if is_sticker and tgs_convert and is_tgs:
-            converted_anim = await convert_tgs_to(
-                file, tgs_convert["target"], **tgs_convert["args"]
+            converted_anim = await sticker_converter.convert_tgs(
+                document_id, file, tgs_convert["target"], **tgs_convert["args"]
             )
             mime_type = converted_anim.mime
             file = converted_anim.data
@@ -358,20 +546,15 @@ async def _unlocked_transfer_file_to_matrix(
             image_converted = mime_type != "application/gzip"
             thumbnail = None
         elif is_sticker and webm_convert and webm_convert != "webm" and mime_type == "video/webm":
-            converted_anim = await convert_webm_to(file, webm_convert)
+            converted_anim = await sticker_converter.convert_webm(document_id, file, webm_convert)
             mime_type = converted_anim.mime
             file = converted_anim.data
             image_converted = mime_type != "video/webm"
             thumbnail = None
 
-        decryption_info = None
-        upload_mime_type = mime_type
-        if encrypt and encrypt_attachment:
-            file, decryption_info = encrypt_attachment(file)
-            upload_mime_type = "application/octet-stream"
-        content_uri = await intent.upload_media(file, upload_mime_type, async_upload=async_upload)
-        if decryption_info:
-            decryption_info.url = content_uri
+        content_uri, decryption_info, sha256 = await _upload_deduplicated(
+            intent, file, mime_type, bool(encrypt and encrypt_attachment), async_upload
+        )
 
         db_file = DBTelegramFile(
             id=loc_id,
@@ -383,6 +566,7 @@ async def _unlocked_transfer_file_to_matrix(
             size=len(file),
             width=width,
             height=height,
+            sha256=sha256,
         )
     try:
         if thumbnail and (mime_type.startswith("video/") or mime_type == "image/gif"):
@@ -397,6 +581,7 @@ async def _unlocked_transfer_file_to_matrix(
                     mime_type=mime_type,
                     encrypt=encrypt,
                     async_upload=async_upload,
+                    priority=priority,
                 )
             except FileIdInvalidError:
                 log.warning(f"Failed to transfer thumbnail {thumbnail!s}", exc_info=True)
@@ -416,6 +601,11 @@ async def _unlocked_transfer_file_to_matrix(
     except Exception:
         log.exception(f"Failed to transfer thumbnail for {loc_id}")
 
+    db_file.input_media = _location_to_input_media(location)
+    if source_message:
+        db_file.source_chat_id, db_file.source_receiver, db_file.source_msg_id = source_message
+    if isinstance(location, Document):
+        db_file.file_name = filename
     try:
         await db_file.insert()
     except (UniqueViolationError, IntegrityError) as e:
@@ -0,0 +1,42 @@
+# mautrix-telegram - A Matrix-Telegram puppeting bridge
+# Copyright (C) 2022 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+import asyncio
+import time
+
+
+class FloodWaitLimiter:
+    """
+    A shared pause flag for tasks that use the same Telegram account. When any task hits a flood
+    wait, all tasks waiting on the limiter are held back until the flood wait expires.
+    """
+
+    _resume_at: float
+
+    def __init__(self) -> None:
+        self._resume_at = 0
+
+    @property
+    def remaining(self) -> float:
+        return max(self._resume_at - time.monotonic(), 0)
+
+    def add_flood_wait(self, seconds: int | float) -> None:
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    async def wait(self) -> None:
+        while (remaining := self.remaining) > 0:
+            await asyncio.sleep(remaining)
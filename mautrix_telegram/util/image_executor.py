@@ -0,0 +1,145 @@
+# mautrix-telegram - A Matrix-Telegram puppeting bridge
+# Copyright (C) 2022 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+from typing import Callable, TypeVar
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import time
+
+from mautrix.util.opt_prometheus import Counter, Gauge, Histogram
+
+T = TypeVar("T")
+
+IMAGE_JOB_TIME = Histogram(
+    name="bridge_image_job",
+    documentation="Time spent running image processing jobs in the executor",
+    labelnames=("job",),
+)
+IMAGE_JOB_QUEUE_LENGTH = Gauge(
+    name="bridge_image_job_queue_length",
+    documentation="Number of image processing jobs waiting for or running in the executor",
+)
+IMAGE_JOB_TIMEOUTS = Counter(
+    name="bridge_image_job_timeouts",
+    documentation="Number of image processing jobs that timed out",
+    labelnames=("job",),
+)
+
+
+class ImageExecutor:
+    """
+    Runs CPU-bound image processing (PIL) off the event loop in a thread or process pool.
+    Callers wait for a queue slot when too many jobs are pending.
+
+    Jobs that are already running can't be interrupted, so a job that times out keeps its worker
+    (and its queue slot) until it actually finishes. This means stuck jobs can only ever occupy
+    the configured number of workers instead of piling up more threads or queued work.
+    """
+
+    kind: str
+    workers: int
+    max_queue: int
+    timeout: float
+
+    _executor: Executor | None
+    _queue_sema: asyncio.Semaphore | None
+
+    def __init__(
+        self, kind: str = "thread", workers: int = 2, max_queue: int = 32, timeout: float = 30
+    ) -> None:
+        self._executor = None
+        self._queue_sema = None
+        self.configure(kind, workers, max_queue, timeout)
+
+    def configure(self, kind: str, workers: int, max_queue: int, timeout: float) -> None:
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown image executor type {kind!r}")
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.kind = kind
+        self.workers = max(workers, 1)
+        self.max_queue = max(max_queue, 0)
+        self.timeout = timeout
+        self._queue_sema = None
+
+    @property
+    def executor(self) -> Executor:
+        if not self._executor:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="image"
+                )
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """
+        Run ``func(*args)`` in the executor. With a process pool, the function and arguments
+        must be picklable.
+
+        Raises:
+            asyncio.TimeoutError: If the job doesn't finish within the configured timeout.
+        """
+        if not self._queue_sema:
+            self._queue_sema = asyncio.Semaphore(self.workers + self.max_queue)
+        queue_sema = self._queue_sema
+        job = getattr(func, "__name__", "unknown").lstrip("_")
+        IMAGE_JOB_QUEUE_LENGTH.inc()
+        try:
+            await queue_sema.acquire()
+        except BaseException:
+            IMAGE_JOB_QUEUE_LENGTH.dec()
+            raise
+        start = time.monotonic()
+        try:
+            concurrent_future = self.executor.submit(func, *args)
+        except BaseException:
+            self._release_slot(queue_sema)
+            raise
+        future = asyncio.wrap_future(concurrent_future)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout or None)
+        except asyncio.TimeoutError:
+            IMAGE_JOB_TIMEOUTS.labels(job=job).inc()
+            raise
+        finally:
+            IMAGE_JOB_TIME.labels(job=job).observe(time.monotonic() - start)
+            if not future.done() and not concurrent_future.cancel():
+                # The job is already running and can't be stopped, so only free the slot
+                # once its thread or process is actually free again.
+                future.add_done_callback(lambda _: self._release_slot(queue_sema))
+            else:
+                self._release_slot(queue_sema)
+
+    @staticmethod
+    def _release_slot(queue_sema: asyncio.Semaphore) -> None:
+        queue_sema.release()
+        IMAGE_JOB_QUEUE_LENGTH.dec()
+
+    def shutdown(self) -> None:
+        """
+        Stop the executor without waiting. Queued jobs are cancelled, but jobs that are already
+        running in threads are left to finish in the background.
+        """
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_executor = ImageExecutor()
@@ -0,0 +1,64 @@
+# mautrix-telegram - A Matrix-Telegram puppeting bridge
+# Copyright (C) 2022 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+from typing import AsyncIterator, Generic, Hashable, TypeVar
+from contextlib import asynccontextmanager
+import asyncio
+
+K = TypeVar("K", bound=Hashable)
+
+
+class _RefCountedLock:
+    __slots__ = ("lock", "refs")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+
+class LockMap(Generic[K]):
+    """
+    A map of per-key locks. Each lock only exists while something is holding or waiting for it,
+    so the map doesn't grow with the number of distinct keys ever used.
+    """
+
+    _locks: dict[K, _RefCountedLock]
+
+    def __init__(self) -> None:
+        self._locks = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def locked(self, key: K) -> bool:
+        entry = self._locks.get(key)
+        return entry is not None and entry.lock.locked()
+
+    @asynccontextmanager
+    async def lock(self, key: K) -> AsyncIterator[None]:
+        try:
+            entry = self._locks[key]
+        except KeyError:
+            entry = self._locks[key] = _RefCountedLock()
+        entry.refs += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.refs -= 1
+            if entry.refs == 0:
+                del self._locks[key]
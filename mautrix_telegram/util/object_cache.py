@@ -0,0 +1,156 @@
+# mautrix-telegram - A Matrix-Telegram puppeting bridge
+# Copyright (C) 2022 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+from typing import Callable, Hashable, Iterator, MutableMapping, TypeVar
+from collections import OrderedDict
+import time
+
+from mautrix.util.opt_prometheus import Counter, Gauge
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+OBJECT_CACHE_HITS = Counter(
+    name="bridge_object_cache_hits",
+    documentation="Number of lookups served from an in-memory object cache",
+    labelnames=("cache",),
+)
+OBJECT_CACHE_MISSES = Counter(
+    name="bridge_object_cache_misses",
+    documentation="Number of lookups not found in an in-memory object cache",
+    labelnames=("cache",),
+)
+OBJECT_CACHE_EVICTIONS = Counter(
+    name="bridge_object_cache_evictions",
+    documentation="Number of objects evicted from an in-memory object cache",
+    labelnames=("cache",),
+)
+OBJECT_CACHE_SIZE = Gauge(
+    name="bridge_object_cache_size",
+    documentation="Number of objects in an in-memory object cache",
+    labelnames=("cache",),
+)
+
+
+class ObjectCache(MutableMapping[K, V]):
+    """
+    A dict-like LRU cache for bridge objects (portals, puppets) that may only be instantiated
+    once per key. When the cache grows past ``max_size``, the least recently used objects that
+    have been idle for at least ``min_idle`` seconds and aren't in use are evicted.
+
+    Lookups with ``[]`` and ``get`` count as uses, while iterating and ``in`` checks don't.
+    Iterating returns a snapshot, so the cache can be used and modified while iterating.
+    """
+
+    name: str
+    max_size: int
+    min_idle: float
+    in_use: Callable[[V], bool]
+    on_evict: Callable[[K, V], None] | None
+
+    _data: OrderedDict[K, V]
+    _last_used: dict[K, float]
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._data = OrderedDict()
+        self._last_used = {}
+        self.configure()
+
+    def configure(
+        self,
+        max_size: int = 0,
+        min_idle: float = 0,
+        in_use: Callable[[V], bool] = lambda _: False,
+        on_evict: Callable[[K, V], None] | None = None,
+    ) -> None:
+        self.max_size = max(max_size, 0)
+        self.min_idle = min_idle
+        self.in_use = in_use
+        self.on_evict = on_evict
+
+    def __getitem__(self, key: K) -> V:
+        try:
+            value = self._data[key]
+        except KeyError:
+            OBJECT_CACHE_MISSES.labels(cache=self.name).inc()
+            raise
+        self.touch(key)
+        OBJECT_CACHE_HITS.labels(cache=self.name).inc()
+        return value
+
+    def __setitem__(self, key: K, value: V) -> None:
+        self._data[key] = value
+        self.touch(key)
+        self._evict()
+        OBJECT_CACHE_SIZE.labels(cache=self.name).set(len(self._data))
+
+    def __delitem__(self, key: K) -> None:
+        del self._data[key]
+        self._last_used.pop(key, None)
+        OBJECT_CACHE_SIZE.labels(cache=self.name).set(len(self._data))
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(list(self._data))
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def items(self) -> list[tuple[K, V]]:
+        return list(self._data.items())
+
+    def values(self) -> list[V]:
+        return list(self._data.values())
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._last_used.clear()
+        OBJECT_CACHE_SIZE.labels(cache=self.name).set(0)
+
+    def touch(self, key: K) -> None:
+        if key in self._data:
+            self._data.move_to_end(key)
+            self._last_used[key] = time.monotonic()
+
+    def discard(self, key: K, value: V) -> None:
+        """Remove ``key`` if it still points at ``value``."""
+        if self._data.get(key) is value:
+            del self[key]
+
+    def _evict(self) -> None:
+        if not self.max_size:
+            return
+        now = time.monotonic()
+        # Objects that are in use are moved to the end, so each one is checked at most once.
+        checks_left = len(self._data)
+        while len(self._data) > self.max_size and checks_left > 0:
+            checks_left -= 1
+            key, value = next(iter(self._data.items()))
+            if now - self._last_used.get(key, 0) < self.min_idle:
+                # Entries after this one were used more recently or are in use
+                break
+            if self.in_use(value):
+                self._data.move_to_end(key)
+                continue
+            del self._data[key]
+            self._last_used.pop(key, None)
+            OBJECT_CACHE_EVICTIONS.labels(cache=self.name).inc()
+            if self.on_evict:
+                self.on_evict(key, value)
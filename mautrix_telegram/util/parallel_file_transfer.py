@@ -16,7 +16,6 @@
 from __future__ import annotations
 
 from typing import AsyncGenerator, Awaitable, Union, cast
-from collections import defaultdict
 import asyncio
 import hashlib
 import logging
@@ -52,6 +51,7 @@ from mautrix.util.logging import TraceLogger
 
 from ..db import TelegramFile as DBTelegramFile
 from ..tgclient import MautrixTelegramClient
+from .transfer_scheduler import TransferPriority, transfer_scheduler
 
 try:
     from mautrix.crypto.attachments import async_encrypt_attachment
@@ -306,9 +306,6 @@ class ParallelTransferrer:
         await self._cleanup()
 
 
-parallel_transfer_locks: defaultdict[int, asyncio.Lock] = defaultdict(lambda: asyncio.Lock())
-
-
 async def parallel_transfer_to_matrix(
     client: MautrixTelegramClient,
     intent: IntentAPI,
@@ -316,15 +313,23 @@ async def parallel_transfer_to_matrix(
     location: TypeLocation,
     filename: str,
     encrypt: bool,
-    parallel_id: int,
+    priority: TransferPriority = TransferPriority.LIVE,
 ) -> DBTelegramFile:
     size = location.size
     mime_type = location.mime_type
     dc_id, location = utils.get_input_location(location)
-    # We lock the transfers because telegram has connection count limits
-    async with parallel_transfer_locks[parallel_id]:
+    sha256 = hashlib.sha256()
+
+    async def hashed(stream):
+        async for chunk in stream:
+            sha256.update(chunk)
+            yield chunk
+
+    # Telegram has connection count limits, so the scheduler decides how many we can use
+    wanted_connections = ParallelTransferrer._get_connection_count(size)
+    async with transfer_scheduler.reserve(dc_id, priority, wanted_connections) as connections:
         downloader = ParallelTransferrer(client, dc_id)
-        data = downloader.download(location, size)
+        data = hashed(downloader.download(location, size, connection_count=connections))
         decryption_info = None
         up_mime_type = mime_type
         if encrypt and async_encrypt_attachment:
@@ -354,18 +359,21 @@ async def parallel_transfer_to_matrix(
         width=None,
         height=None,
         decryption_info=decryption_info,
+        sha256=sha256.digest(),
     )
 
 
 async def _internal_transfer_to_telegram(
-    client: MautrixTelegramClient, response: ClientResponse
+    client: MautrixTelegramClient, response: ClientResponse, connections: int
 ) -> tuple[TypeInputFile, int]:
     file_id = helpers.generate_random_long()
     file_size = response.content_length
 
     hash_md5 = hashlib.md5()
     uploader = ParallelTransferrer(client)
-    part_size, part_count, is_large = await uploader.init_upload(file_id, file_size)
+    part_size, part_count, is_large = await uploader.init_upload(
+        file_id, file_size, connection_count=connections
+    )
     buffer = bytearray()
     async for data in response.content:
         if not is_large:
@@ -392,9 +400,12 @@ async def _internal_transfer_to_telegram(
 
 
 async def parallel_transfer_to_telegram(
-    client: MautrixTelegramClient, intent: IntentAPI, uri: ContentURI, parallel_id: int
+    client: MautrixTelegramClient, intent: IntentAPI, uri: ContentURI
 ) -> tuple[TypeInputFile, int]:
     url = intent.api.get_download_url(uri)
-    async with parallel_transfer_locks[parallel_id]:
-        async with intent.api.session.get(url) as response:
-            return await _internal_transfer_to_telegram(client, response)
+    async with intent.api.session.get(url) as response:
+        wanted_connections = ParallelTransferrer._get_connection_count(response.content_length)
+        async with transfer_scheduler.reserve(
+            client.session.dc_id, TransferPriority.LIVE, wanted_connections
+        ) as connections:
+            return await _internal_transfer_to_telegram(client, response, connections)
@@ -0,0 +1,131 @@
+# mautrix-telegram - A Matrix-Telegram puppeting bridge
+# Copyright (C) 2022 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Tuple
+from collections import OrderedDict
+import asyncio
+
+from mautrix.util.opt_prometheus import Counter, Gauge
+
+from .lock_map import LockMap
+from .tgs_converter import ConvertedSticker, convert_tgs_to
+from .webm_converter import convert_webm_to
+
+STICKER_CONVERSIONS = Counter(
+    name="bridge_sticker_conversions",
+    documentation="Number of animated sticker conversions, by whether the result was cached",
+    labelnames=("source", "cached"),
+)
+STICKER_CONVERSIONS_ACTIVE = Gauge(
+    name="bridge_sticker_conversions_active",
+    documentation="Number of animated sticker conversions currently running",
+)
+
+CacheKey = Tuple[int, str, str, int, int, int]
+
+
+class StickerConverter:
+    """
+    Converts animated stickers with a cap on concurrently running converter processes, and
+    caches the results by document ID and output parameters. The cache key doesn't include
+    whether the file will be encrypted, so both variants share a single conversion.
+    """
+
+    max_concurrent: int
+    cache_size: int
+
+    _cache: OrderedDict[CacheKey, ConvertedSticker]
+    _locks: LockMap[CacheKey]
+    _sema: asyncio.Semaphore | None
+
+    def __init__(self, max_concurrent: int = 4, cache_size: int = 64) -> None:
+        self._cache = OrderedDict()
+        self._locks = LockMap()
+        self._sema = None
+        self.configure(max_concurrent, cache_size)
+
+    def configure(self, max_concurrent: int, cache_size: int) -> None:
+        self.max_concurrent = max(max_concurrent, 1)
+        self.cache_size = max(cache_size, 0)
+        self._sema = None
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _convert(
+        self,
+        key: CacheKey | None,
+        fallback_mime: str,
+        convert: Callable[[], Awaitable[ConvertedSticker]],
+    ) -> ConvertedSticker:
+        if key is None or not self.cache_size:
+            return await self._run(key, convert)
+        async with self._locks.lock(key):
+            try:
+                self._cache.move_to_end(key)
+                STICKER_CONVERSIONS.labels(source=key[1], cached="true").inc()
+                return self._cache[key]
+            except KeyError:
+                pass
+            converted = await self._run(key, convert)
+            # Failed conversions return the original file, those aren't worth caching
+            if converted.mime != fallback_mime:
+                self._cache[key] = converted
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            return converted
+
+    async def _run(
+        self, key: CacheKey | None, convert: Callable[[], Awaitable[ConvertedSticker]]
+    ) -> ConvertedSticker:
+        if not self._sema:
+            self._sema = asyncio.Semaphore(self.max_concurrent)
+        STICKER_CONVERSIONS.labels(source=key[1] if key else "unknown", cached="false").inc()
+        async with self._sema:
+            STICKER_CONVERSIONS_ACTIVE.inc()
+            try:
+                return await convert()
+            finally:
+                STICKER_CONVERSIONS_ACTIVE.dec()
+
+    async def convert_tgs(
+        self,
+        document_id: int | None,
+        file: bytes,
+        convert_to: str,
+        width: int,
+        height: int,
+        **kwargs: Any,
+    ) -> ConvertedSticker:
+        key = None
+        if document_id is not None:
+            key = (document_id, "tgs", convert_to, width, height, kwargs.get("fps", 0))
+        return await self._convert(
+            key,
+            "application/gzip",
+            lambda: convert_tgs_to(file, convert_to, width, height, **kwargs),
+        )
+
+    async def convert_webm(
+        self, document_id: int | None, file: bytes, convert_to: str
+    ) -> ConvertedSticker:
+        key = None
+        if document_id is not None:
+            key = (document_id, "webm", convert_to, 0, 0, 0)
+        return await self._convert(key, "video/webm", lambda: convert_webm_to(file, convert_to))
+
+
+sticker_converter = StickerConverter()
@@ -99,56 +99,70 @@ if lottieconverter:
     converters["png"] = tgs_to_png
     converters["gif"] = tgs_to_gif
 
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+async def _tgs_to_animation(
+    file: bytes, width: int, height: int, fps: int, output_args: tuple[str, ...]
+) -> tuple[bytes, bytes]:
+    # lottieconverter can only write frame sequences to files, so let ffmpeg read them straight
+    # from the temporary directory instead of passing every frame through Python.
+    with tempfile.TemporaryDirectory(prefix="tgs_") as tmpdir:
+        file_template = f"{tmpdir}/out_"
+        await _run_lottieconverter(
+            args=("-", file_template, "pngs", f"{width}x{height}", str(fps)),
+            input_data=file,
+        )
+        loop = asyncio.get_running_loop()
+        frame_names = await loop.run_in_executor(None, os.listdir, tmpdir)
+        if not frame_names:
+            raise ffmpeg.ConverterError("lottieconverter didn't output any frames")
+        first_frame = await loop.run_in_executor(None, _read_file, f"{tmpdir}/{min(frame_names)}")
+        data = await ffmpeg.convert_path(
+            input_args=("-framerate", str(fps), "-pattern_type", "glob"),
+            input_file=f"{file_template}*.png",
+            output_args=output_args,
+            output_path_override="-",
+            output_extension=None,
+        )
+        return data, first_frame
+
+
 if lottieconverter and ffmpeg.ffmpeg_path:
 
     async def tgs_to_webm(
         file: bytes, width: int, height: int, fps: int = 30, **_: Any
     ) -> ConvertedSticker:
-        with tempfile.TemporaryDirectory(prefix="tgs_") as tmpdir:
-            file_template = tmpdir + "/out_"
-            try:
-                await _run_lottieconverter(
-                    args=("-", file_template, "pngs", f"{width}x{height}", str(fps)),
-                    input_data=file,
-                )
-                first_frame_name = min(os.listdir(tmpdir))
-                with open(f"{tmpdir}/{first_frame_name}", "rb") as first_frame_file:
-                    first_frame_data = first_frame_file.read()
-                webm_data = await ffmpeg.convert_path(
-                    input_args=("-framerate", str(fps), "-pattern_type", "glob"),
-                    input_file=f"{file_template}*.png",
-                    output_args=("-c:v", "libvpx-vp9", "-pix_fmt", "yuva420p", "-f", "webm"),
-                    output_path_override="-",
-                    output_extension=None,
-                )
-                return ConvertedSticker("video/webm", webm_data, "image/png", first_frame_data)
-            except ffmpeg.ConverterError as e:
-                log.error(str(e))
+        try:
+            webm_data, first_frame_data = await _tgs_to_animation(
+                file,
+                width,
+                height,
+                fps,
+                output_args=("-c:v", "libvpx-vp9", "-pix_fmt", "yuva420p", "-f", "webm"),
+            )
+            return ConvertedSticker("video/webm", webm_data, "image/png", first_frame_data)
+        except ffmpeg.ConverterError as e:
+            log.error(str(e))
         return ConvertedSticker("application/gzip", file)
 
     async def tgs_to_webp(
         file: bytes, width: int, height: int, fps: int = 30, **_: Any
     ) -> ConvertedSticker:
-        with tempfile.TemporaryDirectory(prefix="tgs_") as tmpdir:
-            file_template = tmpdir + "/out_"
-            try:
-                await _run_lottieconverter(
-                    args=("-", file_template, "pngs", f"{width}x{height}", str(fps)),
-                    input_data=file,
-                )
-                first_frame_name = min(os.listdir(tmpdir))
-                with open(f"{tmpdir}/{first_frame_name}", "rb") as first_frame_file:
-                    first_frame_data = first_frame_file.read()
-                webp_data = await ffmpeg.convert_path(
-                    input_args=("-framerate", str(fps), "-pattern_type", "glob"),
-                    input_file=f"{file_template}*.png",
-                    output_args=("-c:v", "libwebp_anim", "-pix_fmt", "yuva420p", "-f", "webp"),
-                    output_path_override="-",
-                    output_extension=None,
-                )
-                return ConvertedSticker("image/webp", webp_data, "image/png", first_frame_data)
-            except ffmpeg.ConverterError as e:
-                log.error(str(e))
+        try:
+            webp_data, first_frame_data = await _tgs_to_animation(
+                file,
+                width,
+                height,
+                fps,
+                output_args=("-c:v", "libwebp_anim", "-pix_fmt", "yuva420p", "-f", "webp"),
+            )
+            return ConvertedSticker("image/webp", webp_data, "image/png", first_frame_data)
+        except ffmpeg.ConverterError as e:
+            log.error(str(e))
         return ConvertedSticker("application/gzip", file)
 
     converters["webm"] = tgs_to_webm
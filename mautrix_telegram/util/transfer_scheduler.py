@@ -0,0 +1,183 @@
+# mautrix-telegram - A Matrix-Telegram puppeting bridge
+# Copyright (C) 2022 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+from typing import AsyncIterator
+from bisect import insort
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from enum import IntEnum
+import asyncio
+import itertools
+import time
+
+from mautrix.util.opt_prometheus import Gauge, Histogram
+
+TRANSFER_QUEUE_WAIT = Histogram(
+    name="bridge_media_transfer_queue_wait",
+    documentation="Time media transfers wait for Telegram connection slots",
+    labelnames=("priority",),
+)
+TRANSFER_QUEUE_LENGTH = Gauge(
+    name="bridge_media_transfer_queue_length",
+    documentation="Number of media transfers waiting for Telegram connection slots",
+    labelnames=("priority",),
+)
+TRANSFER_CONNECTIONS = Gauge(
+    name="bridge_media_transfer_connections",
+    documentation="Number of Telegram connection slots held by media transfers",
+    labelnames=("dc",),
+)
+
+
+class TransferPriority(IntEnum):
+    LIVE = 0
+    EMOJI = 1
+    BACKFILL = 2
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "dc_id", "connections", "future")
+
+    def __init__(self, priority: TransferPriority, seq: int, dc_id: int, connections: int) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.dc_id = dc_id
+        self.connections = connections
+        self.future = asyncio.get_running_loop().create_future()
+
+    def __lt__(self, other: _Waiter) -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class TransferScheduler:
+    """
+    Hands out Telegram connection slots for media transfers. The number of slots is limited
+    globally, per DC and for backfill, and waiting transfers are served in priority order.
+    """
+
+    global_limit: int
+    per_dc_limit: int
+    backfill_limit: int
+
+    _active_total: int
+    _active_backfill: int
+    _active_per_dc: defaultdict[int, int]
+    _waiters: list[_Waiter]
+
+    def __init__(
+        self, global_limit: int = 40, per_dc_limit: int = 20, backfill_limit: int = 20
+    ) -> None:
+        self.global_limit = global_limit
+        self.per_dc_limit = per_dc_limit
+        self.backfill_limit = backfill_limit
+        self._active_total = 0
+        self._active_backfill = 0
+        self._active_per_dc = defaultdict(lambda: 0)
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def _available(self, dc_id: int, priority: TransferPriority) -> int:
+        available = min(
+            self.global_limit - self._active_total,
+            self.per_dc_limit - self._active_per_dc[dc_id],
+        )
+        if priority == TransferPriority.BACKFILL:
+            available = min(available, self.backfill_limit - self._active_backfill)
+        return available
+
+    def _acquire(self, dc_id: int, priority: TransferPriority, connections: int) -> int:
+        granted = min(connections, self._available(dc_id, priority))
+        self._active_total += granted
+        self._active_per_dc[dc_id] += granted
+        if priority == TransferPriority.BACKFILL:
+            self._active_backfill += granted
+        TRANSFER_CONNECTIONS.labels(dc=dc_id).inc(granted)
+        return granted
+
+    def _release(self, dc_id: int, priority: TransferPriority, connections: int) -> None:
+        self._active_total -= connections
+        self._active_per_dc[dc_id] -= connections
+        if priority == TransferPriority.BACKFILL:
+            self._active_backfill -= connections
+        TRANSFER_CONNECTIONS.labels(dc=dc_id).dec(connections)
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        for waiter in list(self._waiters):
+            if self._active_total >= self.global_limit:
+                break
+            if self._available(waiter.dc_id, waiter.priority) > 0:
+                self._waiters.remove(waiter)
+                waiter.future.set_result(
+                    self._acquire(waiter.dc_id, waiter.priority, waiter.connections)
+                )
+
+    def _has_waiters_before(self, dc_id: int, priority: TransferPriority) -> bool:
+        for waiter in self._waiters:
+            if waiter.priority > priority:
+                break
+            # Waiters for a saturated DC only block transfers to the same DC, while ones waiting
+            # for a budget shared by all DCs block everyone with the same or lower priority.
+            if waiter.dc_id == dc_id or self._active_per_dc[waiter.dc_id] < self.per_dc_limit:
+                return True
+        return False
+
+    async def _wait_for_slot(
+        self, dc_id: int, priority: TransferPriority, connections: int
+    ) -> int:
+        waiter = _Waiter(priority, next(self._seq), dc_id, connections)
+        insort(self._waiters, waiter)
+        queue_length = TRANSFER_QUEUE_LENGTH.labels(priority=priority.name.lower())
+        queue_length.inc()
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(dc_id, priority, waiter.future.result())
+            else:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            queue_length.dec()
+
+    @asynccontextmanager
+    async def reserve(
+        self,
+        dc_id: int,
+        priority: TransferPriority = TransferPriority.LIVE,
+        connections: int = 1,
+    ) -> AsyncIterator[int]:
+        """
+        Reserve connection slots for a transfer. Yields the number of connections that were
+        granted, which is at least 1 but may be less than requested if the budgets are tight.
+        """
+        connections = max(connections, 1)
+        start = time.monotonic()
+        if not self._has_waiters_before(dc_id, priority) and self._available(dc_id, priority) > 0:
+            granted = self._acquire(dc_id, priority, connections)
+        else:
+            granted = await self._wait_for_slot(dc_id, priority, connections)
+        TRANSFER_QUEUE_WAIT.labels(priority=priority.name.lower()).observe(
+            time.monotonic() - start
+        )
+        try:
+            yield granted
+        finally:
+            self._release(dc_id, priority, granted)
+
+
+transfer_scheduler = TransferScheduler()
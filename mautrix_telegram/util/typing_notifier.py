@@ -0,0 +1,131 @@
+# mautrix-telegram - A Matrix-Telegram puppeting bridge
+# Copyright (C) 2022 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Iterable, Tuple
+import asyncio
+import logging
+import time
+
+from mautrix.types import RoomID
+from mautrix.util import background_task
+from mautrix.util.opt_prometheus import Counter
+
+from ..types import TelegramID
+
+if TYPE_CHECKING:
+    from ..portal import Portal
+    from ..user import User
+
+TYPING_SENT = Counter(
+    name="bridge_typing_notifications_sent",
+    documentation="Number of typing notifications sent to Telegram",
+    labelnames=("typing",),
+)
+TYPING_SKIPPED = Counter(
+    name="bridge_typing_notifications_skipped",
+    documentation="Number of typing notifications that weren't sent to Telegram",
+    labelnames=("reason",),
+)
+
+TypingKey = Tuple[RoomID, TelegramID]
+
+
+class TypingNotifier:
+    """
+    Bridges Matrix typing notifications to Telegram. Only changes are sent immediately, active
+    typing is re-sent at Telegram's refresh interval, and all typing requests share a global
+    rate limit so they can't crowd out more important requests.
+    """
+
+    log: logging.Logger = logging.getLogger("mau.typing")
+
+    refresh_interval: float
+    rate: float
+    burst: float
+
+    _active: dict[TypingKey, tuple[Portal, User, float]]
+    _refresh_task: asyncio.Task | None
+    _tokens: float
+    _tokens_updated_at: float
+
+    def __init__(self, refresh_interval: float = 5, rate: float = 10, burst: float = 20) -> None:
+        self.refresh_interval = refresh_interval
+        self.rate = rate
+        self.burst = burst
+        self._active = {}
+        self._refresh_task = None
+        self._tokens = burst
+        self._tokens_updated_at = time.monotonic()
+
+    async def update(
+        self, portal: Portal, started: Iterable[User], stopped: Iterable[User]
+    ) -> None:
+        now = time.monotonic()
+        sends = []
+        for user in started:
+            self._active[(portal.mxid, user.tgid)] = (portal, user, now)
+            sends.append(self._send(portal, user, True))
+        for user in stopped:
+            if self._active.pop((portal.mxid, user.tgid), None):
+                sends.append(self._send(portal, user, False))
+        await asyncio.gather(*sends)
+        if self._active and not self._refresh_task:
+            self._refresh_task = background_task.create(self._refresh_loop())
+
+    def _take_token(self) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        elapsed = now - self._tokens_updated_at
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._tokens_updated_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    async def _send(self, portal: Portal, user: User, typing: bool) -> None:
+        if typing and portal.send_lock.locked(user.tgid):
+            # Sending the message will end the typing notification anyway
+            TYPING_SKIPPED.labels(reason="sending").inc()
+            return
+        elif not self._take_token():
+            TYPING_SKIPPED.labels(reason="rate_limit").inc()
+            return
+        TYPING_SENT.labels(typing=str(typing).lower()).inc()
+        try:
+            await portal.set_typing(user, typing)
+        except Exception as e:
+            self.log.debug(f"Failed to send typing notification for {user.mxid}: {e}")
+
+    async def _refresh_loop(self) -> None:
+        try:
+            while self._active:
+                await asyncio.sleep(1)
+                now = time.monotonic()
+                refresh = []
+                for key, (portal, user, sent_at) in list(self._active.items()):
+                    if now - sent_at < self.refresh_interval:
+                        continue
+                    elif not user.client or not user.client.is_connected():
+                        del self._active[key]
+                        continue
+                    self._active[key] = (portal, user, now)
+                    refresh.append(self._send(portal, user, True))
+                await asyncio.gather(*refresh)
+        finally:
+            self._refresh_task = None
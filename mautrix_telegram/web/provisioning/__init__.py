@@ -407,7 +407,7 @@ class ProvisioningAPI(AuthAPI):
                         "title": chat.title,
                     }
                     for chat in (await user.get_cached_portals()).values()
-                    if chat.tgid
+                    if chat and chat.tgid
                 ]
             )
 